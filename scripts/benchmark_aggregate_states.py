@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Benchmark of a weekly refresh of user-item features from aggregate states vs a recompute"""
+
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+from src.recsys_retail.data.make_dataset import load_data
+from src.recsys_retail.data.lazy_dataset import scan_parquet_cache
+from src.recsys_retail.data.aggregate_states import (
+    AggregateStates,
+    StatefulTransactions,
+)
+from src.recsys_retail.features.prefilter import (
+    get_item_stats,
+    get_item_decisions,
+    apply_item_decisions,
+    get_item_mapping,
+    add_price,
+)
+from src.recsys_retail.features.new_item_user_features import get_user_item_features
+
+
+logger = logging.getLogger()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        "-d1",
+        "--data_path",
+        required=False,
+        default="data/01_raw/train.csv",
+        help="transactions dataset store path",
+    )
+    argparser.add_argument(
+        "-d2",
+        "--item_features_path",
+        required=False,
+        default="data/01_raw/item_features.csv",
+        help="item features dataset store path",
+    )
+    argparser.add_argument(
+        "-d3",
+        "--user_features_path",
+        required=False,
+        default="data/01_raw/user_features.csv",
+        help="user features dataset store path",
+    )
+    argparser.add_argument(
+        "-c",
+        "--cache_path",
+        required=False,
+        default="data/01_raw/cache",
+        help="Parquet cache folder of the raw datasets (created by the first run)",
+    )
+    args = argparser.parse_args()
+
+    data, item_features, _ = load_data(
+        args.data_path,
+        args.item_features_path,
+        args.user_features_path,
+        cache_path=args.cache_path,
+    )
+    lazy = scan_parquet_cache(args.cache_path)
+    last_week = int(data["week_no"].max())
+
+    # The states of the previous weeks are built by the run of the last week,
+    # then the new week is added with the item decisions of its run
+    decisions = {}
+    for week in [last_week - 1, last_week]:
+        item_stats = get_item_stats(data[data["week_no"] <= week])
+        decisions[week] = get_item_decisions(item_stats, item_features)
+    item_decisions = decisions[last_week]
+
+    results = {}
+    for name, transactions in [
+        ("Parquet cache", lazy),
+        ("in memory", data),
+    ]:
+        seconds, results[f"recompute ({name})"] = measure(
+            apply_item_decisions(transactions, item_decisions)
+        )
+        print(f"{'recompute (' + name + ')':<28} {seconds:6.2f} s")
+
+        states = AggregateStates()
+        for week in [last_week - 1, last_week]:
+            seconds, features = measure(
+                StatefulTransactions(
+                    select_weeks(transactions, week),
+                    states,
+                    item_ids=get_item_mapping(decisions[week]),
+                ).map_partitions(add_price)
+            )
+        results[f"refresh ({name})"] = features
+        n_rows = sum(
+            sum(
+                len(table)
+                for table in [stats] + list(counts.values())
+                if table is not None
+            )
+            for stats, counts in states.partials.values()
+        )
+        print(
+            f"{'refresh (' + name + ')':<28} {seconds:6.2f} s, "
+            f"{n_rows} rows of states for {len(data)} transactions"
+        )
+
+    expected = results["recompute (in memory)"]
+    for name, features in results.items():
+        for table, df in expected._asdict().items():
+            # Sums are added up week by week in a different order
+            pd.testing.assert_frame_equal(
+                features._asdict()[table].replace(np.inf, np.nan),
+                df.replace(np.inf, np.nan),
+                rtol=1e-5,
+            )
+    print("Outputs are equal")
+
+
+def measure(transactions):
+    start = time.perf_counter()
+    features = get_user_item_features(transactions)
+
+    return time.perf_counter() - start, features
+
+
+def select_weeks(transactions, last_week: int):
+    """Transactions of the weeks up to last_week"""
+
+    if isinstance(transactions, pd.DataFrame):
+        return transactions[transactions["week_no"] <= last_week]
+
+    return transactions.select(None, last_week + 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Benchmark of IVF index over ALS factors: recall@N and latency vs exact search"""
+
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+sys.path.append(os.path.join(os.getcwd(), "src", "recsys_retail"))
+
+import time
+import logging
+import argparse
+import numpy as np
+
+from src.recsys_retail.data.make_dataset import load_data
+from src.recsys_retail.features.prefilter import prefilter_items
+from src.recsys_retail.features.data_time_split import time_split_2
+from src.recsys_retail.features.recommenders import MainRecommender
+from src.recsys_retail.features.ann_index import IVFIndex
+
+
+logger = logging.getLogger()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        "-d1",
+        "--data_path",
+        required=False,
+        default="data/01_raw/train.csv",
+        help="transactions dataset store path",
+    )
+    argparser.add_argument(
+        "-d2",
+        "--item_features_path",
+        required=False,
+        default="data/01_raw/item_features.csv",
+        help="item features dataset store path",
+    )
+    argparser.add_argument(
+        "-d3",
+        "--user_features_path",
+        required=False,
+        default="data/01_raw/user_features.csv",
+        help="user features dataset store path",
+    )
+    argparser.add_argument(
+        "-N", "--n_neighbours", type=int, default=10, help="N in recall@N"
+    )
+    argparser.add_argument(
+        "-l", "--n_lists", type=int, default=None, help="the number of IVF lists"
+    )
+    argparser.add_argument(
+        "-p",
+        "--n_probe",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32],
+        help="the numbers of searched lists to benchmark",
+    )
+    argparser.add_argument(
+        "-v", "--verbose", help="increase output verbosity", action="store_true"
+    )
+    args = argparser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    logging.info("Reading data...")
+    data, item_features, user_features = load_data(
+        args.data_path, args.item_features_path, args.user_features_path
+    )
+    data_train, _ = time_split_2(prefilter_items(data, item_features))
+
+    logging.info("Training recommender...")
+    recommender = MainRecommender(data_train, n_factors_ALS=50)
+
+    for name, factors, similar in [
+        ("items", recommender.model.item_factors, recommender.model.similar_items),
+        ("users", recommender.model.user_factors, recommender.model.similar_users),
+    ]:
+        index = IVFIndex(factors, n_lists=args.n_lists)
+        print(f"\n{name}: {len(index)} vectors, {index.n_lists} lists")
+        for row in benchmark(index, factors, similar, args.n_neighbours, args.n_probe):
+            print("n_probe={:>4}  recall@{}={:.4f}  {:.1f} us/query".format(*row))
+
+
+def benchmark(index: IVFIndex, factors: np.ndarray, similar, N: int, n_probes):
+    """
+    Compares approximate search of all the vectors of the index with
+    the exact search (similar - similar_items / similar_users of the model).
+    Yields (n_probe, N, recall@N, microseconds per query); the first row
+    (n_probe=0) is the exact search.
+    """
+
+    queries = np.arange(len(factors))
+
+    start = time.perf_counter()
+    exact, _ = similar(queries, N=N)
+    exact_time = time.perf_counter() - start
+    yield 0, N, 1.0, 1e6 * exact_time / len(queries)
+
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        approximate, _ = index.search(factors, N=N, n_probe=n_probe)
+        search_time = time.perf_counter() - start
+
+        yield n_probe, N, recall_at_n(approximate, exact), 1e6 * search_time / len(
+            queries
+        )
+
+
+def recall_at_n(approximate: np.ndarray, exact: np.ndarray) -> float:
+    """Share of the exact N nearest neighbours found by approximate search"""
+
+    found = (approximate[:, :, None] == exact[:, None, :]) & (exact[:, None, :] >= 0)
+
+    return found.any(axis=1).sum() / (exact >= 0).sum()
+
+
+if __name__ == "__main__":
+    main()
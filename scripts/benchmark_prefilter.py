@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Benchmark of prefilter_items against the previous step-by-step implementation"""
+
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+from src.recsys_retail.data.make_dataset import load_data
+from src.recsys_retail.features.prefilter import (
+    prefilter_items,
+    LOWER_PRICE_THRESHOLD,
+    UPPER_PRICE_THRESHOLD,
+    TAKE_N_POPULAR,
+)
+
+
+logger = logging.getLogger()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        "-d1",
+        "--data_path",
+        required=False,
+        default="data/01_raw/train.csv",
+        help="transactions dataset store path",
+    )
+    argparser.add_argument(
+        "-d2",
+        "--item_features_path",
+        required=False,
+        default="data/01_raw/item_features.csv",
+        help="item features dataset store path",
+    )
+    argparser.add_argument(
+        "-d3",
+        "--user_features_path",
+        required=False,
+        default="data/01_raw/user_features.csv",
+        help="user features dataset store path",
+    )
+    argparser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="the number of runs of each version"
+    )
+    args = argparser.parse_args()
+
+    data, item_features, _ = load_data(
+        args.data_path, args.item_features_path, args.user_features_path
+    )
+
+    results = {}
+    for name, prefilter in [
+        ("prefilter_items_legacy", prefilter_items_legacy),
+        ("prefilter_items", prefilter_items),
+    ]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = prefilter(data, item_features.copy())
+            timings.append(time.perf_counter() - start)
+        print(f"{name:<24} best of {args.repeat}: {min(timings):.3f} s")
+
+    pd.testing.assert_frame_equal(
+        results["prefilter_items"], results["prefilter_items_legacy"]
+    )
+    print("Outputs are identical")
+
+
+def prefilter_items_legacy(
+    data: pd.DataFrame,
+    item_features: pd.DataFrame,
+    lower_price_threshold: Optional[int] = None,
+    upper_price_threshold: Optional[int] = None,
+    take_n_popular: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    The previous implementation of prefilter_items: seven filtering passes
+    over the transactions.
+
+    1.Removes items that have not been sold for the last 12 months
+    2.Removes most popular items (they will be bought anyway).
+    3.Removes most unpopular items (nobody will buy them)
+    4.Removes items from the departments with a limited assortiment
+    5.Removes too cheap items (we will not earn on them)
+    6.Removes too expensive_items. They will be bought irrespective
+      of our recommendations.
+    7.Selects top N popular items
+    8.Introduces fake item_id = 999999. If user has bought an item which
+      is not from top-N, he bought an item 999999.
+    """
+
+    # 1.Remove items that have not been sold for the last 12 months
+    t = max(data["day"]) - 365
+    not_sold_in_12_month = list(
+        set(data[data["day"] < t]["item_id"].unique())
+        - set(data[data["day"] >= t]["item_id"].unique())
+    )
+    data = data[~data["item_id"].isin(not_sold_in_12_month)]
+
+    # 2.Remove most popular items (they will be bought anyway).
+    popularity = (
+        data.groupby("item_id")["user_id"].nunique() / data["user_id"].nunique()
+    ).reset_index()
+    popularity.rename(columns={"user_id": "share_unique_users"}, inplace=True)
+    top_popular = popularity[popularity["share_unique_users"] > 0.2].item_id.tolist()
+    data = data[~data["item_id"].isin(top_popular)]
+
+    # 3.Remove most unpopular items (nobody will buy them)
+    top_unpopular = popularity[popularity["share_unique_users"] < 0.02].item_id.tolist()
+    data = data[~data["item_id"].isin(top_unpopular)]
+
+    # 4.Remove items from the departments with a limited assortiment
+    if item_features is not None:
+        department_size = (
+            item_features.groupby("department")["item_id"]
+            .nunique()
+            .sort_values(ascending=False)
+        ).reset_index()
+        department_size.columns = ["department", "n_items"]
+
+        unpopular_departments = department_size[
+            department_size["n_items"] < 150
+        ].department.tolist()
+        items_in_unpopular_departments = (
+            item_features[item_features["department"].isin(unpopular_departments)]
+            .item_id.unique()
+            .tolist()
+        )
+        data = data[~data["item_id"].isin(items_in_unpopular_departments)]
+
+    # 5.Remove too cheap items (we will not earn on them)
+    data["price"] = data["sales_value"] / np.maximum(data["quantity"], 1)
+    if lower_price_threshold is None:
+        lower_price_threshold = LOWER_PRICE_THRESHOLD
+    cheap_items = (
+        data.loc[data["price"] < lower_price_threshold, "item_id"].unique().tolist()
+    )
+    data = data[~data["item_id"].isin(cheap_items)]
+
+    # 6.Remove too expensive_items.
+    # They will be bought irrespective of our recommendations.
+    if upper_price_threshold is None:
+        upper_price_threshold = UPPER_PRICE_THRESHOLD
+    expensive_items = (
+        data.loc[data["price"] > upper_price_threshold, "item_id"].unique().tolist()
+    )
+    data = data[~data["item_id"].isin(expensive_items)]
+
+    # 7.Select top N popular items
+    popularity = data.groupby("item_id")["quantity"].sum().reset_index()
+    popularity.rename(columns={"quantity": "n_sold"}, inplace=True)
+    if take_n_popular is None:
+        take_n_popular = TAKE_N_POPULAR
+    top = (
+        popularity.sort_values("n_sold", ascending=False)
+        .head(take_n_popular)
+        .item_id.tolist()
+    )
+
+    # Introduce fake item_id = 999999.
+    # If user has bought an item which is not from top-N, he bought an item 999999.
+    data.loc[~data["item_id"].isin(top), "item_id"] = 999999
+
+    return data
+
+
+if __name__ == "__main__":
+    main()
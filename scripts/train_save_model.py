@@ -14,7 +14,7 @@ import lightgbm as lgb
 from typing import Optional
 
 from src.recsys_retail.data.make_dataset import load_data
-from src.recsys_retail.data.validation import train_test_split
+from src.recsys_retail.data.validation import train_test_split, ID_COLUMNS
 from src.recsys_retail.models import train
 from src.recsys_retail.models.serialize import store
 
@@ -45,6 +45,26 @@ def main():
         default="data/01_raw/user_features.csv",
         help="user features dataset store path",
     )
+    argparser.add_argument(
+        "-c",
+        "--cache_path",
+        required=False,
+        default=None,
+        help="Parquet cache folder of the raw datasets (created by the first run)",
+    )
+    argparser.add_argument(
+        "-w",
+        "--n_workers",
+        required=False,
+        type=int,
+        default=None,
+        help="number of processes computing user-item feature families",
+    )
+    argparser.add_argument(
+        "--check_dtypes",
+        help="check that compact dtypes of features do not change AUC",
+        action="store_true",
+    )
     argparser.add_argument(
         "-o",
         "--output",
@@ -62,11 +82,18 @@ def main():
     logging.info("Reading data...")
 
     data, item_features, user_features = load_data(
-        args.data_path, args.item_features_path, args.user_features_path
+        args.data_path,
+        args.item_features_path,
+        args.user_features_path,
+        cache_path=args.cache_path,
     )
     logging.info("Preprocessing data...")
     train_dataset_lvl_2 = train.data_preprocessing_pipeline(
-        data, item_features, user_features
+        data,
+        item_features,
+        user_features,
+        n_workers=args.n_workers,
+        check_dtypes=args.check_dtypes,
     )
     logging.info("Training the model...")
     train_store(train_dataset_lvl_2, args.output)
@@ -77,7 +104,11 @@ def train_store(dataset: pd.DataFrame, filename: str):
     Trains and stores LightGBM model.
     """
 
-    X_train, X_valid, y_train, y_valid = train_test_split(dataset)
+    # The dataset is downcast by data_preprocessing_pipeline already; without
+    # the int64 ids lgb.Dataset takes float32 features without a float64 copy
+    X_train, X_valid, y_train, y_valid = train_test_split(
+        dataset.drop(columns=ID_COLUMNS)
+    )
     dtrain = lgb.Dataset(X_train, y_train)
     dvalid = lgb.Dataset(X_valid, y_valid)
 
@@ -19,6 +19,8 @@ from pydantic import BaseModel
 
 from src.recsys_retail.models.serialize import load
 from src.recsys_retail.models.inference_tools import preprocess
+from src.recsys_retail.models.artifact_registry import registry
+from src.recsys_retail.data.validation import ID_COLUMNS
 from src.recsys_retail.metrics import get_recommendations
 from src.recsys_retail.models.save_artifacts import save_to_YC_s3
 
@@ -38,10 +40,6 @@ N_RECOMMENDATIONS_IN_FILE = 100
 MODEL_OUTPUT_S3_BUCKET = "recsys-retail-model-output"
 
 
-class Model:
-    classifier = None
-
-
 class User(BaseModel):
     user_id: int
 
@@ -52,7 +50,21 @@ class Users(BaseModel):
 
 @app.on_event("startup")
 def load_model():
-    Model.classifier = load(MODEL)
+    registry.load(classifier=load(MODEL))
+
+
+@app.post("/reload")
+def reload_artifacts():
+    """
+    Loads the classifier and the latest published artifact set and swaps
+    them in together atomically
+    """
+    try:
+        registry.load(classifier=load(MODEL))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {"status": "Reloaded", "artifacts_version": registry.version}
 
 
 @app.get("/")
@@ -62,16 +74,17 @@ def read_healthcheck():
 
 @app.post("/predict")
 def predict(user_id: int, user: User):
-    if Model.classifier is None:
+    artifacts = registry.get()
+    if artifacts.classifier is None:
         raise HTTPException(status_code=503, detail="No model loaded")
     try:
         id_ = jsonable_encoder(user)["user_id"]
-        df, new_user = preprocess(id_)
+        df, new_user = preprocess(id_, artifacts=artifacts)
         if new_user:
             NEW_CLIENTS_COUNTER.inc()
             logging.info(f" The new user: {new_user}")
 
-        predictions = Model.classifier.predict(df)
+        predictions = artifacts.classifier.predict(df.drop(columns=ID_COLUMNS))
         results = get_recommendations(df, predictions)
         recs = results["recommendations"][0].tolist()
         recs_dict = {id_: recs}
@@ -106,17 +119,18 @@ def predict(user_id: int, user: User):
 
 @app.post("/predict_user_list")
 def predict_user_list(batch_id: int, users: Users):
-    if Model.classifier is None:
+    artifacts = registry.get()
+    if artifacts.classifier is None:
         raise HTTPException(status_code=503, detail="No model loaded")
     try:
         ids_ = jsonable_encoder(users)["user_ids"]
-        df, new_users = preprocess(ids_, user_list=True)
+        df, new_users = preprocess(ids_, user_list=True, artifacts=artifacts)
         if new_users:
             new_users_number = len(new_users)
             NEW_CLIENTS_COUNTER.inc(new_users_number)
             logging.info(f" {new_users_number} new users: {new_users}")
 
-        predictions = Model.classifier.predict(df)
+        predictions = artifacts.classifier.predict(df.drop(columns=ID_COLUMNS))
         results = get_recommendations(df, predictions).set_index("user_id")
         recs_ = results.loc[:, "recommendations"]
         recs_dict = {}
@@ -8,7 +8,8 @@ import logging
 import pandas as pd
 from fastapi.testclient import TestClient
 
-from .main import app, Model
+from .main import app
+from src.recsys_retail.models.artifact_registry import registry
 from src.recsys_retail.models.serialize import load
 from src.recsys_retail.data.make_dataset import load_data
 from src.recsys_retail.models.train import data_preprocessing_pipeline
@@ -35,7 +36,7 @@ def test_predict():
         data, item_features, user_features
     )
     train_store(train_dataset_lvl_2, "baseline_v1")
-    Model.classifier = load(MODEL)
+    registry.load(classifier=load(MODEL))
 
     user = {"user_id": 1340}
     response = client.post("/predict?user_id=1340", json=user)
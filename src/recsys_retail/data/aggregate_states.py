@@ -0,0 +1,566 @@
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from .lazy_dataset import (
+    Keys,
+    LazyTransactions,
+    PartialAggregates,
+    check_aggregations,
+    combine_aggregates,
+    partial_aggregate,
+)
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["AggregateStates", "StatefulTransactions", "join_week_partials"]
+
+WEEK = "week_no"
+ITEM = "item_id"
+COUNT = "count"
+
+# Aggregations of the states which are added up and subtracted; minima and
+# maxima are taken from the counts of distinct values instead
+ADDITIVE_AGGREGATIONS = ["size", "sum"]
+# Share of the rows of the states subtracted by the corrections of items
+# above which the rows of the same groups are added up
+MAX_SUBTRACTED_SHARE = 0.1
+
+# Partial results of aggregations (see PartialAggregates) as flat tables
+# with the keys in columns, so they are concatenated, selected by week and
+# corrected by item without rebuilding indexes; the number of rows of the
+# groups and the counts of distinct values are in COUNT column
+StatePartials = Tuple[Optional[pd.DataFrame], Dict[str, pd.DataFrame]]
+
+
+class AggregateStates:
+    """
+    Additive states of grouped aggregations of transactions by week.
+
+    For every aggregation requested through StatefulTransactions the partial
+    results of each week are kept (sizes, sums and the counts of distinct
+    values, see partial_aggregate). New weeks are added by aggregating their
+    transactions only, and the aggregations of a range of weeks, with the
+    ratios and means derived from them, are combined from the states
+    instead of the transactions.
+
+    key - identifies the transactions the states are calculated from;
+          states of other transactions are not valid
+    partials - partial results of the aggregations by name with week_no
+               and the keys of the aggregation in columns
+    weeks - the first and the last week_no of each aggregation
+    item_ids - item_ids of prefilter the partial results of each
+               aggregation are calculated with (see StatefulTransactions)
+    new_weeks - weeks with partial results which are not saved yet
+    """
+
+    def __init__(self, key: str = ""):
+        self.key = key
+        self.partials: Dict[str, StatePartials] = {}
+        self.weeks: Dict[str, Tuple[int, int]] = {}
+        self.item_ids: Dict[str, Optional[pd.Series]] = {}
+        self.new_weeks: Set[int] = set()
+
+    @property
+    def last_week(self) -> int:
+        return max([last for _, last in self.weeks.values()], default=0)
+
+    def week_partials(self, week: int) -> Dict[str, StatePartials]:
+        """Partial results of the week by aggregation name"""
+
+        return {
+            name: _select_weeks(partial, week, week)
+            for name, partial in self.partials.items()
+            if self.weeks[name][0] <= week <= self.weeks[name][1]
+        }
+
+    def drop(self, name: str):
+        """Drops the states of the aggregation to recalculate them"""
+
+        del self.partials[name], self.weeks[name]
+        self.item_ids.pop(name, None)
+
+
+def join_week_partials(
+    key: str,
+    week_partials: Dict[int, Dict[str, StatePartials]],
+    item_ids: Optional[Dict[str, Optional[pd.Series]]] = None,
+) -> AggregateStates:
+    """
+    States from the partial results of the weeks (see week_partials)
+    and the item_ids of the aggregations
+    """
+
+    states = AggregateStates(key)
+    parts: Dict[str, List[StatePartials]] = {}
+    for week in sorted(week_partials):
+        for name, partial in week_partials[week].items():
+            parts.setdefault(name, []).append(partial)
+            first, _ = states.weeks.get(name, (week, week))
+            states.weeks[name] = (first, week)
+    for name, partials in parts.items():
+        states.partials[name] = _concat_partials(partials)
+        states.item_ids[name] = (item_ids or {}).get(name)
+
+    return states
+
+
+class StatefulTransactions:
+    """
+    Transactions (DataFrame or lazy transactions) with grouped aggregations
+    served from AggregateStates: partial results are calculated for the
+    weeks of the transactions which are not in the states yet, the result
+    is combined from the states of the weeks of the transactions.
+
+    Transactions can be given before prefilter with item_ids - item_id
+    after prefilter indexed by item_id before it (see features.prefilter.
+    get_item_mapping): rows of items missing from item_ids are dropped and
+    the others are replaced before they are aggregated. The states are kept
+    by week and the keys of the aggregations only; when item_ids change,
+    the rows of the items with other item_ids are read from all the weeks
+    of the states, their partial results with the previous item_ids are
+    subtracted and the ones with the new item_ids are added, so new item
+    decisions cost the transactions of the changed items only.
+
+    Functions mapped with map_partitions are applied to the weeks being
+    aggregated only and get their own states (by the function name), so
+    they should not depend on anything but the transactions of the row
+    (e.g. add columns).
+    """
+
+    stateful = True
+
+    def __init__(
+        self,
+        data: Union[pd.DataFrame, LazyTransactions],
+        states: AggregateStates,
+        prefix: str = "",
+        item_ids: Optional[pd.Series] = None,
+        functions: Tuple[Tuple[Callable[..., pd.DataFrame], tuple], ...] = (),
+    ):
+        self.data = data
+        self.states = states
+        self.prefix = prefix
+        self.item_ids = item_ids
+        self.functions = functions
+        self._weeks: Optional[np.ndarray] = None
+
+    @property
+    def weeks(self) -> np.ndarray:
+        if self._weeks is None:
+            if isinstance(self.data, pd.DataFrame):
+                self._weeks = np.unique(self.data[WEEK].to_numpy())
+            else:
+                self._weeks = self.data.weeks
+
+        return self._weeks
+
+    @property
+    def columns(self) -> pd.Index:
+        data = self.data
+        if isinstance(data, pd.DataFrame):
+            return self._map(data.iloc[:0]).columns
+
+        for function, args in self.functions:
+            data = data.map_partitions(function, *args)
+
+        return data.columns
+
+    def partitions(self) -> Iterator[pd.DataFrame]:
+        for data in _partitions(self.data):
+            data = self._map(data)
+            if self.item_ids is not None:
+                data = _replace_items(data, self.item_ids)
+            yield data
+
+    def select(self, start_week=None, stop_week=None) -> "StatefulTransactions":
+        return StatefulTransactions(
+            _select(self.data, start_week, stop_week),
+            self.states,
+            self.prefix,
+            self.item_ids,
+            self.functions,
+        )
+
+    def map_partitions(
+        self, function: Callable[..., pd.DataFrame], *args
+    ) -> "StatefulTransactions":
+        return StatefulTransactions(
+            self.data,
+            self.states,
+            self.prefix + function.__name__ + "/",
+            self.item_ids,
+            self.functions + ((function, args),),
+        )
+
+    def aggregate(self, keys, **aggregations: Tuple[str, str]) -> pd.DataFrame:
+        """
+        Named aggregations of the groups as DataFrame.groupby(keys).agg(...)
+        combined from the states of the weeks of the transactions.
+        """
+
+        return self.aggregate_batch([(keys, aggregations)])[0]
+
+    def aggregate_batch(
+        self, requests: List[Tuple[Keys, Dict[str, Tuple[str, str]]]]
+    ) -> List[pd.DataFrame]:
+        """
+        Aggregations of the requests (keys and named aggregations as of
+        aggregate); the weeks missing from the states of any of them
+        are read in one pass, the rows of the items with new item_ids
+        in one more pass.
+        """
+
+        key_lists = [
+            [keys] if isinstance(keys, str) else list(keys) for keys, _ in requests
+        ]
+        for _, aggregations in requests:
+            check_aggregations(aggregations)
+        week_keys = [list(dict.fromkeys([WEEK] + keys)) for keys in key_lists]
+        state_aggregations = [
+            _state_aggregations(aggregations) for _, aggregations in requests
+        ]
+
+        weeks = self.weeks
+        if len(weeks) == 0:
+            raise ValueError("No transactions to aggregate")
+        first, last = int(weeks[0]), int(weeks[-1])
+
+        states = self.states
+        names = [
+            self.prefix + state_name(keys, aggregations)
+            for keys, (_, aggregations) in zip(key_lists, requests)
+        ]
+        corrected: Dict[int, pd.Index] = {}
+        for i, name in enumerate(names):
+            if name not in states.weeks or name in names[:i]:
+                continue
+            state_first, state_last = states.weeks[name]
+            item_ids = states.item_ids.get(name)
+            if first < state_first:
+                logging.info(f"Recalculating states of {name} from week {first}...")
+                states.drop(name)
+            elif _same_items(item_ids, self.item_ids):
+                continue
+            elif item_ids is None or self.item_ids is None or last < state_last:
+                logging.info(f"Recalculating states of {name} for new item_ids...")
+                states.drop(name)
+            else:
+                corrected[i] = _changed_items(item_ids, self.item_ids)
+
+        if corrected:
+            self._correct_items(corrected, names, week_keys, state_aggregations)
+
+        starts = [
+            states.weeks[name][1] + 1 if name in states.weeks else first
+            for name in names
+        ]
+        new = [i for i, start in enumerate(starts) if start <= last]
+        if new:
+            start = min(starts[i] for i in new)
+            new_partials: Dict[int, List[StatePartials]] = {i: [] for i in new}
+            for data in _partitions(_select(self.data, start, last + 1)):
+                data = self._map(data)
+                if self.item_ids is not None:
+                    data = _replace_items(data, self.item_ids)
+                for i in new:
+                    new_data = data
+                    if starts[i] > start:
+                        new_data = data[(data[WEEK] >= starts[i]).to_numpy()]
+                    new_partials[i].append(
+                        _flatten(
+                            partial_aggregate(
+                                new_data, week_keys[i], state_aggregations[i]
+                            )
+                        )
+                    )
+            for i in new:
+                name = names[i]
+                if name in states.partials:
+                    new_partials[i].insert(0, states.partials[name])
+                states.partials[name] = _concat_partials(new_partials[i])
+                states.weeks[name] = (states.weeks.get(name, (first, last))[0], last)
+                states.item_ids[name] = self.item_ids
+            states.new_weeks.update(int(week) for week in weeks[weeks >= start])
+
+        results = []
+        for name, keys, (_, aggregations) in zip(names, key_lists, requests):
+            partial = _select_weeks(states.partials[name], first, last)
+            results.append(
+                combine_aggregates(
+                    [_reduce(partial, keys, aggregations)], keys, aggregations
+                )
+            )
+
+        return results
+
+    def _correct_items(
+        self,
+        changed_items: Dict[int, pd.Index],
+        names: List[str],
+        week_keys: List[List[str]],
+        state_aggregations: List[Dict[str, Tuple[str, str]]],
+    ):
+        """
+        Replaces the partial results of the changed items (by request) of
+        the states calculated with the previous item_ids by the ones with
+        the item_ids of the transactions
+        """
+
+        states = self.states
+        items = changed_items[next(iter(changed_items))]
+        for changed in changed_items.values():
+            items = items.union(changed)
+        start = min(states.weeks[names[i]][0] for i in changed_items)
+        stop = max(states.weeks[names[i]][1] for i in changed_items) + 1
+        logging.info(f"Correcting aggregate states of {len(items)} items...")
+
+        # The rows of the changed items are few, they are read in one pass
+        # and aggregated at once
+        data = pd.concat(
+            [
+                self._map(data[data[ITEM].isin(items).to_numpy()])
+                for data in _partitions(_select(self.data, start, stop))
+            ],
+            ignore_index=True,
+        )
+        data_weeks = data[WEEK].to_numpy()
+        for i, changed in changed_items.items():
+            name = names[i]
+            state_first, state_last = states.weeks[name]
+            rows = (data_weeks >= state_first) & (data_weeks <= state_last)
+            rows &= data[ITEM].isin(changed).to_numpy()
+            changed_data = data[rows]
+            partial = _concat_partials(
+                [states.partials[name]]
+                + [
+                    _flatten(
+                        partial_aggregate(
+                            _replace_items(changed_data, item_ids),
+                            week_keys[i],
+                            state_aggregations[i],
+                        ),
+                        sign,
+                    )
+                    for item_ids, sign in [
+                        (states.item_ids[name], -1),
+                        (self.item_ids, 1),
+                    ]
+                ]
+            )
+            states.new_weeks.update(int(week) for week in np.unique(data_weeks[rows]))
+            if _subtracted_share(partial) > MAX_SUBTRACTED_SHARE:
+                partial = _compact(partial, week_keys[i])
+                states.new_weeks.update(_weeks(partial))
+            states.partials[name] = partial
+            states.item_ids[name] = self.item_ids
+
+    def _map(self, data: pd.DataFrame) -> pd.DataFrame:
+        for function, args in self.functions:
+            data = function(data, *args)
+
+        return data
+
+
+def state_name(keys: List[str], aggregations: Dict[str, Tuple[str, str]]) -> str:
+    """Name of the states of an aggregation: its keys and a digest"""
+
+    digest = hashlib.md5(repr(sorted(aggregations.items())).encode()).hexdigest()
+
+    return "-".join(keys) + "_" + digest[:8]
+
+
+def _partitions(data: Union[pd.DataFrame, LazyTransactions]) -> Iterator[pd.DataFrame]:
+    if isinstance(data, pd.DataFrame):
+        yield data
+    else:
+        yield from data.partitions()
+
+
+def _select(
+    data: Union[pd.DataFrame, LazyTransactions], start_week=None, stop_week=None
+) -> Union[pd.DataFrame, LazyTransactions]:
+    if not isinstance(data, pd.DataFrame):
+        return data.select(start_week, stop_week)
+
+    weeks = data[WEEK]
+    rows = np.ones(len(data), dtype=bool)
+    if start_week is not None:
+        rows &= (weeks >= start_week).to_numpy()
+    if stop_week is not None:
+        rows &= (weeks < stop_week).to_numpy()
+
+    return data[rows]
+
+
+def _state_aggregations(
+    aggregations: Dict[str, Tuple[str, str]]
+) -> Dict[str, Tuple[str, str]]:
+    """
+    Aggregations of the partial results of the states: minima and maxima
+    are taken from the counts of distinct values, so that rows can be
+    subtracted, COUNT is the number of rows of the groups
+    """
+
+    state_aggregations = {
+        name: (column, "nunique" if func in ["min", "max"] else func)
+        for name, (column, func) in aggregations.items()
+    }
+    for column, func in aggregations.values():
+        if func in ADDITIVE_AGGREGATIONS:
+            state_aggregations[COUNT] = (column, "size")
+            break
+
+    return state_aggregations
+
+
+def _flatten(partial: PartialAggregates, sign: int = 1) -> StatePartials:
+    stats, value_counts = partial
+    if stats is not None and sign != 1:
+        stats = stats * sign
+
+    return (
+        None if stats is None else stats.reset_index(),
+        {
+            column: (counts * sign).reset_index(name=COUNT)
+            for column, counts in value_counts.items()
+        },
+    )
+
+
+def _reduce(
+    partial: StatePartials, keys: List[str], aggregations: Dict[str, Tuple[str, str]]
+) -> PartialAggregates:
+    """
+    Partial results of the groups by keys (see combine_aggregates); groups
+    and distinct values without rows (e.g. subtracted ones) are dropped
+    """
+
+    stats, value_counts = partial
+    level = keys if len(keys) > 1 else keys[0]
+
+    counts = {}
+    for column, table in value_counts.items():
+        column_counts = table.groupby(list(dict.fromkeys(keys + [column])))[COUNT].sum()
+        counts[column] = column_counts[column_counts.to_numpy() != 0]
+
+    columns = {}
+    if stats is not None:
+        additive = [
+            name
+            for name, (_, func) in aggregations.items()
+            if func in ADDITIVE_AGGREGATIONS
+        ]
+        sums = stats.groupby(keys)[additive + [COUNT]].sum()
+        sums = sums[sums[COUNT].to_numpy() != 0]
+        for name in additive:
+            columns[name] = sums[name]
+    for name, (column, func) in aggregations.items():
+        if func in ["min", "max"]:
+            values = counts[column].reset_index(column)[column]
+            columns[name] = values.groupby(level=level).agg(func)
+
+    return pd.DataFrame(columns) if columns else None, counts
+
+
+def _select_weeks(partial: StatePartials, first: int, last: int) -> StatePartials:
+    """Partial results of the weeks first <= week_no <= last"""
+
+    def select(table: pd.DataFrame) -> pd.DataFrame:
+        weeks = table[WEEK].to_numpy()
+        rows = (weeks >= first) & (weeks <= last)
+        return table if rows.all() else table[rows]
+
+    stats, value_counts = partial
+
+    return (
+        None if stats is None else select(stats),
+        {column: select(counts) for column, counts in value_counts.items()},
+    )
+
+
+def _same_items(item_ids: Optional[pd.Series], other: Optional[pd.Series]) -> bool:
+    if item_ids is None or other is None:
+        return item_ids is other
+
+    return item_ids is other or item_ids.equals(other)
+
+
+def _changed_items(item_ids: pd.Series, other: pd.Series) -> pd.Index:
+    """item_id before prefilter of the items replaced or dropped differently"""
+
+    items = item_ids.index.union(other.index)
+    same = item_ids.reindex(items).to_numpy() == other.reindex(items).to_numpy()
+
+    return items[~same]
+
+
+def _replace_items(table: pd.DataFrame, item_ids: pd.Series) -> pd.DataFrame:
+    """
+    Rows of table with item_id replaced by item_ids (item_id after
+    prefilter by item_id before it); rows of missing items are dropped
+    """
+
+    item_id = table[ITEM].to_numpy()
+    positions = item_ids.index.get_indexer(item_id)
+    rows = np.flatnonzero(positions >= 0)
+
+    table = table.take(rows)
+    table[ITEM] = item_ids.to_numpy()[positions[rows]].astype(item_id.dtype)
+
+    return table
+
+
+def _subtracted_share(partial: StatePartials) -> float:
+    stats, value_counts = partial
+    tables = list(value_counts.values()) + ([] if stats is None else [stats])
+    n_rows = sum(len(table) for table in tables)
+
+    return sum((table[COUNT] < 0).sum() for table in tables) / max(n_rows, 1)
+
+
+def _compact(partial: StatePartials, week_keys: List[str]) -> StatePartials:
+    """Partial results with the rows of the same groups added up"""
+
+    def add(table: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+        table = table.groupby(keys, as_index=False, sort=False).sum()
+        return table[(table[COUNT] != 0).to_numpy()].reset_index(drop=True)
+
+    stats, value_counts = partial
+
+    return (
+        None if stats is None else add(stats, week_keys),
+        {
+            column: add(counts, list(dict.fromkeys(week_keys + [column])))
+            for column, counts in value_counts.items()
+        },
+    )
+
+
+def _weeks(partial: StatePartials) -> Set[int]:
+    stats, value_counts = partial
+    tables = list(value_counts.values()) + ([] if stats is None else [stats])
+
+    return {int(week) for table in tables for week in np.unique(table[WEEK])}
+
+
+def _concat_partials(partials: List[StatePartials]) -> StatePartials:
+    """
+    Partial results as one: the ones of disjoint weeks or the corrections
+    of the same weeks (the subtracted results of the rows are negative)
+    """
+
+    stats = [stats for stats, _ in partials if stats is not None]
+
+    return (
+        pd.concat(stats, ignore_index=True) if stats else None,
+        {
+            column: pd.concat(
+                [value_counts[column] for _, value_counts in partials],
+                ignore_index=True,
+            )
+            for column in partials[0][1]
+        },
+    )
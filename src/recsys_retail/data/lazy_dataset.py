@@ -0,0 +1,319 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from .make_dataset import PARTITION_COL, TRANSACTIONS_SCHEMA, to_pandas
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["scan_parquet_cache", "LazyTransactions"]
+
+# Aggregations which are combined from the results of the parts of
+# transactions (the value is the combining function)
+PARTIAL_AGGREGATIONS = {"size": "sum", "sum": "sum", "min": "min", "max": "max"}
+# Aggregations calculated from the counts of distinct values of the groups
+VALUE_COUNT_AGGREGATIONS = ["nunique", "median"]
+
+# Keys of grouped aggregations: a column name or a list of them
+Keys = Union[str, List[str]]
+
+
+def scan_parquet_cache(cache_path: str) -> "LazyTransactions":
+    """
+    Transactions of the Parquet cache of load_data as LazyTransactions;
+    nothing is read until the partitions are iterated.
+    """
+
+    logging.info(f"Scanning transactions of Parquet cache {cache_path}...")
+
+    partitioning = ds.partitioning(
+        pa.schema([(PARTITION_COL, TRANSACTIONS_SCHEMA[PARTITION_COL])]),
+        flavor="hive",
+    )
+    dataset = ds.dataset(
+        os.path.join(cache_path, "transactions"),
+        format="parquet",
+        partitioning=partitioning,
+    )
+
+    return LazyTransactions(dataset)
+
+
+class LazyTransactions:
+    """
+    Out-of-core backend of the feature functions: transactions of a Parquet
+    dataset partitioned by week_no which are read one week at a time.
+
+    Functions of the partitions (map_partitions) are applied while reading,
+    aggregate combines grouped aggregations of the weeks, so memory is
+    bounded by a week of transactions and the size of the result instead
+    of the full history. get_item_stats, apply_item_decisions,
+    prefilter_items and get_user_item_features accept LazyTransactions
+    in place of a DataFrame.
+    """
+
+    def __init__(
+        self,
+        dataset: ds.Dataset,
+        weeks: Optional[np.ndarray] = None,
+        functions: Tuple[Tuple[Callable[..., pd.DataFrame], tuple], ...] = (),
+    ):
+        if weeks is None:
+            weeks = np.unique(
+                [
+                    ds.get_partition_keys(fragment.partition_expression)[PARTITION_COL]
+                    for fragment in dataset.get_fragments()
+                ]
+            )
+
+        self.dataset = dataset
+        self.weeks = weeks
+        self.functions = functions
+
+    stateful = False
+
+    def partitions(self) -> Iterator[pd.DataFrame]:
+        """Transactions of each week in week order"""
+
+        for week in self.weeks:
+            yield self._to_pandas(
+                self.dataset.to_table(filter=ds.field(PARTITION_COL) == int(week))
+            )
+
+    @property
+    def columns(self) -> pd.Index:
+        """Columns of the partitions (nothing is read)"""
+
+        return self._to_pandas(self.dataset.schema.empty_table()).columns
+
+    def _to_pandas(self, table: pa.Table) -> pd.DataFrame:
+        # Partition column is appended as the last one by the dataset;
+        # the layout of the raw transactions is restored
+        columns = [col for col in TRANSACTIONS_SCHEMA if col in table.column_names]
+        columns += [col for col in table.column_names if col not in columns]
+        data = to_pandas(table.select(columns))
+
+        for function, args in self.functions:
+            data = function(data, *args)
+
+        return data
+
+    def map_partitions(
+        self, function: Callable[..., pd.DataFrame], *args
+    ) -> "LazyTransactions":
+        """Transactions with function(partition, *args) applied to each week"""
+
+        return LazyTransactions(
+            self.dataset, self.weeks, self.functions + ((function, args),)
+        )
+
+    def select(self, start_week=None, stop_week=None) -> "LazyTransactions":
+        """Weeks start_week <= week_no < stop_week (other weeks are not read)"""
+
+        weeks = self.weeks
+        if start_week is not None:
+            weeks = weeks[weeks >= start_week]
+        if stop_week is not None:
+            weeks = weeks[weeks < stop_week]
+
+        return LazyTransactions(self.dataset, weeks, self.functions)
+
+    def collect(self) -> pd.DataFrame:
+        """All the transactions as one DataFrame"""
+
+        return pd.concat(list(self.partitions()), ignore_index=True)
+
+    def aggregate(self, keys, **aggregations: Tuple[str, str]) -> pd.DataFrame:
+        """
+        Named aggregations of the groups as DataFrame.groupby(keys).agg(...)
+        combined from partial results of the weeks (see partial_aggregate).
+        """
+
+        return self.aggregate_batch([(keys, aggregations)])[0]
+
+    def aggregate_batch(
+        self, requests: List[Tuple[Keys, Dict[str, Tuple[str, str]]]]
+    ) -> List[pd.DataFrame]:
+        """
+        Aggregations of the requests (keys and named aggregations as of
+        aggregate) in one pass over the partitions. Partial results of the
+        weeks are reduced into one as soon as they outgrow the reduced one,
+        so memory is bounded by a week of transactions and about twice
+        the size of the results.
+        """
+
+        key_lists = [_as_list(keys) for keys, _ in requests]
+        for _, aggregations in requests:
+            check_aggregations(aggregations)
+
+        pending: List[List[PartialAggregates]] = [[] for _ in requests]
+        for data in self.partitions():
+            for parts, keys, (_, aggregations) in zip(pending, key_lists, requests):
+                parts.append(partial_aggregate(data, keys, aggregations))
+                if len(parts) > 1 and _n_rows(parts[1:]) >= _n_rows(parts[:1]):
+                    parts[:] = [reduce_partials(parts, keys, aggregations)]
+            del data
+
+        results = []
+        for parts, keys, (_, aggregations) in zip(pending, key_lists, requests):
+            if not parts:
+                raise ValueError("No transactions to aggregate")
+            results.append(combine_aggregates(parts, keys, aggregations))
+
+        return results
+
+
+# Partial results of aggregations of a part of transactions: size, sum,
+# min and max of the groups and the counts of distinct (keys, value) rows
+# of the columns of nunique and median
+PartialAggregates = Tuple[Optional[pd.DataFrame], Dict[str, pd.Series]]
+
+
+def check_aggregations(aggregations: Dict[str, Tuple[str, str]]):
+    for column, func in aggregations.values():
+        if func not in PARTIAL_AGGREGATIONS and func not in VALUE_COUNT_AGGREGATIONS:
+            raise ValueError(f"Aggregation {func} is not supported")
+
+
+def partial_aggregate(
+    data: pd.DataFrame, keys: List[str], aggregations: Dict[str, Tuple[str, str]]
+) -> PartialAggregates:
+    """
+    Partial results of named aggregations of the groups of data which
+    are combined by combine_aggregates; keys may include more columns
+    than the ones of the combined result (e.g. week_no).
+    """
+
+    partial = {
+        name: (column, func)
+        for name, (column, func) in aggregations.items()
+        if func in PARTIAL_AGGREGATIONS
+    }
+    stats = data.groupby(keys).agg(**partial) if partial else None
+
+    value_counts = {}
+    for column, func in aggregations.values():
+        if func in VALUE_COUNT_AGGREGATIONS and column not in value_counts:
+            value_counts[column] = data.groupby(_unique(keys + [column])).size()
+
+    return stats, value_counts
+
+
+def reduce_partials(
+    partials: List[PartialAggregates],
+    keys: List[str],
+    aggregations: Dict[str, Tuple[str, str]],
+) -> PartialAggregates:
+    """
+    Partial results of the parts reduced to the groups by keys (the extra
+    keys of the parts, e.g. week_no, are dropped); the result is a partial
+    result itself which can be reduced with more parts.
+    """
+
+    if len(partials) == 1 and _is_reduced(partials[0], keys):
+        return partials[0]
+
+    level = keys if len(keys) > 1 else keys[0]
+
+    stats = None
+    partial_stats = [stats for stats, _ in partials if stats is not None]
+    if partial_stats:
+        stats = (
+            pd.concat(partial_stats)
+            .groupby(level=level)
+            .agg(
+                **{
+                    name: (name, PARTIAL_AGGREGATIONS[func])
+                    for name, (_, func) in aggregations.items()
+                    if func in PARTIAL_AGGREGATIONS
+                }
+            )
+        )
+
+    value_counts = {
+        column: pd.concat([value_counts[column] for _, value_counts in partials])
+        .groupby(level=_unique(keys + [column]))
+        .sum()
+        for column in partials[0][1]
+    }
+
+    return stats, value_counts
+
+
+def combine_aggregates(
+    partials: List[PartialAggregates],
+    keys: List[str],
+    aggregations: Dict[str, Tuple[str, str]],
+) -> pd.DataFrame:
+    """
+    Named aggregations of the groups by keys from partial results:
+    size, sum, min and max are combined from the ones of the parts,
+    nunique and median are calculated from the counts of distinct values.
+    """
+
+    level = keys if len(keys) > 1 else keys[0]
+    stats, counts = reduce_partials(partials, keys, aggregations)
+
+    results = {}
+    if stats is not None:
+        for name in stats.columns:
+            results[name] = stats[name]
+
+    for name, (column, func) in aggregations.items():
+        if func == "nunique":
+            results[name] = counts[column].groupby(level=level).size()
+        elif func == "median":
+            results[name] = _median_of_counts(counts[column], level, column)
+
+    return pd.DataFrame({name: results[name] for name in aggregations})
+
+
+def _is_reduced(partial: PartialAggregates, keys: List[str]) -> bool:
+    """Whether the groups of the partial results are the ones by keys"""
+
+    stats, value_counts = partial
+
+    return (stats is None or list(stats.index.names) == keys) and all(
+        list(counts.index.names) == _unique(keys + [column])
+        for column, counts in value_counts.items()
+    )
+
+
+def _n_rows(partials: List[PartialAggregates]) -> int:
+    return sum(
+        (0 if stats is None else len(stats))
+        + sum(len(counts) for counts in value_counts.values())
+        for stats, value_counts in partials
+    )
+
+
+def _as_list(keys: Keys) -> List[str]:
+    return [keys] if isinstance(keys, str) else list(keys)
+
+
+def _unique(columns: List[str]) -> List[str]:
+    return list(dict.fromkeys(columns))
+
+
+def _median_of_counts(counts: pd.Series, level, column: str) -> pd.Series:
+    """
+    Median of the column of each group from the counts of (keys, value)
+    sorted by keys and value; the mean of the two middle values is taken
+    for an even number of values as pandas does.
+    """
+
+    values = counts.index.get_level_values(column).to_numpy(dtype=np.float64)
+    n_values = counts.groupby(level=level).sum()
+    totals = n_values.to_numpy()
+
+    # Positions of the middle values in the sorted values of all the groups
+    cumulative = np.cumsum(counts.to_numpy())
+    offsets = np.cumsum(totals) - totals
+    lower = np.searchsorted(cumulative, offsets + (totals - 1) // 2, side="right")
+    upper = np.searchsorted(cumulative, offsets + totals // 2, side="right")
+
+    return pd.Series((values[lower] + values[upper]) / 2, index=n_values.index)
@@ -1,6 +1,16 @@
+import os
+import json
+import shutil
 import logging
+import tempfile
+import numpy as np
 import pandas as pd
-from typing import Optional
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -12,30 +22,249 @@ TRAIN_PATH = PATH + "train.csv"
 ITEM_FEATURES_PATH = PATH + "item_features.csv"
 USER_FEATURES_PATH = PATH + "user_features.csv"
 
+BLOCK_SIZE = 16 << 20
+PARTITION_COL = "week_no"
+# Sizes and modification times of the source files the cache is made of
+SOURCES_FILE = "sources.json"
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+# Column types of the raw files by lower-cased column name
+TRANSACTIONS_SCHEMA = {
+    "user_id": pa.int32(),
+    "basket_id": pa.int64(),
+    "day": pa.int16(),
+    "item_id": pa.int32(),
+    "quantity": pa.int32(),
+    "sales_value": pa.float32(),
+    "store_id": pa.int32(),
+    "retail_disc": pa.float32(),
+    "trans_time": pa.int16(),
+    "week_no": pa.int16(),
+    "coupon_disc": pa.float32(),
+    "coupon_match_disc": pa.float32(),
+}
+ITEM_FEATURES_SCHEMA = {
+    "product_id": pa.int32(),
+    "manufacturer": pa.int32(),
+    "department": CATEGORY,
+    "brand": CATEGORY,
+    "commodity_desc": CATEGORY,
+    "sub_commodity_desc": CATEGORY,
+    "curr_size_of_product": CATEGORY,
+}
+USER_FEATURES_SCHEMA = {
+    "age_desc": CATEGORY,
+    "marital_status_code": CATEGORY,
+    "income_desc": CATEGORY,
+    "homeowner_desc": CATEGORY,
+    "hh_comp_desc": CATEGORY,
+    "household_size_desc": CATEGORY,
+    "kid_category_desc": CATEGORY,
+    "household_key": pa.int32(),
+}
+
 
 def load_data(
     data_path: Optional[str] = None,
     item_path: Optional[str] = None,
     user_path: Optional[str] = None,
-) -> pd.DataFrame:
+    cache_path: Optional[str] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Loads transactions, item features and user features with typed schemas:
+    compact integer and float32 columns, categoricals for the text columns.
+    Transactions are sorted by week_no (rows of a week keep the file order).
+
+    cache_path - folder of the Parquet cache; if it does not exist yet or
+                 the csv files have changed since (size or modification
+                 time), the csv files are converted into it (transactions
+                 partitioned by week_no), later runs read the cache only.
+    """
 
     if data_path is None:
         data_path = TRAIN_PATH
-    logging.info(f"Reading dataset from {data_path}...")
-    data = pd.read_csv(data_path)
-
     if item_path is None:
         item_path = ITEM_FEATURES_PATH
-    logging.info(f"Reading item_features from {item_path}...")
-    item_features = pd.read_csv(item_path)
-    item_features.columns = map(str.lower, item_features.columns)
-    item_features.rename(columns={"product_id": "item_id"}, inplace=True)
-
     if user_path is None:
         user_path = USER_FEATURES_PATH
+    sources = get_sources([data_path, item_path, user_path])
+
+    if cache_path is not None and os.path.exists(cache_path):
+        if is_cache_valid(cache_path, sources):
+            logging.info(f"Reading datasets from Parquet cache {cache_path}...")
+            return read_parquet_cache(cache_path)
+        logging.info(f"Source files of Parquet cache {cache_path} have changed")
+
+    logging.info(f"Reading dataset from {data_path}...")
+    data = sort_by_week(read_csv_table(data_path, TRANSACTIONS_SCHEMA))
+
+    logging.info(f"Reading item_features from {item_path}...")
+    item_features = read_csv_table(item_path, ITEM_FEATURES_SCHEMA)
+
     logging.info(f"Reading user_features from {user_path}...")
-    user_features = pd.read_csv(user_path)
-    user_features.columns = map(str.lower, user_features.columns)
-    user_features.rename(columns={"household_key": "user_id"}, inplace=True)
+    user_features = read_csv_table(user_path, USER_FEATURES_SCHEMA)
+
+    if cache_path is not None:
+        logging.info(f"Saving datasets to Parquet cache {cache_path}...")
+        write_parquet_cache(cache_path, data, item_features, user_features, sources)
+
+    return (
+        to_pandas(data),
+        rename_item_features(to_pandas(item_features)),
+        rename_user_features(to_pandas(user_features)),
+    )
+
+
+def read_csv_table(path: str, schema: Dict[str, pa.DataType]) -> pa.Table:
+    """
+    Reads csv file block by block with pyarrow's streaming reader;
+    columns are converted to the types of the schema while reading.
+    Column names are lower-cased.
+    """
+
+    header = pd.read_csv(path, nrows=0).columns
+    column_types = {col: schema[col.lower()] for col in header if col.lower() in schema}
+    reader = pa_csv.open_csv(
+        path,
+        read_options=pa_csv.ReadOptions(block_size=BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types, strings_can_be_null=True
+        ),
+    )
+    table = pa.Table.from_batches(list(reader), schema=reader.schema)
+
+    # Batches have their own dictionaries of the categorical columns
+    table = table.unify_dictionaries()
+
+    return table.rename_columns([col.lower() for col in table.column_names])
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """Converts table into pd.DataFrame releasing its buffers on the way"""
+
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def rename_item_features(item_features: pd.DataFrame) -> pd.DataFrame:
+    return item_features.rename(columns={"product_id": "item_id"})
+
+
+def rename_user_features(user_features: pd.DataFrame) -> pd.DataFrame:
+    return user_features.rename(columns={"household_key": "user_id"})
+
+
+def sort_by_week(data: pa.Table) -> pa.Table:
+    """Transactions in week order, rows of each week keep their original order"""
+
+    weeks = data[PARTITION_COL].to_numpy()
+    if (np.diff(weeks) >= 0).all():
+        return data
+
+    return data.take(pc.sort_indices(data[PARTITION_COL]))
+
+
+def get_sources(paths: List[str]) -> Dict[str, List[int]]:
+    """Sizes and modification times of the existing source files by path"""
+
+    sources = {}
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            sources[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns]
+
+    return sources
+
+
+def is_cache_valid(cache_path: str, sources: Dict[str, List[int]]) -> bool:
+    """
+    Whether the cache was converted from the current versions of the source
+    files; source files which do not exist any more are not checked.
+    """
+
+    sources_path = os.path.join(cache_path, SOURCES_FILE)
+    if not os.path.exists(sources_path):
+        return not sources
+    with open(sources_path) as f:
+        cached_sources = json.load(f)
+
+    return all(cached_sources.get(path) == stat for path, stat in sources.items())
+
+
+def write_parquet_cache(
+    cache_path: str,
+    data: pa.Table,
+    item_features: pa.Table,
+    user_features: pa.Table,
+    sources: Optional[Dict[str, List[int]]] = None,
+):
+    """
+    Saves the tables into Parquet cache, transactions are partitioned by week;
+    sources (see get_sources) are saved with them.
+
+    The cache is written into a temporary folder next to cache_path which
+    replaces it when complete, so an interrupted run leaves no partial cache.
+    """
+
+    parent = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(
+        prefix=os.path.basename(os.path.abspath(cache_path)) + ".tmp-", dir=parent
+    )
+    try:
+        data = sort_by_week(data)
+        weeks = data[PARTITION_COL].to_numpy()
+        starts = np.flatnonzero(np.diff(weeks, prepend=weeks[:1] - 1))
+        stops = np.append(starts[1:], len(weeks))
+        for start, stop in zip(starts, stops):
+            folder = os.path.join(
+                tmp_path, "transactions", f"{PARTITION_COL}={weeks[start]}"
+            )
+            os.makedirs(folder, exist_ok=True)
+            pq.write_table(
+                data.slice(start, stop - start).drop([PARTITION_COL]),
+                os.path.join(folder, "part-0.parquet"),
+            )
+
+        pq.write_table(item_features, os.path.join(tmp_path, "item_features.parquet"))
+        pq.write_table(user_features, os.path.join(tmp_path, "user_features.parquet"))
+        with open(os.path.join(tmp_path, SOURCES_FILE), "w") as f:
+            json.dump(sources or {}, f)
+
+        if os.path.exists(cache_path):
+            shutil.rmtree(cache_path)
+        os.rename(tmp_path, cache_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def read_parquet_cache(
+    cache_path: str,
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Reads datasets saved by write_parquet_cache, transactions are in week order"""
+
+    partitioning = ds.partitioning(
+        pa.schema([(PARTITION_COL, TRANSACTIONS_SCHEMA[PARTITION_COL])]),
+        flavor="hive",
+    )
+    data = ds.dataset(
+        os.path.join(cache_path, "transactions"),
+        format="parquet",
+        partitioning=partitioning,
+    ).to_table()
+
+    # Partition column is appended as the last one and fragments come
+    # in the order of directory names; the original layout is restored
+    columns = [col for col in TRANSACTIONS_SCHEMA if col in data.column_names]
+    columns += [col for col in data.column_names if col not in columns]
+    data = data.select(columns).take(pc.sort_indices(data[PARTITION_COL]))
+
+    item_features = pq.read_table(os.path.join(cache_path, "item_features.parquet"))
+    user_features = pq.read_table(os.path.join(cache_path, "user_features.parquet"))
 
-    return data, item_features, user_features
+    return (
+        to_pandas(data),
+        rename_item_features(to_pandas(item_features)),
+        rename_user_features(to_pandas(user_features)),
+    )
@@ -1,8 +1,40 @@
+import logging
+import lightgbm as lgb
+import numpy as np
 import pandas as pd
+from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import train_test_split as sklean_train_test_split
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-__all__ = ["train_test_split"]
+logger = logging.getLogger(__name__)
+
+__all__ = ["train_test_split", "check_auc_unchanged", "ID_COLUMNS"]
+
+# Keys of the level 2 dataset which are not features of the model
+ID_COLUMNS = ["user_id", "item_id"]
+
+# Models of the check differ by the seed of bagging only; their AUC spread
+# is the run-to-run variance the compact dtypes are compared with
+CHECK_PARAMS: Dict[str, Any] = {
+    "objective": "binary",
+    "metric": "auc",
+    "learning_rate": 0.05,
+    "num_leaves": 31,
+    "bagging_fraction": 0.8,
+    "bagging_freq": 1,
+    "feature_fraction": 0.8,
+    "deterministic": True,
+    "force_row_wise": True,
+    "num_threads": 1,
+    "verbose": -1,
+}
+CHECK_BOOST_ROUNDS = 200
+CHECK_SEEDS = [12, 13, 14, 15, 16]
+CHECK_SPLIT_SEED = 16
+# Mean AUC with compact dtypes may differ by N_SIGMAS standard deviations
+# of the run-to-run AUC of the reference, but not less than MIN_AUC_TOLERANCE
+N_SIGMAS = 2
+MIN_AUC_TOLERANCE = 1e-4
 
 
 def train_test_split(
@@ -18,3 +50,64 @@ def train_test_split(
     )
 
     return X_train, X_valid, y_train, y_valid
+
+
+def check_auc_unchanged(
+    dataset: pd.DataFrame,
+    compact_dataset: pd.DataFrame,
+    params: Optional[dict] = None,
+    num_boost_round: Optional[int] = None,
+    seeds: Optional[List[int]] = None,
+    tolerance: Optional[float] = None,
+) -> Tuple[float, float]:
+    """
+    Checks that the compact dtypes of the level 2 dataset (see
+    features.dtypes.apply_dtype_schema) do not change the model quality.
+
+    LightGBM models are trained on both datasets (without ID_COLUMNS,
+    as the model of the level 2) with the same fixed split
+    and one model per seed in one thread, so the check is deterministic.
+    Mean validation AUC of the datasets must differ by no more than
+    tolerance; by default it is N_SIGMAS standard deviations of AUC of
+    the models of dataset over the seeds (run-to-run variance of training).
+
+    Returns mean AUC of dataset and compact_dataset, raises ValueError
+    otherwise.
+    """
+
+    if params is None:
+        params = CHECK_PARAMS
+    if num_boost_round is None:
+        num_boost_round = CHECK_BOOST_ROUNDS
+    if seeds is None:
+        seeds = CHECK_SEEDS
+
+    aucs = []
+    for df in (dataset, compact_dataset):
+        df = df.drop(columns=ID_COLUMNS, errors="ignore")
+        X_train, X_valid, y_train, y_valid = train_test_split(
+            df, random_state=CHECK_SPLIT_SEED
+        )
+        train_set = lgb.Dataset(X_train, y_train, free_raw_data=False)
+        df_aucs = []
+        for seed in seeds:
+            model = lgb.train(
+                {**params, "seed": seed}, train_set, num_boost_round=num_boost_round
+            )
+            df_aucs.append(roc_auc_score(y_valid, model.predict(X_valid)))
+        aucs.append(np.array(df_aucs))
+
+    if tolerance is None:
+        tolerance = max(N_SIGMAS * aucs[0].std(ddof=1), MIN_AUC_TOLERANCE)
+    auc, compact_auc = aucs[0].mean(), aucs[1].mean()
+
+    logging.info(
+        f"AUC {auc:.6f}, with compact dtypes {compact_auc:.6f}, "
+        f"tolerance {tolerance:.6f}"
+    )
+    if abs(auc - compact_auc) > tolerance:
+        raise ValueError(
+            f"Compact dtypes change AUC from {auc:.6f} to {compact_auc:.6f}"
+        )
+
+    return auc, compact_auc
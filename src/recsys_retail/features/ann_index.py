@@ -0,0 +1,186 @@
+import logging
+import numpy as np
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["IVFIndex"]
+
+N_PROBE = 8
+KMEANS_ITERATIONS = 10
+BATCH_SIZE = 1024
+
+
+class IVFIndex:
+    """
+    Inverted file (IVF) index for approximate nearest neighbours search
+    by cosine similarity, e.g. over ALS item_factors or user_factors.
+
+    Vectors are clustered with k-means into n_lists lists; a query is compared
+    only with the vectors of the n_probe lists with the closest centroids.
+    n_probe sets the trade-off between recall and latency: n_probe = n_lists
+    gives the exact result.
+
+    Input
+    -----
+    vectors: np.ndarray
+        vectors in the order of matrix ids (rows of item_factors / user_factors)
+    n_lists: int
+        the number of lists, sqrt(len(vectors)) by default
+    n_probe: int
+        the number of lists searched by default
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        n_lists: Optional[int] = None,
+        n_probe: int = N_PROBE,
+        iterations: int = KMEANS_ITERATIONS,
+        random_state: int = 0,
+    ):
+        logger.info("Building IVF index...")
+
+        vectors = self._normalize(np.asarray(vectors, dtype=np.float32))
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors)))
+        # An empty matrix gives an empty index without lists
+        n_lists = min(max(1, n_lists), len(vectors))
+        self.n_probe = n_probe
+
+        self.centroids, labels = self._kmeans(
+            vectors, n_lists, iterations, np.random.default_rng(random_state)
+        )
+
+        # Vectors are stored grouped by list, list i is the slice
+        # [list_offsets[i], list_offsets[i + 1]) of vectors and ids
+        self.ids = np.argsort(labels, kind="stable")
+        self.vectors = vectors[self.ids]
+        self.list_offsets = np.append(
+            0, np.cumsum(np.bincount(labels, minlength=n_lists))
+        )
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def freeze(self):
+        """Makes the index arrays read-only"""
+
+        for array in (self.centroids, self.ids, self.vectors, self.list_offsets):
+            array.flags.writeable = False
+
+    def search(
+        self,
+        queries: np.ndarray,
+        N: int = 10,
+        n_probe: Optional[int] = None,
+        batch_size: int = BATCH_SIZE,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds N nearest neighbours for a batch of queries
+
+        Returns two arrays of shape (len(queries), N): matrix ids sorted by
+        decreasing cosine similarity and the similarities; if fewer than N
+        vectors are found, the rest is filled with -1 and nan.
+        """
+
+        queries = self._normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if n_probe is None:
+            n_probe = self.n_probe
+        n_probe = max(1, min(n_probe, self.n_lists))
+
+        ids = np.full((len(queries), N), -1, dtype=np.int64)
+        scores = np.full((len(queries), N), np.nan, dtype=np.float32)
+        if len(self) == 0:
+            return ids, scores
+
+        for start in range(0, len(queries), batch_size):
+            batch = slice(start, start + batch_size)
+            ids[batch], scores[batch] = self._search_batch(queries[batch], N, n_probe)
+
+        return ids, scores
+
+    def _search_batch(self, queries, N, n_probe):
+        n_queries = len(queries)
+
+        # Lists with the closest centroids
+        centroid_scores = queries @ self.centroids.T
+        if n_probe < self.n_lists:
+            lists = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+        else:
+            lists = np.tile(np.arange(self.n_lists), (n_queries, 1))
+
+        # Candidates of each query are the vectors of its lists placed one
+        # after another in a row of (n_queries x max_candidates) matrix
+        # padded with -inf; scores are calculated list by list with one
+        # matrix product for all the queries probing the list
+        lengths = np.diff(self.list_offsets)[lists]
+        col_starts = np.cumsum(lengths, axis=1) - lengths
+        n_candidates = int(lengths.sum(axis=1).max()) if n_queries else 0
+        candidate_scores = np.full((n_queries, max(n_candidates, N)), -np.inf)
+        candidate_rows = np.zeros(candidate_scores.shape, dtype=np.int64)
+
+        probes = np.argsort(lists, axis=None, kind="stable")
+        probe_lists = lists.ravel()[probes]
+        bounds = np.searchsorted(probe_lists, np.arange(self.n_lists + 1))
+        for list_id in np.flatnonzero(np.diff(bounds)):
+            start, stop = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == stop:
+                continue
+            probe = probes[bounds[list_id] : bounds[list_id + 1]]
+            query_idx = probe // lists.shape[1]
+            cols = col_starts.ravel()[probe][:, None] + np.arange(stop - start)
+            candidate_scores[query_idx[:, None], cols] = (
+                queries[query_idx] @ self.vectors[start:stop].T
+            )
+            candidate_rows[query_idx[:, None], cols] = np.arange(start, stop)
+
+        # Top N of the candidates
+        if N < candidate_scores.shape[1]:
+            top = np.argpartition(-candidate_scores, N - 1, axis=1)[:, :N]
+        else:
+            top = np.tile(np.arange(N), (n_queries, 1))
+        top_scores = np.take_along_axis(candidate_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        found = np.isfinite(top_scores)
+        ids = np.where(found, self.ids[np.take_along_axis(candidate_rows, top, 1)], -1)
+        scores = np.where(found, top_scores, np.nan)
+
+        return ids, scores
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+
+        return vectors / norms
+
+    @staticmethod
+    def _kmeans(vectors, n_lists, iterations, rng):
+        """Spherical k-means, returns centroids and labels of the vectors"""
+
+        if n_lists == 0:
+            return vectors[:0], np.zeros(0, dtype=np.int64)
+
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+        labels = np.zeros(len(vectors), dtype=np.int64)
+        for _ in range(iterations):
+            labels = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, vectors)
+
+            # Empty lists keep their centroids
+            empty = np.bincount(labels, minlength=n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = IVFIndex._normalize(sums)
+
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+
+        return centroids, labels
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from collections import deque
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Protocol,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+__all__ = ["LazyFrame", "Transactions", "aggregate_in_one_pass"]
+
+T = TypeVar("T")
+# Keys and named aggregations of a grouped aggregation
+AggregationRequest = Tuple[Union[str, List[str]], Dict[str, Tuple[str, str]]]
+
+
+class LazyFrame(Protocol):
+    """
+    Out-of-core backend of the feature functions: transactions read
+    partition by partition in week order (data.lazy_dataset.LazyTransactions
+    streams Parquet partitions by week, data.aggregate_states.
+    StatefulTransactions combines aggregations from the states of the weeks).
+    pandas DataFrames are the default
+    backend; functions check which one they are given with
+    isinstance(data, pd.DataFrame).
+    """
+
+    weeks: np.ndarray
+    # Whether aggregations are served from the states of the weeks, so the
+    # transactions should be aggregated rather than passed over
+    stateful: bool
+
+    @property
+    def columns(self) -> pd.Index:
+        ...
+
+    def partitions(self) -> Iterator[pd.DataFrame]:
+        ...
+
+    def select(self, start_week=None, stop_week=None) -> "LazyFrame":
+        ...
+
+    def map_partitions(
+        self, function: Callable[..., pd.DataFrame], *args
+    ) -> "LazyFrame":
+        ...
+
+    def aggregate(self, keys, **aggregations) -> pd.DataFrame:
+        ...
+
+    def aggregate_batch(self, requests: List[AggregationRequest]) -> List[pd.DataFrame]:
+        ...
+
+
+Transactions = Union[pd.DataFrame, LazyFrame]
+
+
+def aggregate_in_one_pass(
+    data: LazyFrame, functions: List[Callable[[LazyFrame], T]]
+) -> List[T]:
+    """
+    Results of the functions of lazy transactions with all their grouped
+    aggregations calculated in one pass over the partitions: the functions
+    are called once to record the aggregations they request (answered
+    with empty results), then once more with the results of
+    data.aggregate_batch. The requests of a function should not depend
+    on the results.
+    """
+
+    recorder = _BatchedAggregations(data)
+    for function in functions:
+        function(recorder)
+
+    recorder.set_results(data.aggregate_batch(list(recorder.requests)))
+
+    return [function(recorder) for function in functions]
+
+
+class _BatchedAggregations:
+    """
+    Lazy transactions recording the aggregations requested from them until
+    the results are set, then serving the results in the order of requests.
+    """
+
+    def __init__(self, data: LazyFrame):
+        self.data = data
+        self.weeks = data.weeks
+        self.stateful = data.stateful
+        self.requests: Deque[AggregationRequest] = deque()
+        self.results: Deque[pd.DataFrame] = deque()
+        self.recording = True
+
+    def set_results(self, results: List[pd.DataFrame]):
+        self.results = deque(results)
+        self.recording = False
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.data.columns
+
+    def partitions(self) -> Iterator[pd.DataFrame]:
+        return self.data.partitions()
+
+    def select(self, start_week=None, stop_week=None) -> LazyFrame:
+        return self.data.select(start_week, stop_week)
+
+    def map_partitions(self, function: Callable[..., pd.DataFrame], *args) -> LazyFrame:
+        return self.data.map_partitions(function, *args)
+
+    def aggregate(self, keys, **aggregations) -> pd.DataFrame:
+        if self.recording:
+            self.requests.append((keys, aggregations))
+            return _empty_result(keys, aggregations)
+
+        if self.requests.popleft() != (keys, aggregations):
+            raise ValueError("Aggregations differ from the recorded ones")
+
+        return self.results.popleft()
+
+    def aggregate_batch(self, requests: List[AggregationRequest]) -> List[pd.DataFrame]:
+        return [self.aggregate(keys, **aggregations) for keys, aggregations in requests]
+
+
+def _empty_result(keys, aggregations: Dict[str, Tuple[str, str]]) -> pd.DataFrame:
+    """Result of the aggregations without groups"""
+
+    names = [keys] if isinstance(keys, str) else list(keys)
+    empty = [np.array([], dtype=np.int64)] * len(names)
+    index = (
+        pd.Index(empty[0], name=names[0])
+        if len(names) == 1
+        else pd.MultiIndex.from_arrays(empty, names=names)
+    )
+
+    return pd.DataFrame(
+        {name: np.array([], dtype=np.float64) for name in aggregations}, index=index
+    )
@@ -1,7 +1,8 @@
 import logging
 import numpy as np
 import pandas as pd
-from typing import Optional
+import pyarrow as pa
+from typing import Callable, Dict, Optional, Tuple
 from .recommenders import MainRecommender
 
 
@@ -11,6 +12,50 @@ __all__ = ["getting_candidates_for_level_2"]
 
 N_ITEMS = 100
 
+# Sources of candidates: the retrievers of current users and top purchases
+# of all dataset (new users and the completion of short lists)
+OWN_RECOMMENDER = "own_recommender"
+ALS = "als"
+SIMILAR_ITEMS = "similar_items"
+SIMILAR_USERS = "similar_users"
+TOP_POPULAR = "top_popular"
+
+Retriever = Callable[..., Tuple[np.ndarray, np.ndarray]]
+
+# Each retriever gets a batch of users and returns two arrays of shape
+# (len(user_ids), N): item ids and scores (NaN for top purchases completing
+# the lists)
+RETRIEVERS: Dict[str, Retriever] = {
+    OWN_RECOMMENDER: lambda recommender, user_ids, N, purchases: (
+        recommender.recommend_batch(
+            user_ids,
+            N=N,
+            model=recommender.own_recommender,
+            recent_purchases=purchases,
+        )
+    ),
+    ALS: lambda recommender, user_ids, N, purchases: (
+        recommender.recommend_batch(
+            user_ids, N=N, model=recommender.model, recent_purchases=purchases
+        )
+    ),
+    SIMILAR_ITEMS: lambda recommender, user_ids, N, purchases: (
+        recommender.similar_items_recommend_scores(user_ids, N=N)
+    ),
+    SIMILAR_USERS: lambda recommender, user_ids, N, purchases: (
+        recommender.similar_users_recommend_batch(user_ids, N=N)
+    ),
+}
+SOURCES = list(RETRIEVERS) + [TOP_POPULAR]
+
+# Shares of n_items taken from each retriever in the order of priority
+QUOTAS = {OWN_RECOMMENDER: 0.5, ALS: 0.3, SIMILAR_ITEMS: 0.1, SIMILAR_USERS: 0.1}
+
+# Scores and ranks of every retriever as level 2 features
+RETRIEVER_FEATURES = [
+    f"{source}_{feature}" for source in RETRIEVERS for feature in ("score", "rank")
+]
+
 
 def get_candidates(
     recommender,
@@ -18,39 +63,191 @@ def get_candidates(
     data_val_lvl_1: pd.DataFrame,
     data_val_lvl_2: Optional[pd.DataFrame] = None,
     n_items: Optional[int] = None,
+    quotas: Optional[Dict[str, float]] = None,
 ) -> pd.DataFrame:
 
     """
     Selects candidates for level 2 with n_items to be recommended
     for each of the candidate (e.g: top-100 items).
+
+    Candidates of current users are blended from the retrievers of quotas
+    (shares of n_items by retriever, see QUOTAS): each retriever recommends
+    n_items for all the users in one batch, items already taken from the
+    retrievers of higher priority are skipped, and the lists are completed
+    from the rest of the retrieved items in the order of priority and with
+    top purchases of all dataset. New users get top purchases only.
+
+    Returns the long table of candidates: user_id, item_id, rank (from 1),
+    score and source of the retriever the item is taken from (score is NaN
+    for top purchases) and RETRIEVER_FEATURES - score and rank of the item
+    in the list of each retriever (NaN if it is not there),
+    one row per user and item in the order of ranks.
+
+    Users from data_train_lvl_1 unknown to the recommender (e.g. at inference,
+    when data_train_lvl_1 is more recent than the recommender) get
+    recommendations calculated from their purchases in data_train_lvl_1.
     """
 
-    users_train = data_train_lvl_1["user_id"].unique()
-    users_valid = data_val_lvl_1["user_id"].unique().tolist()
+    users = data_val_lvl_1["user_id"].unique()
     if data_val_lvl_2 is not None:
-        users_test = data_val_lvl_2["user_id"].unique()
-        add_to_valid = list(set(users_test) - (set(users_valid)))
-        if add_to_valid:
-            users_valid += add_to_valid
-
-    current_users = list(set(users_valid) & set(users_train))
-    new_users = list(set(users_valid) - set(users_train))
+        users = pd.unique(np.concatenate([users, data_val_lvl_2["user_id"].unique()]))
+    current = np.flatnonzero(np.isin(users, data_train_lvl_1["user_id"].unique()))
 
     logging.info("Generating preference list for each user...")
 
     if n_items is None:
         n_items = N_ITEMS
+    if quotas is None:
+        quotas = QUOTAS
 
-    df = pd.DataFrame(users_valid, columns=["user_id"])
-    cond_1 = df["user_id"].isin(current_users)
-    df.loc[cond_1, "candidates"] = df.loc[cond_1, "user_id"].apply(
-        lambda x: recommender.get_own_recommendations(x, n_items)
+    retrieved = {}
+    for source in quotas:
+        item_ids, scores = RETRIEVERS[source](
+            recommender, users[current], n_items, data_train_lvl_1
+        )
+        # Top purchases completing the lists are added by blend_candidates
+        retrieved[source] = (
+            current.repeat(n_items),
+            item_ids.ravel(),
+            scores.ravel(),
+        )
+
+    top = np.asarray(recommender.overall_top_purchases[:n_items], dtype=np.int64)
+    retrieved[TOP_POPULAR] = (
+        np.arange(len(users)).repeat(len(top)),
+        np.tile(top, len(users)),
+        np.full(len(users) * len(top), np.nan, dtype=np.float32),
     )
-    if new_users:
-        cond_2 = df["user_id"].isin(new_users)
-        df.loc[cond_2, "candidates"] = df.loc[cond_2, "user_id"].apply(
-            lambda x: recommender.overall_top_purchases[:n_items]
+    quota_items = {
+        source: int(round(share * n_items)) for source, share in quotas.items()
+    }
+    columns = blend_candidates(retrieved, quota_items, n_items)
+    columns["user_id"] = users[columns.pop("row")]
+
+    return pa.table(
+        {
+            name: columns[name]
+            for name in ["user_id", "item_id", "rank", "score", "source"]
+            + RETRIEVER_FEATURES
+        }
+    ).to_pandas(split_blocks=True, self_destruct=True)
+
+
+def blend_candidates(
+    retrieved: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    quotas: Dict[str, int],
+    n_items: int,
+) -> Dict[str, np.ndarray]:
+    """
+    Blends the lists of the retrievers without per-user loops.
+
+    retrieved - rows of users (any integer codes), item ids and scores of
+                each source in the order of the lists; items with NaN scores
+                are skipped except for TOP_POPULAR
+    quotas - the number of items of each source taken first, the rest of
+             n_items is completed in the order of sources and ranks
+
+    Returns the columns of candidates ordered by row and rank: row, item_id,
+    rank, score, source (pyarrow dictionary of SOURCES) and RETRIEVER_FEATURES.
+    """
+
+    names = list(retrieved)
+    parts = []
+    for code, name in enumerate(names):
+        rows, item_ids, scores = retrieved[name]
+        # Ranks in the list of the source
+        ranks = (_positions(_group_starts(rows)) + 1).astype(np.float32)
+        keep = item_ids >= 0
+        if name != TOP_POPULAR:
+            keep &= ~np.isnan(scores)
+        parts.append(
+            (
+                rows[keep],
+                item_ids[keep],
+                scores[keep].astype(np.float32),
+                ranks[keep],
+                np.full(keep.sum(), code, dtype=np.int8),
+            )
         )
-    users_lvl_2 = df
+    rows, item_ids, scores, ranks, codes = (
+        np.concatenate(part) for part in zip(*parts)
+    )
+
+    # Pairs of users and items, their rows are ordered by source and rank
+    item_codes, item_uniques = pd.factorize(item_ids)
+    pairs = rows.astype(np.int64) * len(item_uniques) + item_codes
+    order = np.lexsort((ranks, codes, pairs))
+    sorted_pairs, sorted_codes = pairs[order], codes[order]
+    new_pair = _group_starts(sorted_pairs)
+    pair_idx = np.cumsum(new_pair) - 1
+
+    # Score and rank of each pair in every source (the first one if repeated)
+    columns = {}
+    first_in_source = _group_starts(sorted_pairs, sorted_codes)
+    for code, name in enumerate(names):
+        if name == TOP_POPULAR:
+            continue
+        mask = first_in_source & (sorted_codes == code)
+        for feature, values in (("score", scores), ("rank", ranks)):
+            column = np.full(new_pair.sum(), np.nan, dtype=np.float32)
+            column[pair_idx[mask]] = values[order][mask]
+            columns[f"{name}_{feature}"] = column
+    for name in RETRIEVERS:
+        if name not in retrieved:
+            for feature in ("score", "rank"):
+                columns[f"{name}_{feature}"] = np.full(
+                    new_pair.sum(), np.nan, dtype=np.float32
+                )
+
+    # Every pair is taken from the source of the highest priority
+    first = order[new_pair]
+    rows, item_ids, scores, ranks, codes = (
+        rows[first],
+        item_ids[first],
+        scores[first],
+        ranks[first],
+        codes[first],
+    )
+
+    # Positions within the source of the user decide the quotas
+    by_source = np.lexsort((ranks, codes, rows))
+    position = np.empty(len(rows), dtype=np.int64)
+    position[by_source] = _positions(_group_starts(rows[by_source], codes[by_source]))
+    limits = np.array([quotas.get(name, 0) for name in names])
+    in_quota = position < limits[codes]
+
+    by_user = np.lexsort((ranks, codes, ~in_quota, rows))
+    rank = _positions(_group_starts(rows[by_user])) + 1
+    selected = by_user[rank <= n_items]
+
+    source_codes = np.array([SOURCES.index(name) for name in names], dtype=np.int8)
+    return {
+        "row": rows[selected],
+        "item_id": item_ids[selected],
+        "rank": rank[rank <= n_items].astype(np.int16),
+        "score": scores[selected],
+        "source": pa.DictionaryArray.from_arrays(
+            source_codes[codes[selected]], SOURCES
+        ),
+        **{name: column[selected] for name, column in columns.items()},
+    }
+
+
+def _group_starts(*keys: np.ndarray) -> np.ndarray:
+    """Starts of the groups of equal keys in sorted arrays"""
+
+    start = np.zeros(len(keys[0]), dtype=bool)
+    start[:1] = True
+    for key in keys:
+        start[1:] |= key[1:] != key[:-1]
+
+    return start
+
+
+def _positions(group_start: np.ndarray) -> np.ndarray:
+    """Positions of the rows within the groups starting at group_start"""
+
+    starts = np.flatnonzero(group_start)
+    lengths = np.diff(np.r_[starts, len(group_start)])
 
-    return users_lvl_2
+    return np.arange(len(group_start)) - np.repeat(starts, lengths)
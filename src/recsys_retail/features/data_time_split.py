@@ -2,11 +2,14 @@ import os
 import logging
 import numpy as np
 import pandas as pd
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["splitting_data_2_levels"]
+__all__ = ["splitting_data_2_levels", "TimeSplitter"]
+
+VAL_LVL_1_SIZE_WEEKS = 6
+VAL_LVL_2_SIZE_WEEKS = 3
 
 
 def time_split(data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
@@ -23,17 +26,7 @@ def time_split(data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataF
 
     logging.info("Splitting data for 2 levels of train-validation...")
 
-    val_lvl_1_size_weeks = 6
-    val_lvl_2_size_weeks = 3
-
-    t0 = data["week_no"].max() - (val_lvl_1_size_weeks + val_lvl_2_size_weeks)
-    t1 = data["week_no"].max() - val_lvl_2_size_weeks
-
-    data_train_lvl_1 = data[data["week_no"] < t0]
-    data_val_lvl_1 = data[(data["week_no"] >= t0) & (data["week_no"] < t1)]
-    data_val_lvl_2 = data[data["week_no"] >= t1]
-
-    return data_train_lvl_1, data_val_lvl_1, data_val_lvl_2
+    return TimeSplitter(data).time_split()
 
 
 def time_split_2(data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
@@ -52,8 +45,124 @@ def time_split_2(data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
 
     logging.info("Splitting data for train-validation...")
 
-    validation_weeks = 6
-    data_train = data[data["week_no"] < data["week_no"].max() - validation_weeks]
-    data_valid = data[data["week_no"] >= data["week_no"].max() - validation_weeks]
+    return TimeSplitter(data).time_split_2()
+
+
+class TimeSplitter:
+    """
+    Time splits of transactions by week_no returned as zero-copy views.
+
+    Transactions are sorted by week_no once (stable sort; data already
+    sorted by week is not copied at all), so the rows of any range of
+    weeks are a contiguous slice found with np.searchsorted. Splits are
+    views of this frame: they should be copied before being modified
+    in place.
+    """
 
-    return data_train, data_valid
+    def __init__(self, data: pd.DataFrame):
+        weeks = data["week_no"].to_numpy()
+        if not data["week_no"].is_monotonic_increasing:
+            order = np.argsort(weeks, kind="stable")
+            data, weeks = data.take(order), weeks[order]
+
+        self.data = data
+        self.weeks = weeks
+
+    @property
+    def last_week(self):
+        return self.weeks[-1] if len(self.weeks) else 0
+
+    def select(self, start_week=None, stop_week=None) -> pd.DataFrame:
+        """Rows with start_week <= week_no < stop_week (a view)"""
+
+        start = 0 if start_week is None else np.searchsorted(self.weeks, start_week)
+        stop = (
+            len(self.weeks)
+            if stop_week is None
+            else np.searchsorted(self.weeks, stop_week)
+        )
+
+        return self.data.iloc[start:stop]
+
+    def time_split(
+        self,
+        val_lvl_1_size_weeks: Optional[int] = None,
+        val_lvl_2_size_weeks: Optional[int] = None,
+        last_week: Optional[int] = None,
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """
+        Train-validation-test split of time_split ending with last_week
+        (the last week of the data by default):
+        -- old purchases -- | -- val_lvl_1 weeks -- | -- val_lvl_2 weeks --
+        """
+
+        if val_lvl_1_size_weeks is None:
+            val_lvl_1_size_weeks = VAL_LVL_1_SIZE_WEEKS
+        if val_lvl_2_size_weeks is None:
+            val_lvl_2_size_weeks = VAL_LVL_2_SIZE_WEEKS
+        if last_week is None:
+            last_week = self.last_week
+
+        t0 = last_week - (val_lvl_1_size_weeks + val_lvl_2_size_weeks)
+        t1 = last_week - val_lvl_2_size_weeks
+
+        return (
+            self.select(stop_week=t0),
+            self.select(t0, t1),
+            self.select(t1, last_week + 1),
+        )
+
+    def time_split_2(
+        self,
+        validation_weeks: Optional[int] = None,
+        last_week: Optional[int] = None,
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Train-validation split of time_split_2 ending with last_week
+        (the last week of the data by default):
+        -- old purchases -- | -- validation weeks --
+        """
+
+        if validation_weeks is None:
+            validation_weeks = VAL_LVL_1_SIZE_WEEKS
+        if last_week is None:
+            last_week = self.last_week
+
+        t0 = last_week - validation_weeks
+
+        return self.select(stop_week=t0), self.select(t0, last_week + 1)
+
+    def rolling_time_splits(
+        self,
+        n_folds: int,
+        step_weeks: int = 1,
+        train_size_weeks: Optional[int] = None,
+        val_lvl_1_size_weeks: Optional[int] = None,
+        val_lvl_2_size_weeks: Optional[int] = None,
+    ) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+        """
+        Walk-forward folds (train, val_lvl_1, val_lvl_2) for backtesting.
+
+        Folds are generated in time order, each one is shifted by step_weeks,
+        the last fold is time_split of the full data. The train window is
+        expanding (all the older weeks) by default or rolling with
+        train_size_weeks weeks. All the splits are views, so many folds
+        fit in memory.
+        """
+
+        if val_lvl_1_size_weeks is None:
+            val_lvl_1_size_weeks = VAL_LVL_1_SIZE_WEEKS
+        if val_lvl_2_size_weeks is None:
+            val_lvl_2_size_weeks = VAL_LVL_2_SIZE_WEEKS
+
+        for fold in range(n_folds - 1, -1, -1):
+            last_week = self.last_week - fold * step_weeks
+            t0 = last_week - (val_lvl_1_size_weeks + val_lvl_2_size_weeks)
+            t1 = last_week - val_lvl_2_size_weeks
+            train_start = None if train_size_weeks is None else t0 - train_size_weeks
+
+            yield (
+                self.select(train_start, t0),
+                self.select(t0, t1),
+                self.select(t1, last_week + 1),
+            )
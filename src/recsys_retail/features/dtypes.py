@@ -0,0 +1,71 @@
+import logging
+import re
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["apply_dtype_schema"]
+
+# Compact dtypes of the feature tables and the level 2 dataset by column name:
+# the first pattern matching the whole name wins, None keeps the dtype.
+# Integer dtypes are used only if all the values fit them exactly
+# (no NaN or fractions, e.g. after a left join), otherwise float32.
+DTYPE_SCHEMA: List[Tuple[str, Optional[str]]] = [
+    (r"(user|item|store)_id|week_no|weekday|trans_time", None),
+    # Binary target and label / hashing encoders
+    (r"target|brand|manufacturer_\d+", "int8"),
+    # Counts of baskets, items, users, stores and weeks
+    (r"n_\w+", "int32"),
+    (r".*", "float32"),
+]
+
+
+def get_dtype(column: str, schema=None) -> Optional[str]:
+    """Dtype of the column declared by the schema (None to keep it)"""
+
+    if schema is None:
+        schema = DTYPE_SCHEMA
+
+    for pattern, dtype in schema:
+        if re.fullmatch(pattern, column):
+            return dtype
+
+    return None
+
+
+def apply_dtype_schema(df: pd.DataFrame, schema=None) -> pd.DataFrame:
+    """
+    Downcasts numeric columns of df to the compact dtypes of the schema
+    (DTYPE_SCHEMA by default); other columns and the index are kept.
+    """
+
+    dtypes = {}
+    for column in df.columns:
+        dtype = get_dtype(str(column), schema)
+        values = df[column]
+        if dtype is None or values.dtype.kind not in "iuf":
+            continue
+        if np.dtype(dtype).kind in "iu" and not _fits(values.to_numpy(), dtype):
+            dtype = "float32"
+        if values.dtype != dtype:
+            dtypes[column] = dtype
+
+    if not dtypes:
+        return df
+
+    return df.astype(dtypes)
+
+
+def _fits(values: np.ndarray, dtype: str) -> bool:
+    """Whether the values are represented by the integer dtype exactly"""
+
+    if values.dtype.kind == "f":
+        if not np.isfinite(values).all() or (values != np.round(values)).any():
+            return False
+    if len(values) == 0:
+        return True
+    info = np.iinfo(dtype)
+
+    return info.min <= values.min() and values.max() <= info.max
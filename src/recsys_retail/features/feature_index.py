@@ -0,0 +1,95 @@
+import logging
+import numpy as np
+import pandas as pd
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["UserItemFeatureIndex"]
+
+
+class UserItemFeatureIndex:
+    """
+    Serving-time index over user_item_features (or any other table with
+    user_id and item_id columns, e.g. transactions) keyed by user_id and
+    (user_id, item_id).
+
+    The table is sorted by (user_id, item_id) once, so the rows of a user
+    (and of a user-item pair) are a contiguous slice; slice boundaries are
+    found with np.searchsorted and the cost of a lookup is proportional
+    to the number of rows returned.
+    """
+
+    def __init__(self, user_item_features: pd.DataFrame):
+        logging.info("Indexing user-item features...")
+
+        self.features = user_item_features.sort_values(
+            ["user_id", "item_id"], kind="stable", ignore_index=True
+        )
+        user_ids = self.features["user_id"].to_numpy()
+        item_ids = self.features["item_id"].to_numpy()
+
+        # Unique ids and the first row of each user
+        self.user_ids, user_starts = np.unique(user_ids, return_index=True)
+        self.user_offsets = np.append(user_starts, len(user_ids))
+        self.item_ids = np.unique(item_ids)
+
+        # (user_id, item_id) encoded as one sorted int64 key
+        self._pair_keys = self._encode_pairs(user_ids, item_ids)[0]
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def get_users(self, user_ids) -> pd.DataFrame:
+        """Returns rows of user_item_features for the given users"""
+
+        user_ids = np.atleast_1d(np.asarray(user_ids))
+        if len(self.user_ids) == 0:
+            return self.features.iloc[:0]
+
+        pos = np.searchsorted(self.user_ids, user_ids).clip(max=len(self.user_ids) - 1)
+        pos = np.unique(pos[self.user_ids[pos] == user_ids])
+
+        return self._take(self.user_offsets[pos], self.user_offsets[pos + 1])
+
+    def get_pairs(self, user_ids, item_ids) -> pd.DataFrame:
+        """Returns rows of user_item_features for the given (user_id, item_id) pairs"""
+
+        keys, known = self._encode_pairs(
+            np.atleast_1d(np.asarray(user_ids)), np.atleast_1d(np.asarray(item_ids))
+        )
+        keys = np.unique(keys[known])
+        starts = np.searchsorted(self._pair_keys, keys, side="left")
+        stops = np.searchsorted(self._pair_keys, keys, side="right")
+
+        return self._take(starts, stops)
+
+    def _encode_pairs(self, user_ids, item_ids) -> Tuple[np.ndarray, np.ndarray]:
+        """Encodes pairs as user_position * n_items + item_position"""
+
+        n_users, n_items = len(self.user_ids), len(self.item_ids)
+        if n_users == 0 or n_items == 0:
+            return np.zeros(len(user_ids), dtype=np.int64), np.zeros(
+                len(user_ids), dtype=bool
+            )
+
+        user_pos = np.searchsorted(self.user_ids, user_ids).clip(max=n_users - 1)
+        item_pos = np.searchsorted(self.item_ids, item_ids).clip(max=n_items - 1)
+        known = (self.user_ids[user_pos] == user_ids) & (
+            self.item_ids[item_pos] == item_ids
+        )
+        keys = user_pos.astype(np.int64) * n_items + item_pos
+
+        return keys, known
+
+    def _take(self, starts: np.ndarray, stops: np.ndarray) -> pd.DataFrame:
+        """Gathers the rows of the slices [starts[i], stops[i])"""
+
+        if len(starts) == 1:
+            return self.features.iloc[starts[0] : stops[0]]
+
+        lengths = stops - starts
+        shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        rows = np.arange(lengths.sum()) + shifts
+
+        return self.features.take(rows)
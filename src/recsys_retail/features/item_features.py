@@ -5,6 +5,8 @@ import pandas as pd
 import category_encoders as ce
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.feature_extraction import text
+from sklearn.decomposition import TruncatedSVD
+from sklearn.pipeline import Pipeline
 from pickle import dump, load
 from typing import Optional
 
@@ -23,15 +25,22 @@ FEATURES_FOR_COUNT_ENCODER = [
 ]
 FEATURE_FOR_HASHING_ENCODER = "manufacturer"
 CONCAT_LIST = ["commodity_desc", "sub_commodity_desc"]
+N_DESCRIPTION_COMPONENTS = 32
+DESCRIPTION_SVD_SEED = 12
 
 
 def fit_transform_item_features(
     item_features: pd.DataFrame,
     count_cols=None,
     hashing_enc_col=None,
+    description_encoder: Optional[Pipeline] = None,
 ) -> pd.DataFrame:
     """
     Generates new item featurs for train dataset.
+
+    description_encoder - encoder of item descriptions (see
+                          fit_description_encoder), fitted on item_features
+                          if not given.
     """
     logging.info("Transforming item_features for train dataset...")
 
@@ -45,7 +54,9 @@ def fit_transform_item_features(
     logging.info("Encoding feature 'brand' ...")
 
     df1 = pd.DataFrame()
-    df1["brand"] = item_features["brand"].map({"Private": 0, "National": 1})
+    df1["brand"] = (
+        item_features["brand"].astype(object).map({"Private": 0, "National": 1})
+    )
 
     logging.info("Encoding item features with CountEncoder ...")
 
@@ -69,7 +80,7 @@ def fit_transform_item_features(
 
     logging.info("Encoding item descriptions...")
 
-    df4 = encode_item_descriptions(item_features)
+    df4 = encode_item_descriptions(item_features, encoder=description_encoder)
 
     item_features_transformed = pd.concat([df1, df2, df3, df4], axis=1)
 
@@ -79,21 +90,52 @@ def fit_transform_item_features(
 def encode_item_descriptions(
     item_features: pd.DataFrame,
     concat_list=None,
+    encoder: Optional[Pipeline] = None,
 ) -> pd.DataFrame:
     """
-    Encodes commodity and sub-commodity descriptions with TF-IDF vectorizer and applies
-    HashingEncoder to change the number od columns from 300 to 32.
+    Encodes commodity and sub-commodity descriptions to N_DESCRIPTION_COMPONENTS
+    columns item_desc_*: the sparse TF-IDF matrix of the descriptions is reduced
+    with TruncatedSVD without being densified.
+
+    encoder - fitted by fit_description_encoder (e.g. on the items of train
+              dataset to encode unseen items), it is fitted on item_features
+              if not given.
     """
 
-    if concat_list is None:
-        concat_list = CONCAT_LIST
+    if encoder is None:
+        encoder = fit_description_encoder(item_features, concat_list)
+
+    embedding = encoder.transform(get_item_descriptions(item_features, concat_list))
+
+    # Vocabularies smaller than N_DESCRIPTION_COMPONENTS leave zero columns
+    item_desc_encoded = np.zeros(
+        (len(item_features), N_DESCRIPTION_COMPONENTS), dtype=np.float32
+    )
+    item_desc_encoded[:, : embedding.shape[1]] = embedding
+
+    return pd.DataFrame(
+        item_desc_encoded,
+        index=item_features.index,
+        columns=["item_desc" + "_" + str(i) for i in range(N_DESCRIPTION_COMPONENTS)],
+    )
+
+
+def fit_description_encoder(
+    item_features: pd.DataFrame,
+    concat_list=None,
+) -> Pipeline:
+    """
+    Fits the encoder of item descriptions: TF-IDF vectorizer of words and
+    bigrams (words of product sizes are stop words) and TruncatedSVD
+    to N_DESCRIPTION_COMPONENTS.
+    """
 
     vectorizer = TfidfVectorizer(
         analyzer="word",
         lowercase=True,
         max_features=300,
     )
-    X = vectorizer.fit_transform(item_features["curr_size_of_product"])
+    vectorizer.fit(item_features["curr_size_of_product"])
     size_of_product_stop_words = set(vectorizer.get_feature_names_out())
     my_stop_words = list(set(text.ENGLISH_STOP_WORDS).union(size_of_product_stop_words))
 
@@ -104,18 +146,27 @@ def encode_item_descriptions(
         max_features=300,
         stop_words=my_stop_words,
     )
-    df = pd.DataFrame()
-    df["item_desc"] = item_features.loc[:, concat_list].apply(
-        lambda x: " ".join(x).replace("/", " ").replace("-", " "), axis=1
+    X = vectorizer.fit_transform(get_item_descriptions(item_features, concat_list))
+
+    svd = TruncatedSVD(
+        n_components=min(N_DESCRIPTION_COMPONENTS, *X.shape),
+        random_state=DESCRIPTION_SVD_SEED,
     )
-    X = vectorizer.fit_transform(df["item_desc"])
-    df_desc = X.toarray()
-    df_desc = pd.DataFrame(df_desc, index=item_features.index)
+    svd.fit(X)
+
+    return Pipeline([("tfidf", vectorizer), ("svd", svd)])
+
 
-    hashing_encoder = ce.HashingEncoder(cols=df_desc.columns, n_components=32)
-    item_desc_encoded = hashing_encoder.fit_transform(df_desc)
-    item_desc_encoded.columns = [
-        "item_desc" + "_" + str(i) for i in range(item_desc_encoded.shape[1])
-    ]
+def get_item_descriptions(item_features: pd.DataFrame, concat_list=None) -> pd.Series:
+    """Commodity and sub-commodity descriptions of the items joined in one text"""
 
-    return item_desc_encoded
+    if concat_list is None:
+        concat_list = CONCAT_LIST
+
+    descriptions = item_features[concat_list[0]].str.cat(
+        item_features[concat_list[1:]], sep=" "
+    )
+
+    return descriptions.str.replace("/", " ", regex=False).str.replace(
+        "-", " ", regex=False
+    )
@@ -1,563 +1,884 @@
+import os
+import time
 import logging
+import tempfile
+import multiprocessing
 import numpy as np
 import pandas as pd
-from typing import Optional, Tuple
+import pyarrow as pa
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from .recommenders import IdMapping
+from .backend import LazyFrame, Transactions, aggregate_in_one_pass
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["generate_user_item_features"]
+__all__ = ["generate_user_item_features", "UserItemFeatures"]
 
+# Group codes of the transactions and features of the groups
+# (row i of the features is the group with code i); lazy transactions
+# have no codes, their rows are looked up in the index of the features
+GroupFeatures = Tuple[Optional[np.ndarray], pd.DataFrame]
+
+# Tables of the single keys, features averaged over user-item pairs
+# and the time of computation (seconds) of a feature family
+FamilyFeatures = Tuple[Dict[str, pd.DataFrame], List[Tuple[str, np.ndarray]], float]
+
+N_WORKERS = 1
+PAIR_CODE = "pair_code"
 
-def get_user_item_features(
-    recommender,
-    data_train_lvl_1: pd.DataFrame,
-) -> pd.DataFrame:
 
+class Embeddings(NamedTuple):
+    """
+    ALS item and user factors as float32 matrices; row i of the factors
+    is matrix id i of the mapping.
+    """
+
+    item_mapping: IdMapping
+    item_factors: np.ndarray
+    user_mapping: IdMapping
+    user_factors: np.ndarray
+
+
+class UserItemFeatures(NamedTuple):
+    """
+    Feature store tables generated from transactions: user_items has one
+    row per (user_id, item_id), the other tables one row per user, item,
+    store, week number, weekday and transaction time.
     """
-    Generates new features from transactions matrix, users and items
-    embeddings taken from recommender.
 
+    user_items: pd.DataFrame
+    users: pd.DataFrame
+    items: pd.DataFrame
+    stores: pd.DataFrame
+    weeks: pd.DataFrame
+    weekdays: pd.DataFrame
+    trans_times: pd.DataFrame
+
+
+# Tables of UserItemFeatures with the features of a single key
+KEY_TABLES = {
+    "user_id": "users",
+    "item_id": "items",
+    "store_id": "stores",
+    "week_no": "weeks",
+    "weekday": "weekdays",
+    "trans_time": "trans_times",
+}
+# Transaction columns which are not averaged for user_items
+IGNORE_LIST = [
+    "basket_id",
+    "day",
+    "quantity",
+    "store_id",
+    "trans_time",
+    "week_no",
+    "hour",
+    "weekday",
+]
+
+
+def get_user_item_features(
+    data_train_lvl_1: Transactions,
+    n_workers: Optional[int] = None,
+) -> UserItemFeatures:
+
+    """
+    Generates new features from transactions matrix.
+
+    Features of a single key (user, item, store, week, weekday,
+    transaction time) go to the table of the key. Features of stores,
+    weeks, weekdays and transaction times are also averaged over the
+    transactions of each user-item pair in user_items together with
+    the rest of the features and the transaction values; features of
+    users and items are kept in their tables only.
+
+    n_workers - the number of processes computing the feature families
+                (encode_users, encode_items, ...) concurrently; the
+                transactions are shared with them through a memory-mapped
+                Arrow file. With 1 worker the families are computed
+                one by one in the current process.
+
+    Lazy transactions (e.g. LazyTransactions of the Parquet cache) are
+    processed out-of-core, the families are computed one by one.
     """
 
     logging.info("Generating new user-item features...")
 
-    X = data_train_lvl_1.copy()
+    if not isinstance(data_train_lvl_1, pd.DataFrame):
+        return _get_lazy_user_item_features(data_train_lvl_1)
+
+    if n_workers is None:
+        n_workers = N_WORKERS
+
+    X = _add_time_columns(data_train_lvl_1)
+
+    grouped = X.groupby(["user_id", "item_id"])
+    pair_codes = grouped.ngroup().to_numpy()
+    pairs = grouped.size()
+    n_transactions = pairs.to_numpy()
+    del grouped
+
+    columns = {
+        "user_id": pairs.index.get_level_values("user_id").to_numpy(),
+        "item_id": pairs.index.get_level_values("item_id").to_numpy(),
+    }
+    for name in X.columns:
+        if name not in columns and name not in IGNORE_LIST:
+            values = X[name].to_numpy()
+            columns[name] = _mean_by_group(pair_codes, values, n_transactions)
+
+    if n_workers > 1:
+        results = _encode_families_in_pool(X, pair_codes, n_workers)
+    else:
+        results = [_encode_family(encode, X, pair_codes) for encode in ENCODERS]
+
+    tables = {}
+    for encode, (family_tables, family_columns, seconds) in zip(ENCODERS, results):
+        logging.info(f"{encode.__name__} took {seconds:.2f} s")
+        tables.update(family_tables)
+        for name, values in family_columns:
+            _add_column(columns, name, values)
+
+    return UserItemFeatures(user_items=pd.DataFrame(columns), **tables)
+
+
+def _encode_family(
+    encode: Callable[[pd.DataFrame], List[GroupFeatures]],
+    data: pd.DataFrame,
+    pair_codes: np.ndarray,
+) -> FamilyFeatures:
+    """
+    Computes one feature family: tables of the single keys and the features
+    averaged over user-item pairs (pair_codes - pair codes of the rows).
+    """
+
+    start = time.perf_counter()
+    n_transactions = np.bincount(pair_codes)
+
+    tables, pair_features = _split_family(encode(data))
+    columns = []
+    for codes, df in pair_features:
+        for name in df.columns:
+            values = df[name].to_numpy()[codes]
+            columns.append((name, _mean_by_group(pair_codes, values, n_transactions)))
+
+    return tables, columns, time.perf_counter() - start
+
+
+def _split_family(
+    features: List[GroupFeatures],
+) -> Tuple[Dict[str, pd.DataFrame], List[GroupFeatures]]:
+    """Tables of the single keys and the features to average over pairs"""
+
+    tables = {}
+    pair_features = []
+    for codes, df in features:
+        keys = df.index.names
+        if len(keys) == 1 and keys[0] in KEY_TABLES:
+            tables[KEY_TABLES[keys[0]]] = df.reset_index()
+
+            # Features of users and items are constant for a pair
+            if keys[0] in ["user_id", "item_id"]:
+                continue
+        pair_features.append((codes, df))
+
+    return tables, pair_features
+
+
+def _get_lazy_user_item_features(data: LazyFrame) -> UserItemFeatures:
+    """
+    get_user_item_features of lazy transactions: the grouped aggregations
+    of all the families are calculated in one pass over the partitions
+    (see aggregate_in_one_pass), then one more pass sums the features
+    of the transactions (looked up by the keys) for each user-item pair.
+
+    Stateful transactions serve the aggregations from their states; the
+    sums still pass over the transactions, as the features of baskets
+    are looked up by the transaction.
+    """
+
+    X = data.map_partitions(_add_time_columns)
+
+    start = time.perf_counter()
+    *results, pairs = aggregate_in_one_pass(X, ENCODERS + [_count_pair_transactions])
+    logging.info(
+        f"Aggregating feature families took {time.perf_counter() - start:.2f} s"
+    )
+
+    tables = {}
+    pair_features = []
+    for family_tables, family_features in map(_split_family, results):
+        tables.update(family_tables)
+        pair_features += family_features
+
+    n_transactions = pairs["n_transactions"].to_numpy()
+
+    sums: Dict[str, np.ndarray] = {}
+    feature_sums = [
+        np.zeros((len(pairs), df.shape[1]), order="F") for _, df in pair_features
+    ]
+    for partition in X.partitions():
+        pair_codes = pairs.index.get_indexer(
+            pd.MultiIndex.from_frame(partition[["user_id", "item_id"]])
+        )
+        for name in partition.columns:
+            if name not in ["user_id", "item_id"] and name not in IGNORE_LIST:
+                values = partition[name].to_numpy()
+                sums[name] = sums.get(name, 0) + np.bincount(
+                    pair_codes, weights=values, minlength=len(pairs)
+                )
+        for (_, df), feature_sum in zip(pair_features, feature_sums):
+            keys = df.index.names
+            if len(keys) == 1:
+                codes = df.index.get_indexer(partition[keys[0]])
+            else:
+                codes = df.index.get_indexer(pd.MultiIndex.from_frame(partition[keys]))
+            for i, name in enumerate(df.columns):
+                values = df[name].to_numpy()[codes]
+                feature_sum[:, i] += np.bincount(
+                    pair_codes, weights=values, minlength=len(pairs)
+                )
+
+    columns = {
+        "user_id": pairs.index.get_level_values("user_id").to_numpy(),
+        "item_id": pairs.index.get_level_values("item_id").to_numpy(),
+    }
+    for name, values in sums.items():
+        columns[name] = values / n_transactions
+    for (_, df), feature_sum in zip(pair_features, feature_sums):
+        for i, name in enumerate(df.columns):
+            _add_column(columns, name, feature_sum[:, i] / n_transactions)
+
+    return UserItemFeatures(user_items=pd.DataFrame(columns), **tables)
+
+
+def _count_pair_transactions(data: LazyFrame) -> pd.DataFrame:
+    return data.aggregate(["user_id", "item_id"], n_transactions=("item_id", "size"))
+
+
+def _encode_families_in_pool(
+    data: pd.DataFrame, pair_codes: np.ndarray, n_workers: int
+) -> List[FamilyFeatures]:
+    """Computes the families of ENCODERS in a pool of n_workers processes"""
+
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    table = table.append_column(PAIR_CODE, pa.array(pair_codes))
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "transactions.arrow")
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        del table
+
+        with ProcessPoolExecutor(
+            max_workers=min(n_workers, len(ENCODERS)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            return list(executor.map(_encode_family_from_file, ENCODERS, repeat(path)))
+
+
+def _encode_family_from_file(
+    encode: Callable[[pd.DataFrame], List[GroupFeatures]], path: str
+) -> FamilyFeatures:
+    """Worker of _encode_families_in_pool: transactions are memory-mapped"""
+
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    data = table.drop([PAIR_CODE]).to_pandas(split_blocks=True)
+    pair_codes = table[PAIR_CODE].to_numpy()
+
+    return _encode_family(encode, data, pair_codes)
+
+
+def _add_time_columns(data: pd.DataFrame) -> pd.DataFrame:
+    X = data.reset_index(drop=True)
     X["hour"] = X["trans_time"] // 100
     X["weekday"] = X["day"] % 7
 
-    X = encode_users(X)
-    X = encode_items(X)
-    X = encode_baskets(X)
-    X = encode_store(X)
-    X = encode_week_no(X)
-    X = encode_weekday(X)
-    X = encode_trans_time(X)
+    return X
 
-    ignore_list = [
-        "basket_id",
-        "day",
-        "quantity",
-        "store_id",
-        "trans_time",
-        "week_no",
-        "hour",
-        "weekday",
-    ]
-    cols = [i for i in X.columns if not i in ignore_list]
-    user_item_features = X[cols]
 
-    df1, df2 = get_embeddings(recommender)
-    user_item_features = user_item_features.merge(df1, on=["item_id"])
-    user_item_features = user_item_features.merge(df2, on=["user_id"])
+def _add_column(columns: Dict[str, np.ndarray], name: str, values: np.ndarray):
+    """Adds the column, repeated names get suffixes as they did with pd.merge"""
+
+    if name in columns:
+        renamed = [
+            (col + "_x" if col == name else col, column)
+            for col, column in columns.items()
+        ]
+        columns.clear()
+        columns.update(renamed)
+        name += "_y"
+    columns[name] = values
 
-    return user_item_features
+
+def _mean_by_group(
+    codes: np.ndarray, values: np.ndarray, counts: np.ndarray
+) -> np.ndarray:
+    return np.bincount(codes, weights=values, minlength=len(counts)) / counts
 
 
 def encode_users(
-    data: pd.DataFrame,
-) -> pd.DataFrame:
+    data: Transactions,
+) -> List[GroupFeatures]:
 
     logging.info("Generating user features...")
 
-    df = pd.DataFrame()
-    df["n_baskets_user"] = data.groupby(["user_id"])["basket_id"].count()
-    df["n_items_user"] = data.groupby(["user_id"])["item_id"].count()
-    df["sales_value_user"] = data.groupby(["user_id"])["sales_value"].sum()
-    df1 = data.groupby(["user_id"])["sales_value", "quantity"].sum()
-    df["avg_price_user"] = df1["sales_value"] / df1["quantity"]
-    df["n_stores_user"] = data.groupby(["user_id"])["store_id"].count()
-    df["retail_disc_user"] = data.groupby(["user_id"])["retail_disc"].sum()
-    df["retail_disc_sales_ratio_user"] = df["retail_disc_user"] / df["sales_value_user"]
-    df["coupon_disc_user"] = data.groupby(["user_id"])["coupon_disc"].sum()
-    df["coupon_disc_sales_ratio_user"] = df["coupon_disc_user"] / df["sales_value_user"]
-    df["coupon_match_disc_user"] = data.groupby(["user_id"])["coupon_match_disc"].sum()
-    df["coupon_match_disc_sales_ratio_user"] = (
-        df["coupon_match_disc_user"] / df["sales_value_user"]
-    )
-    df["n_week_nos_user"] = (
-        data.groupby(["user_id", "week_no"])["week_no"]
-        .count()
-        .groupby(["user_id"])
-        .count()
-    )
-    df["mean_visits_interval_user"] = (
-        data.groupby("user_id")["day"].max() - data.groupby("user_id")["day"].min()
-    ) / data.groupby("user_id")["day"].count()
-
-    df["mean_basket_value_user"] = (
-        data.groupby(["user_id", "basket_id"])["sales_value"]
-        .sum()
+    features = []
+
+    codes, stats = _aggregate(
+        data,
+        "user_id",
+        n_rows=("item_id", "size"),
+        sales_value=("sales_value", "sum"),
+        quantity=("quantity", "sum"),
+        retail_disc=("retail_disc", "sum"),
+        coupon_disc=("coupon_disc", "sum"),
+        coupon_match_disc=("coupon_match_disc", "sum"),
+        n_week_nos=("week_no", "nunique"),
+        first_day=("day", "min"),
+        last_day=("day", "max"),
+    )
+    baskets = (
+        _group_stats(
+            data,
+            ["user_id", "basket_id"],
+            sales_value=("sales_value", "sum"),
+            n_items=("item_id", "size"),
+        )
         .groupby("user_id")
-        .mean()
-    )
-    df["n_items_baskets_mean_user"] = (
-        data.groupby(["user_id", "basket_id"])["item_id"]
-        .count()
-        .groupby(["user_id"])
-        .mean()
-    )
-    df["n_items_baskets_max_user"] = (
-        data.groupby(["user_id", "basket_id"])["item_id"]
-        .count()
-        .groupby(["user_id"])
-        .max()
-    )
-    df["n_items_baskets_std_user"] = (
-        data.groupby(["user_id", "basket_id"])["item_id"]
-        .count()
-        .groupby(["user_id"])
-        .std()
-    )
-    data = pd.merge(data, df, on="user_id", how="left")
+        .agg(
+            sales_value_mean=("sales_value", "mean"),
+            n_items_mean=("n_items", "mean"),
+            n_items_max=("n_items", "max"),
+            n_items_std=("n_items", "std"),
+        )
+    )
+    df = pd.DataFrame(
+        {
+            "n_baskets_user": stats["n_rows"],
+            "n_items_user": stats["n_rows"],
+            "sales_value_user": stats["sales_value"],
+            "avg_price_user": stats["sales_value"] / stats["quantity"],
+            "n_stores_user": stats["n_rows"],
+            "retail_disc_user": stats["retail_disc"],
+            "retail_disc_sales_ratio_user": stats["retail_disc"] / stats["sales_value"],
+            "coupon_disc_user": stats["coupon_disc"],
+            "coupon_disc_sales_ratio_user": stats["coupon_disc"] / stats["sales_value"],
+            "coupon_match_disc_user": stats["coupon_match_disc"],
+            "coupon_match_disc_sales_ratio_user": stats["coupon_match_disc"]
+            / stats["sales_value"],
+            "n_week_nos_user": stats["n_week_nos"],
+            "mean_visits_interval_user": (stats["last_day"] - stats["first_day"])
+            / stats["n_rows"],
+            "mean_basket_value_user": baskets["sales_value_mean"],
+            "n_items_baskets_mean_user": baskets["n_items_mean"],
+            "n_items_baskets_max_user": baskets["n_items_max"],
+            "n_items_baskets_std_user": baskets["n_items_std"],
+        }
+    )
+    features.append((codes, df))
 
     logging.info("Calculating median transactions time for pair user-item...")
 
-    df = pd.DataFrame()
-    df["median_trans_hour_user-item"] = data.groupby(["user_id", "item_id"])[
-        "hour"
-    ].median()
-    df["median_trans_weekday_user-item"] = data.groupby(["user_id", "item_id"])[
-        "weekday"
-    ].median()
-    data = pd.merge(data, df, on=["user_id", "item_id"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["user_id", "item_id"],
+            **{
+                "median_trans_hour_user-item": ("hour", "median"),
+                "median_trans_weekday_user-item": ("weekday", "median"),
+            },
+        )
+    )
 
     logging.info("Summarising user transactions by weekday...")
 
-    df = pd.DataFrame()
-    df["n_baskets_weekday_user"] = data.groupby(["user_id", "weekday"])[
-        "basket_id"
-    ].count()
-    df["n_items_weekday_user"] = data.groupby(["user_id", "weekday"])["item_id"].count()
-    df["sales_value_weekday_user"] = data.groupby(["user_id", "weekday"])[
-        "sales_value"
-    ].sum()
-    df1 = data.groupby(["user_id", "weekday"])["sales_value", "quantity"].sum()
-    df["avg_price_weekday_user"] = df1["sales_value"] / df1["quantity"]
-    data = pd.merge(data, df, on=["user_id", "weekday"], how="left")
+    codes, stats = _aggregate(
+        data,
+        ["user_id", "weekday"],
+        n_rows=("item_id", "size"),
+        sales_value=("sales_value", "sum"),
+        quantity=("quantity", "sum"),
+    )
+    df = pd.DataFrame(
+        {
+            "n_baskets_weekday_user": stats["n_rows"],
+            "n_items_weekday_user": stats["n_rows"],
+            "sales_value_weekday_user": stats["sales_value"],
+            "avg_price_weekday_user": stats["sales_value"] / stats["quantity"],
+        }
+    )
+    features.append((codes, df))
 
     logging.info("Summarising user transactions by transaction hour...")
 
-    df = pd.DataFrame()
-    df["n_baskets_trans_time_user"] = data.groupby(["user_id", "trans_time"])[
-        "basket_id"
-    ].count()
-    df["n_items_trans_time_user"] = data.groupby(["user_id", "trans_time"])[
-        "item_id"
-    ].count()
-    df["sales_value_trans_time_user"] = data.groupby(["user_id", "trans_time"])[
-        "sales_value"
-    ].sum()
-    data = pd.merge(data, df, on=["user_id", "trans_time"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["user_id", "trans_time"],
+            n_baskets_trans_time_user=("basket_id", "size"),
+            n_items_trans_time_user=("item_id", "size"),
+            sales_value_trans_time_user=("sales_value", "sum"),
+        )
+    )
 
-    return data
+    return features
 
 
 def encode_items(
-    data: pd.DataFrame,
-) -> pd.DataFrame:
+    data: Transactions,
+) -> List[GroupFeatures]:
 
     logging.info("Generating item features...")
 
-    df = pd.DataFrame()
-    df["n_baskets_item"] = data.groupby(["item_id"])["basket_id"].count()
-    df["n_users_item"] = data.groupby(["item_id"])["user_id"].count()
-    df["sales_value_item"] = data.groupby(["item_id"])["sales_value"].sum()
-    df["n_stores_item"] = data.groupby(["item_id"])["store_id"].count()
-    df["retail_disc_item"] = data.groupby(["item_id"])["retail_disc"].sum()
-    df["retail_disc_sales_ratio_item"] = df["retail_disc_item"] / df["sales_value_item"]
-    df["coupon_disc_item"] = data.groupby(["item_id"])["coupon_disc"].sum()
-    df["coupon_disc_sales_ratio_item"] = df["coupon_disc_item"] / df["sales_value_item"]
-    df["coupon_match_disc_item"] = data.groupby(["item_id"])["coupon_match_disc"].sum()
-    df["coupon_match_disc_sales_ratio_item"] = (
-        df["coupon_match_disc_item"] / df["sales_value_item"]
-    )
-    df["n_week_nos_item"] = (
-        data.groupby(["item_id", "week_no"])["week_no"]
-        .count()
-        .groupby(["item_id"])
-        .count()
-    )
-    data = pd.merge(data, df, on="item_id", how="left")
+    features = []
+
+    codes, stats = _aggregate(
+        data,
+        "item_id",
+        n_rows=("user_id", "size"),
+        sales_value=("sales_value", "sum"),
+        retail_disc=("retail_disc", "sum"),
+        coupon_disc=("coupon_disc", "sum"),
+        coupon_match_disc=("coupon_match_disc", "sum"),
+        n_week_nos=("week_no", "nunique"),
+    )
+    df = pd.DataFrame(
+        {
+            "n_baskets_item": stats["n_rows"],
+            "n_users_item": stats["n_rows"],
+            "sales_value_item": stats["sales_value"],
+            "n_stores_item": stats["n_rows"],
+            "retail_disc_item": stats["retail_disc"],
+            "retail_disc_sales_ratio_item": stats["retail_disc"] / stats["sales_value"],
+            "coupon_disc_item": stats["coupon_disc"],
+            "coupon_disc_sales_ratio_item": stats["coupon_disc"] / stats["sales_value"],
+            "coupon_match_disc_item": stats["coupon_match_disc"],
+            "coupon_match_disc_sales_ratio_item": stats["coupon_match_disc"]
+            / stats["sales_value"],
+            "n_week_nos_item": stats["n_week_nos"],
+        }
+    )
+    features.append((codes, df))
 
     logging.info("Summarising item transactions by weekday...")
 
-    df = pd.DataFrame()
-    df["n_baskets_weekday_item"] = data.groupby(["item_id", "weekday"])[
-        "basket_id"
-    ].count()
-    df["n_users_weekday_item"] = data.groupby(["item_id", "weekday"])["user_id"].count()
-    df["sales_value_weekday_item"] = data.groupby(["item_id", "weekday"])[
-        "sales_value"
-    ].sum()
-    df["n_stores_weekday_item"] = data.groupby(["item_id", "weekday"])[
-        "store_id"
-    ].count()
-    data = pd.merge(data, df, on=["item_id", "weekday"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["item_id", "weekday"],
+            n_baskets_weekday_item=("basket_id", "size"),
+            n_users_weekday_item=("user_id", "size"),
+            sales_value_weekday_item=("sales_value", "sum"),
+            n_stores_weekday_item=("store_id", "size"),
+        )
+    )
 
     logging.info("Summarising item transactions by transaction hour...")
 
-    df = pd.DataFrame()
-    df["n_baskets_trans_time_item"] = data.groupby(["item_id", "trans_time"])[
-        "basket_id"
-    ].count()
-    df["n_users_trans_time_item"] = data.groupby(["item_id", "trans_time"])[
-        "user_id"
-    ].count()
-    df["sales_value_trans_time_item"] = data.groupby(["item_id", "trans_time"])[
-        "sales_value"
-    ].sum()
-    df["n_stores_trans_time_item"] = data.groupby(["item_id", "trans_time"])[
-        "store_id"
-    ].count()
-    data = pd.merge(data, df, on=["item_id", "trans_time"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["item_id", "trans_time"],
+            n_baskets_trans_time_item=("basket_id", "size"),
+            n_users_trans_time_item=("user_id", "size"),
+            sales_value_trans_time_item=("sales_value", "sum"),
+            n_stores_trans_time_item=("store_id", "size"),
+        )
+    )
 
-    return data
+    return features
 
 
 def encode_baskets(
-    data: pd.DataFrame,
-) -> pd.DataFrame:
+    data: Transactions,
+) -> List[GroupFeatures]:
 
     logging.info("Encoding baskets...")
 
-    df = pd.DataFrame()
-    df["n_items_busket"] = data.groupby(["basket_id"])["item_id"].count()
-    df["sales_value_basket"] = data.groupby(["basket_id"])["sales_value"].sum()
-    df1 = data.groupby(["basket_id"])["sales_value", "quantity"].sum()
-    df["avg_price_basket"] = df1["sales_value"] / df1["quantity"]
-    df["retail_disc_basket"] = data.groupby(["basket_id"])["retail_disc"].sum()
-    df["retail_disc_sales_ratio_basket"] = (
-        df["retail_disc_basket"] / df["sales_value_basket"]
-    )
-    df["coupon_disc_basket"] = data.groupby(["basket_id"])["coupon_disc"].sum()
-    df["coupon_disc_sales_ratio_basket"] = (
-        df["coupon_disc_basket"] / df["sales_value_basket"]
-    )
-    df["coupon_match_disc_basket"] = data.groupby(["basket_id"])[
-        "coupon_match_disc"
-    ].sum()
-    df["coupon_match_disc_sales_ratio_basket"] = (
-        df["coupon_match_disc_basket"] / df["sales_value_basket"]
-    )
-    data = pd.merge(data, df, on="basket_id", how="left")
+    features = []
+
+    codes, stats = _aggregate(
+        data,
+        "basket_id",
+        n_rows=("item_id", "size"),
+        sales_value=("sales_value", "sum"),
+        quantity=("quantity", "sum"),
+        retail_disc=("retail_disc", "sum"),
+        coupon_disc=("coupon_disc", "sum"),
+        coupon_match_disc=("coupon_match_disc", "sum"),
+    )
+    df = pd.DataFrame(
+        {
+            "n_items_busket": stats["n_rows"],
+            "sales_value_basket": stats["sales_value"],
+            "avg_price_basket": stats["sales_value"] / stats["quantity"],
+            "retail_disc_basket": stats["retail_disc"],
+            "retail_disc_sales_ratio_basket": stats["retail_disc"]
+            / stats["sales_value"],
+            "coupon_disc_basket": stats["coupon_disc"],
+            "coupon_disc_sales_ratio_basket": stats["coupon_disc"]
+            / stats["sales_value"],
+            "coupon_match_disc_basket": stats["coupon_match_disc"],
+            "coupon_match_disc_sales_ratio_basket": stats["coupon_match_disc"]
+            / stats["sales_value"],
+        }
+    )
+    features.append((codes, df))
 
     logging.info("Summarising baskets transactions by weekday...")
 
-    df = pd.DataFrame()
-    df["sales_value_weekday_basket"] = data.groupby(["basket_id", "weekday"])[
-        "sales_value"
-    ].sum()
-    data = pd.merge(data, df, on=["basket_id", "weekday"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["basket_id", "weekday"],
+            sales_value_weekday_basket=("sales_value", "sum"),
+        )
+    )
 
     logging.info("Summarising baskets transactions by transaction hour...")
 
-    df = pd.DataFrame()
-    df["sales_value_trans_time_item"] = data.groupby(["basket_id", "trans_time"])[
-        "sales_value"
-    ].sum()
-    data = pd.merge(data, df, on=["basket_id", "trans_time"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["basket_id", "trans_time"],
+            sales_value_trans_time_item=("sales_value", "sum"),
+        )
+    )
 
-    return data
+    return features
 
 
 def encode_store(
-    data: pd.DataFrame,
-) -> pd.DataFrame:
+    data: Transactions,
+) -> List[GroupFeatures]:
 
     logging.info("Encoding stores...")
 
-    df = pd.DataFrame()
-    df["n_users_store"] = (
-        data.groupby(["store_id", "user_id"])["user_id"]
-        .count()
-        .groupby(["store_id"])
-        .count()
-    )
-    df["mean_user_value_store"] = (
-        data.groupby(["store_id", "user_id"])["sales_value"]
-        .sum()
-        .groupby(["store_id"])
-        .mean()
-    )
-    df["n_items_store"] = (
-        data.groupby(["store_id", "item_id"])["item_id"]
-        .count()
-        .groupby(["store_id"])
-        .count()
-    )
-    df["mean_item_value_store"] = (
-        data.groupby(["store_id", "item_id"])["sales_value"]
-        .sum()
-        .groupby(["store_id"])
-        .mean()
-    )
-    df["n_baskets_store"] = (
-        data.groupby(["store_id", "basket_id"])["basket_id"]
-        .count()
-        .groupby(["store_id"])
-        .count()
-    )
-    df["mean_basket_value_store"] = (
-        data.groupby(["store_id", "basket_id"])["sales_value"]
-        .sum()
-        .groupby(["store_id"])
-        .mean()
-    )
-    df["sales_value_store"] = data.groupby(["store_id"])["sales_value"].sum()
-    df1 = data.groupby(["store_id"])["sales_value", "quantity"].sum()
-    df["avg_price_store"] = df1["sales_value"] / df1["quantity"]
-    df["retail_disc_store"] = data.groupby(["store_id"])["retail_disc"].sum()
-    df["retail_disc_sales_ratio_store"] = (
-        df["retail_disc_store"] / df["sales_value_store"]
-    )
-    df["coupon_disc_store"] = data.groupby(["store_id"])["coupon_disc"].sum()
-    df["coupon_disc_sales_ratio_store"] = (
-        df["coupon_disc_store"] / df["sales_value_store"]
-    )
-    df["coupon_match_disc_store"] = data.groupby(["store_id"])[
-        "coupon_match_disc"
-    ].sum()
-    df["coupon_match_disc_sales_ratio_store"] = (
-        df["coupon_match_disc_store"] / df["sales_value_store"]
-    )
-    df["n_week_nos_store"] = (
-        data.groupby(["store_id", "week_no"])["week_no"]
-        .count()
-        .groupby(["store_id"])
-        .count()
-    )
-    data = pd.merge(data, df, on=["store_id"], how="left")
+    features = []
+
+    codes, stats = _aggregate(
+        data,
+        "store_id",
+        n_users=("user_id", "nunique"),
+        n_items=("item_id", "nunique"),
+        n_baskets=("basket_id", "nunique"),
+        sales_value=("sales_value", "sum"),
+        quantity=("quantity", "sum"),
+        retail_disc=("retail_disc", "sum"),
+        coupon_disc=("coupon_disc", "sum"),
+        coupon_match_disc=("coupon_match_disc", "sum"),
+        n_week_nos=("week_no", "nunique"),
+    )
+    df = pd.DataFrame(
+        {
+            "n_users_store": stats["n_users"],
+            "mean_user_value_store": _mean_group_value(data, "store_id", "user_id"),
+            "n_items_store": stats["n_items"],
+            "mean_item_value_store": _mean_group_value(data, "store_id", "item_id"),
+            "n_baskets_store": stats["n_baskets"],
+            "mean_basket_value_store": _mean_group_value(data, "store_id", "basket_id"),
+            "sales_value_store": stats["sales_value"],
+            "avg_price_store": stats["sales_value"] / stats["quantity"],
+            "retail_disc_store": stats["retail_disc"],
+            "retail_disc_sales_ratio_store": stats["retail_disc"]
+            / stats["sales_value"],
+            "coupon_disc_store": stats["coupon_disc"],
+            "coupon_disc_sales_ratio_store": stats["coupon_disc"]
+            / stats["sales_value"],
+            "coupon_match_disc_store": stats["coupon_match_disc"],
+            "coupon_match_disc_sales_ratio_store": stats["coupon_match_disc"]
+            / stats["sales_value"],
+            "n_week_nos_store": stats["n_week_nos"],
+        }
+    )
+    features.append((codes, df))
 
     logging.info("Summarising stores transactions by weekday...")
 
-    df = pd.DataFrame()
-    df["n_users_weekday_store"] = (
-        data.groupby(["store_id", "weekday", "user_id"])["user_id"]
-        .count()
-        .groupby(["store_id", "weekday"])
-        .count()
-    )
-    df["n_items_weekday_store"] = (
-        data.groupby(["store_id", "weekday", "item_id"])["item_id"]
-        .count()
-        .groupby(["store_id", "weekday"])
-        .count()
-    )
-    df["n_baskets_weekday_store"] = (
-        data.groupby(["store_id", "weekday", "basket_id"])["basket_id"]
-        .count()
-        .groupby(["store_id", "weekday"])
-        .count()
+    features.append(
+        _aggregate(
+            data,
+            ["store_id", "weekday"],
+            n_users_weekday_store=("user_id", "nunique"),
+            n_items_weekday_store=("item_id", "nunique"),
+            n_baskets_weekday_store=("basket_id", "nunique"),
+            sales_value_weekday_store=("sales_value", "sum"),
+        )
     )
-    df["sales_value_weekday_store"] = data.groupby(["store_id", "weekday"])[
-        "sales_value"
-    ].sum()
-    data = pd.merge(data, df, on=["store_id", "weekday"], how="left")
 
     logging.info("Summarising stores transactions by transaction hour...")
 
-    df = pd.DataFrame()
-    df["n_users_trans_time_store"] = (
-        data.groupby(["store_id", "trans_time", "user_id"])["user_id"]
-        .count()
-        .groupby(["store_id", "trans_time"])
-        .count()
+    features.append(
+        _aggregate(
+            data,
+            ["store_id", "trans_time"],
+            n_users_trans_time_store=("user_id", "nunique"),
+            n_items_trans_time_store=("item_id", "nunique"),
+            n_baskets_trans_time_store=("basket_id", "nunique"),
+            sales_value_trans_time_store=("sales_value", "sum"),
+        )
     )
-    df["n_items_trans_time_store"] = (
-        data.groupby(["store_id", "trans_time", "item_id"])["item_id"]
-        .count()
-        .groupby(["store_id", "trans_time"])
-        .count()
-    )
-    df["n_baskets_trans_time_store"] = (
-        data.groupby(["store_id", "trans_time", "basket_id"])["basket_id"]
-        .count()
-        .groupby(["store_id", "trans_time"])
-        .count()
-    )
-    df["sales_value_trans_time_store"] = data.groupby(["store_id", "trans_time"])[
-        "sales_value"
-    ].sum()
-    data = pd.merge(data, df, on=["store_id", "trans_time"], how="left")
 
-    return data
+    return features
 
 
 def encode_week_no(
-    data: pd.DataFrame,
-) -> pd.DataFrame:
+    data: Transactions,
+) -> List[GroupFeatures]:
 
     logging.info("Encoding week number...")
 
-    df = pd.DataFrame()
-    df["n_users_week_no"] = (
-        data.groupby(["week_no", "user_id"])["user_id"]
-        .count()
-        .groupby("week_no")
-        .count()
-    )
-    df["n_items_week_no"] = (
-        data.groupby(["week_no", "item_id"])["item_id"]
-        .count()
-        .groupby("week_no")
-        .count()
-    )
-    df["n_baskets_week_no"] = (
-        data.groupby(["week_no", "basket_id"])["basket_id"]
-        .count()
-        .groupby("week_no")
-        .count()
-    )
-    df["n_stores_week_no"] = (
-        data.groupby(["week_no", "store_id"])["store_id"]
-        .count()
-        .groupby("week_no")
-        .count()
-    )
-    df["sales_value_week_no"] = data.groupby(["week_no"])["sales_value"].sum()
-    df1 = data.groupby(["week_no"])["sales_value", "quantity"].sum()
-    df["avg_price_week_no"] = df1["sales_value"] / df1["quantity"]
-    df["retail_disc_week_no"] = data.groupby(["week_no"])["retail_disc"].sum()
-    df["retail_disc_sales_ratio_week_no"] = (
-        df["retail_disc_week_no"] / df["sales_value_week_no"]
-    )
-    df["coupon_disc_week_no"] = data.groupby(["week_no"])["coupon_disc"].sum()
-    df["coupon_disc_sales_ratio_week_no"] = (
-        df["coupon_disc_week_no"] / df["sales_value_week_no"]
-    )
-    df["coupon_match_disc_week_no"] = data.groupby(["week_no"])[
-        "coupon_match_disc"
-    ].sum()
-    df["coupon_match_disc_sales_ratio_week_no"] = (
-        df["coupon_match_disc_week_no"] / df["sales_value_week_no"]
-    )
-    data = pd.merge(data, df, on=["week_no"], how="left")
+    features = []
+
+    codes, stats = _aggregate(
+        data,
+        "week_no",
+        n_users=("user_id", "nunique"),
+        n_items=("item_id", "nunique"),
+        n_baskets=("basket_id", "nunique"),
+        n_stores=("store_id", "nunique"),
+        sales_value=("sales_value", "sum"),
+        quantity=("quantity", "sum"),
+        retail_disc=("retail_disc", "sum"),
+        coupon_disc=("coupon_disc", "sum"),
+        coupon_match_disc=("coupon_match_disc", "sum"),
+    )
+    df = pd.DataFrame(
+        {
+            "n_users_week_no": stats["n_users"],
+            "n_items_week_no": stats["n_items"],
+            "n_baskets_week_no": stats["n_baskets"],
+            "n_stores_week_no": stats["n_stores"],
+            "sales_value_week_no": stats["sales_value"],
+            "avg_price_week_no": stats["sales_value"] / stats["quantity"],
+            "retail_disc_week_no": stats["retail_disc"],
+            "retail_disc_sales_ratio_week_no": stats["retail_disc"]
+            / stats["sales_value"],
+            "coupon_disc_week_no": stats["coupon_disc"],
+            "coupon_disc_sales_ratio_week_no": stats["coupon_disc"]
+            / stats["sales_value"],
+            "coupon_match_disc_week_no": stats["coupon_match_disc"],
+            "coupon_match_disc_sales_ratio_week_no": stats["coupon_match_disc"]
+            / stats["sales_value"],
+        }
+    )
+    features.append((codes, df))
 
     logging.info("Summarising transactions by week number and weekday...")
 
-    df = pd.DataFrame()
-    df["sales_value_weekday_week_no"] = data.groupby(["week_no", "weekday"])[
-        "sales_value"
-    ].sum()
-    data = pd.merge(data, df, on=["week_no", "weekday"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["week_no", "weekday"],
+            sales_value_weekday_week_no=("sales_value", "sum"),
+        )
+    )
 
     logging.info("Summarising transactions by week number and transaction hour...")
 
-    df = pd.DataFrame()
-    df["sales_value_trans_time_store"] = data.groupby(["week_no", "trans_time"])[
-        "sales_value"
-    ].sum()
-    data = pd.merge(data, df, on=["week_no", "trans_time"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["week_no", "trans_time"],
+            sales_value_trans_time_store=("sales_value", "sum"),
+        )
+    )
 
-    return data
+    return features
 
 
 def encode_weekday(
-    data: pd.DataFrame,
-) -> pd.DataFrame:
+    data: Transactions,
+) -> List[GroupFeatures]:
 
     logging.info("Encoding weekday...")
 
-    df = pd.DataFrame()
-    df["n_baskets_weekday"] = (
-        data.groupby(["weekday", "basket_id"])["basket_id"]
-        .count()
-        .groupby("weekday")
-        .count()
-    )
-    df["sales_weekday"] = data.groupby(["weekday"])["sales_value"].sum()
-
-    df["avg_basket_value_weekday"] = df["sales_weekday"] / df["n_baskets_weekday"]
-    df1 = data.groupby(["weekday"])["sales_value", "quantity"].sum()
-    df["avg_price_weekday"] = df1["sales_value"] / df1["quantity"]
-    df["retail_disc_weekday"] = data.groupby(["weekday"])["retail_disc"].sum()
-    df["retail_disc_sales_ratio_weekday"] = (
-        df["retail_disc_weekday"] / df["sales_weekday"]
-    )
-    df["coupon_disc_weekday"] = data.groupby(["weekday"])["coupon_disc"].sum()
-    df["coupon_disc_sales_ratio_weekday"] = (
-        df["coupon_disc_weekday"] / df["sales_weekday"]
-    )
-    df["coupon_match_disc_weekday"] = data.groupby(["weekday"])[
-        "coupon_match_disc"
-    ].sum()
-    df["coupon_match_disc_sales_ratio_weekday"] = (
-        df["coupon_match_disc_weekday"] / df["sales_weekday"]
-    )
-    data = pd.merge(data, df, on=["weekday"], how="left")
+    features = []
+
+    codes, stats = _aggregate(
+        data,
+        "weekday",
+        n_baskets=("basket_id", "nunique"),
+        sales_value=("sales_value", "sum"),
+        quantity=("quantity", "sum"),
+        retail_disc=("retail_disc", "sum"),
+        coupon_disc=("coupon_disc", "sum"),
+        coupon_match_disc=("coupon_match_disc", "sum"),
+    )
+    df = pd.DataFrame(
+        {
+            "n_baskets_weekday": stats["n_baskets"],
+            "sales_weekday": stats["sales_value"],
+            "avg_basket_value_weekday": stats["sales_value"] / stats["n_baskets"],
+            "avg_price_weekday": stats["sales_value"] / stats["quantity"],
+            "retail_disc_weekday": stats["retail_disc"],
+            "retail_disc_sales_ratio_weekday": stats["retail_disc"]
+            / stats["sales_value"],
+            "coupon_disc_weekday": stats["coupon_disc"],
+            "coupon_disc_sales_ratio_weekday": stats["coupon_disc"]
+            / stats["sales_value"],
+            "coupon_match_disc_weekday": stats["coupon_match_disc"],
+            "coupon_match_disc_sales_ratio_weekday": stats["coupon_match_disc"]
+            / stats["sales_value"],
+        }
+    )
+    features.append((codes, df))
 
     logging.info("Summarising weekday transactions by transaction hour...")
 
-    df = pd.DataFrame()
-    df["sales_value_trans_time_weekday"] = data.groupby(["weekday", "trans_time"])[
-        "sales_value"
-    ].sum()
-    data = pd.merge(data, df, on=["weekday", "trans_time"], how="left")
+    features.append(
+        _aggregate(
+            data,
+            ["weekday", "trans_time"],
+            sales_value_trans_time_weekday=("sales_value", "sum"),
+        )
+    )
 
-    return data
+    return features
 
 
 def encode_trans_time(
-    data: pd.DataFrame,
-) -> pd.DataFrame:
+    data: Transactions,
+) -> List[GroupFeatures]:
 
     logging.info("Encoding transactions time...")
 
-    df = pd.DataFrame()
-    df["n_baskets_trans_time"] = (
-        data.groupby(["trans_time", "basket_id"])["basket_id"]
-        .count()
-        .groupby("trans_time")
-        .count()
-    )
-    df["sales_trans_time"] = data.groupby(["trans_time"])["sales_value"].sum()
-    df["avg_basket_value_trans_time"] = (
-        df["sales_trans_time"] / df["n_baskets_trans_time"]
-    )
-    df1 = data.groupby(["trans_time"])["sales_value", "quantity"].sum()
-    df["avg_price_trans_time"] = df1["sales_value"] / df1["quantity"]
-    df["retail_disc_trans_time"] = data.groupby(["trans_time"])["retail_disc"].sum()
-    df["retail_disc_sales_ratio_trans_time"] = (
-        df["retail_disc_trans_time"] / df["sales_trans_time"]
-    )
-    df["coupon_disc_trans_time"] = data.groupby(["trans_time"])["coupon_disc"].sum()
-    df["coupon_disc_sales_ratio_trans_time"] = (
-        df["coupon_disc_trans_time"] / df["sales_trans_time"]
-    )
-    df["coupon_match_disc_trans_time"] = data.groupby(["trans_time"])[
-        "coupon_match_disc"
-    ].sum()
-    df["coupon_match_disc_sales_ratio_trans_time"] = (
-        df["coupon_match_disc_trans_time"] / df["sales_trans_time"]
+    features = []
+
+    codes, stats = _aggregate(
+        data,
+        "trans_time",
+        n_baskets=("basket_id", "nunique"),
+        sales_value=("sales_value", "sum"),
+        quantity=("quantity", "sum"),
+        retail_disc=("retail_disc", "sum"),
+        coupon_disc=("coupon_disc", "sum"),
+        coupon_match_disc=("coupon_match_disc", "sum"),
+    )
+    df = pd.DataFrame(
+        {
+            "n_baskets_trans_time": stats["n_baskets"],
+            "sales_trans_time": stats["sales_value"],
+            "avg_basket_value_trans_time": stats["sales_value"] / stats["n_baskets"],
+            "avg_price_trans_time": stats["sales_value"] / stats["quantity"],
+            "retail_disc_trans_time": stats["retail_disc"],
+            "retail_disc_sales_ratio_trans_time": stats["retail_disc"]
+            / stats["sales_value"],
+            "coupon_disc_trans_time": stats["coupon_disc"],
+            "coupon_disc_sales_ratio_trans_time": stats["coupon_disc"]
+            / stats["sales_value"],
+            "coupon_match_disc_trans_time": stats["coupon_match_disc"],
+            "coupon_match_disc_sales_ratio_trans_time": stats["coupon_match_disc"]
+            / stats["sales_value"],
+        }
+    )
+    features.append((codes, df))
+
+    return features
+
+
+# Feature families in the order of their columns
+ENCODERS = [
+    encode_users,
+    encode_items,
+    encode_baskets,
+    encode_store,
+    encode_week_no,
+    encode_weekday,
+    encode_trans_time,
+]
+
+
+def _mean_group_value(data: Transactions, key: str, group: str) -> pd.Series:
+    """Mean sales value of the groups (e.g. users or baskets) of each key"""
+
+    return (
+        _group_stats(data, [key, group], sales_value=("sales_value", "sum"))[
+            "sales_value"
+        ]
+        .groupby(key)
+        .mean()
     )
-    data = pd.merge(data, df, on=["trans_time"], how="left")
 
-    return data
 
+def _aggregate(data: Transactions, keys, **aggregations) -> GroupFeatures:
+    """Named aggregations of the groups and the group codes of the rows"""
+
+    if not isinstance(data, pd.DataFrame):
+        return None, data.aggregate(keys, **aggregations)
+
+    grouped = data.groupby(keys)
+
+    return grouped.ngroup().to_numpy(), grouped.agg(**aggregations)
+
+
+def _group_stats(data: Transactions, keys, **aggregations) -> pd.DataFrame:
+    """Named aggregations of the groups"""
 
-def get_embeddings(recommender) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    if not isinstance(data, pd.DataFrame):
+        return data.aggregate(keys, **aggregations)
+
+    return data.groupby(keys).agg(**aggregations)
+
+
+def get_embeddings(recommender) -> Embeddings:
     """
-    Generates embeddings from recommender item and user factors.
+    Takes item and user factors of the recommender as float32 matrices
+    (without a copy if they are float32 already); raises ValueError if
+    the factors do not match the id mappings of the recommender.
     """
 
-    logging.info("Calculating item embeddings...")
+    logging.info("Calculating item and user embeddings...")
+
+    item_factors = recommender.model.item_factors
+    user_factors = recommender.model.user_factors
+    if not type(item_factors) is np.ndarray:
+        item_factors = item_factors.to_numpy()
+        user_factors = user_factors.to_numpy()
+    item_factors = np.asarray(item_factors, dtype=np.float32)
+    user_factors = np.asarray(user_factors, dtype=np.float32)
 
-    df1 = recommender.model.item_factors
-    if not type(df1) is np.ndarray:
-        df1 = df1.to_numpy()
-    n_factors = df1.shape[1]
-    ind = list(recommender.id_to_itemid.values())
-    df1 = pd.DataFrame(df1, index=ind).reset_index()
-    df1.columns = ["item_id"] + ["factor_" + str(i + 1) for i in range(n_factors)]
+    for name, mapping, factors in [
+        ("item", recommender.item_mapping, item_factors),
+        ("user", recommender.user_mapping, user_factors),
+    ]:
+        if len(mapping) != len(factors):
+            raise ValueError(
+                f"{len(factors)} {name} factors for {len(mapping)} {name} ids"
+            )
+
+    return Embeddings(
+        recommender.item_mapping,
+        item_factors,
+        recommender.user_mapping,
+        user_factors,
+    )
 
-    logging.info("Calculating user embeddings...")
 
-    df2 = recommender.model.user_factors
-    if not type(df2) is np.ndarray:
-        df2 = df2.to_numpy()
-    n_users = df2.shape[0]
-    ind = list(recommender.id_to_userid.values())[:n_users]
-    df2 = pd.DataFrame(df2, index=ind).reset_index()
-    df2.columns = ["user_id"] + ["user_factor_" + str(i + 1) for i in range(n_factors)]
+def add_embeddings(df: pd.DataFrame, embeddings: Embeddings) -> pd.DataFrame:
+    """
+    Adds factor_* and user_factor_* columns gathered by item_id and user_id
+    of the rows of df; unknown items and users get nan.
+    """
 
-    return df1, df2
+    columns = []
+    for key, prefix, mapping, factors in [
+        ("item_id", "factor_", embeddings.item_mapping, embeddings.item_factors),
+        ("user_id", "user_factor_", embeddings.user_mapping, embeddings.user_factors),
+    ]:
+        rows = mapping.encode(df[key].to_numpy())
+        values = factors[rows]
+        values[rows < 0] = np.nan
+        columns.append(
+            pd.DataFrame(
+                values,
+                columns=[prefix + str(i + 1) for i in range(factors.shape[1])],
+                index=df.index,
+            )
+        )
+
+    return pd.concat([df] + columns, axis=1)
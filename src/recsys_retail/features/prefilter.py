@@ -1,26 +1,50 @@
 import logging
 import pandas as pd
 import numpy as np
-from typing import Optional
+from typing import NamedTuple, Optional
+from .backend import LazyFrame, Transactions
 
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["prefilter_items"]
+__all__ = [
+    "prefilter_items",
+    "ItemStats",
+    "get_item_stats",
+    "update_item_stats",
+    "get_item_decisions",
+    "apply_item_decisions",
+    "get_item_mapping",
+    "add_price",
+]
 
 
 LOWER_PRICE_THRESHOLD = 1
 UPPER_PRICE_THRESHOLD = 30
 TAKE_N_POPULAR = 2500
+FAKE_ITEM_ID = 999999
+
+# Reasons of the decisions in the order of prefilter steps
+NOT_SOLD_IN_12_MONTHS = "not_sold_in_12_months"
+TOO_POPULAR = "too_popular"
+TOO_UNPOPULAR = "too_unpopular"
+SMALL_DEPARTMENT = "small_department"
+TOO_CHEAP = "too_cheap"
+TOO_EXPENSIVE = "too_expensive"
+NOT_IN_TOP_N = "not_in_top_n"
+TOP_N = "top_n"
+
+# Decisions: drop the item's rows, keep the item or replace it with FAKE_ITEM_ID
+DROP, KEEP, REPLACE = "drop", "keep", "replace"
 
 
 def prefilter_items(
-    data: pd.DataFrame,
+    data: Transactions,
     item_features: pd.DataFrame,
     lower_price_threshold: Optional[int] = None,
     upper_price_threshold: Optional[int] = None,
     take_n_popular: Optional[int] = None,
-) -> pd.DataFrame:
+) -> Transactions:
     """
     1.Removes items that have not been sold for the last 12 months
     2.Removes most popular items (they will be bought anyway).
@@ -36,76 +60,286 @@ def prefilter_items(
 
     logging.info("Prefiltering items...")
 
-    # 1.Remove items that have not been sold for the last 12 months
-    t = max(data["day"]) - 365
-    not_sold_in_12_month = list(
-        set(data[data["day"] < t]["item_id"].unique())
-        - set(data[data["day"] >= t]["item_id"].unique())
+    item_decisions = get_item_decisions(
+        get_item_stats(data),
+        item_features,
+        lower_price_threshold,
+        upper_price_threshold,
+        take_n_popular,
     )
-    data = data[~data["item_id"].isin(not_sold_in_12_month)]
 
-    # 2.Remove most popular items (they will be bought anyway).
-    popularity = (
-        data.groupby("item_id")["user_id"].nunique() / data["user_id"].nunique()
-    ).reset_index()
-    popularity.rename(columns={"user_id": "share_unique_users"}, inplace=True)
-    top_popular = popularity[popularity["share_unique_users"] > 0.2].item_id.tolist()
-    data = data[~data["item_id"].isin(top_popular)]
+    return apply_item_decisions(data, item_decisions)
+
+
+class ItemStats(NamedTuple):
+    """
+    Statistics of items behind prefilter decisions which can be updated
+    with new weeks of transactions.
+
+    items - last_day, min_price, max_price, n_sold and n_users
+            of each item, indexed by item_id in ascending order
+    item_users - distinct (item_id, user_id) pairs
+    last_week - the last week_no of the transactions included (the version)
+    """
+
+    items: pd.DataFrame
+    item_users: pd.DataFrame
+    last_week: int
+
+
+def get_item_stats(data: Transactions) -> ItemStats:
+    """
+    Calculates statistics of items from transactions in one grouped pass;
+    lazy transactions are folded in one week at a time.
+    """
+
+    if not isinstance(data, pd.DataFrame):
+        return _fold_item_stats(None, data)
+
+    codes, item_ids = pd.factorize(data["item_id"], sort=True)
+    price = data["sales_value"] / np.maximum(data["quantity"], 1)
+    items = (
+        pd.DataFrame(
+            {
+                "last_day": data["day"].to_numpy(),
+                "min_price": price.to_numpy(),
+                "max_price": price.to_numpy(),
+                "n_sold": data["quantity"].to_numpy(),
+            }
+        )
+        .groupby(codes, sort=True)
+        .agg(
+            {"last_day": "max", "min_price": "min", "max_price": "max", "n_sold": "sum"}
+        )
+        .reindex(range(len(item_ids)))
+    )
+    items.index = pd.Index(item_ids, name="item_id")
+
+    item_users = _get_item_users(codes, item_ids, data["user_id"].to_numpy())
+    items["n_users"] = _count_users(items.index.to_numpy(), item_users)
+    last_week = int(data["week_no"].max()) if len(data) else 0
+
+    return ItemStats(items, item_users, last_week)
+
+
+def update_item_stats(item_stats: ItemStats, new_data: Transactions) -> ItemStats:
+    """
+    Refreshes statistics of items with new weeks of transactions only;
+    rows of the weeks which are already included in item_stats are ignored.
+    """
+
+    if not isinstance(new_data, pd.DataFrame):
+        return _fold_item_stats(item_stats, new_data)
+
+    new_data = new_data[new_data["week_no"] > item_stats.last_week]
+    if len(new_data) == 0:
+        return item_stats
+    logging.info(f"Updating item statistics with {len(new_data)} transactions...")
+
+    new_stats = get_item_stats(new_data)
+    items = (
+        pd.concat([item_stats.items, new_stats.items])
+        .groupby(level="item_id", sort=True)
+        .agg(
+            {"last_day": "max", "min_price": "min", "max_price": "max", "n_sold": "sum"}
+        )
+    )
+    item_users = pd.concat([item_stats.item_users, new_stats.item_users])
+    item_codes, item_ids = pd.factorize(item_users["item_id"], sort=True)
+    item_users = _get_item_users(item_codes, item_ids, item_users["user_id"])
+    items["n_users"] = _count_users(items.index.to_numpy(), item_users)
+
+    return ItemStats(items, item_users, new_stats.last_week)
+
+
+def _fold_item_stats(item_stats: Optional[ItemStats], data: LazyFrame) -> ItemStats:
+    """Statistics of items updated with the partitions (weeks) one by one"""
+
+    for partition in data.partitions():
+        if item_stats is None:
+            item_stats = get_item_stats(partition)
+        else:
+            item_stats = update_item_stats(item_stats, partition)
+    if item_stats is None:
+        raise ValueError("No transactions to calculate item statistics")
+
+    return item_stats
+
+
+def get_item_decisions(
+    item_stats: ItemStats,
+    item_features: pd.DataFrame,
+    lower_price_threshold: Optional[int] = None,
+    upper_price_threshold: Optional[int] = None,
+    take_n_popular: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Makes prefilter decision for each item (steps 1-7 of prefilter_items).
+
+    Returns the table of items with the statistics behind the decisions:
+    item_id, decision (keep, replace with FAKE_ITEM_ID or drop), reason
+    (the first prefilter step the item has failed or top_n),
+    share_unique_users, the columns of item_stats.items; the version of
+    the table (item_stats.last_week) is kept in attrs["version"].
+    """
+
+    if lower_price_threshold is None:
+        lower_price_threshold = LOWER_PRICE_THRESHOLD
+    if upper_price_threshold is None:
+        upper_price_threshold = UPPER_PRICE_THRESHOLD
+    if take_n_popular is None:
+        take_n_popular = TAKE_N_POPULAR
+
+    items = item_stats.items
+    item_ids = items.index.to_numpy()
+    reason = np.full(len(items), TOP_N, dtype=object)
 
+    def fail(step_failed, name):
+        # Each item keeps the reason of the first step it has failed
+        reason[step_failed & (reason == TOP_N)] = name
+
+    # 1.Remove items that have not been sold for the last 12 months
+    t = items["last_day"].max() - 365
+    fail((items["last_day"] < t).to_numpy(), NOT_SOLD_IN_12_MONTHS)
+
+    # 2.Remove most popular items (they will be bought anyway).
     # 3.Remove most unpopular items (nobody will buy them)
-    top_unpopular = popularity[popularity["share_unique_users"] < 0.02].item_id.tolist()
-    data = data[~data["item_id"].isin(top_unpopular)]
+    sold_in_12_months = item_ids[reason == TOP_N]
+    item_users = item_stats.item_users
+    n_users = item_users.loc[
+        item_users["item_id"].isin(sold_in_12_months), "user_id"
+    ].nunique()
+    share_unique_users = items["n_users"] / n_users
+    fail((share_unique_users > 0.2).to_numpy(), TOO_POPULAR)
+    fail((share_unique_users < 0.02).to_numpy(), TOO_UNPOPULAR)
 
     # 4.Remove items from the departments with a limited assortiment
     if item_features is not None:
-        department_size = (
-            item_features.groupby("department")["item_id"]
-            .nunique()
-            .sort_values(ascending=False)
-        ).reset_index()
-        department_size.columns = ["department", "n_items"]
-
-        unpopular_departments = department_size[
-            department_size["n_items"] < 150
-        ].department.tolist()
-        items_in_unpopular_departments = (
-            item_features[item_features["department"].isin(unpopular_departments)]
-            .item_id.unique()
-            .tolist()
-        )
-        data = data[~data["item_id"].isin(items_in_unpopular_departments)]
+        department_size = item_features.groupby("department")["item_id"].nunique()
+        unpopular_departments = department_size[department_size < 150].index
+        items_in_unpopular_departments = item_features.loc[
+            item_features["department"].isin(unpopular_departments), "item_id"
+        ].unique()
+        fail(np.isin(item_ids, items_in_unpopular_departments), SMALL_DEPARTMENT)
 
     # 5.Remove too cheap items (we will not earn on them)
-    data["price"] = data["sales_value"] / np.maximum(data["quantity"], 1)
-    if lower_price_threshold is None:
-        lower_price_threshold = LOWER_PRICE_THRESHOLD
-    cheap_items = (
-        data.loc[data["price"] < lower_price_threshold, "item_id"].unique().tolist()
-    )
-    data = data[~data["item_id"].isin(cheap_items)]
+    fail((items["min_price"] < lower_price_threshold).to_numpy(), TOO_CHEAP)
 
     # 6.Remove too expensive_items.
     # They will be bought irrespective of our recommendations.
-    if upper_price_threshold is None:
-        upper_price_threshold = UPPER_PRICE_THRESHOLD
-    expensive_items = (
-        data.loc[data["price"] > upper_price_threshold, "item_id"].unique().tolist()
-    )
-    data = data[~data["item_id"].isin(expensive_items)]
+    fail((items["max_price"] > upper_price_threshold).to_numpy(), TOO_EXPENSIVE)
 
     # 7.Select top N popular items
-    popularity = data.groupby("item_id")["quantity"].sum().reset_index()
-    popularity.rename(columns={"quantity": "n_sold"}, inplace=True)
-    if take_n_popular is None:
-        take_n_popular = TAKE_N_POPULAR
+    kept = reason == TOP_N
+    popularity = pd.DataFrame(
+        {"item_id": item_ids[kept], "n_sold": items["n_sold"].to_numpy()[kept]}
+    )
     top = (
         popularity.sort_values("n_sold", ascending=False)
         .head(take_n_popular)
-        .item_id.tolist()
+        .index.to_numpy()
+    )
+    in_top = np.zeros(len(items), dtype=bool)
+    in_top[np.flatnonzero(kept)[top]] = True
+    fail(kept & ~in_top, NOT_IN_TOP_N)
+
+    decision = np.where(in_top, KEEP, np.where(reason == NOT_IN_TOP_N, REPLACE, DROP))
+    item_decisions = items.assign(share_unique_users=share_unique_users).reset_index()
+    item_decisions.insert(1, "decision", decision)
+    item_decisions.insert(2, "reason", reason)
+    item_decisions.attrs["version"] = item_stats.last_week
+
+    return item_decisions
+
+
+def apply_item_decisions(
+    data: Transactions, item_decisions: pd.DataFrame
+) -> Transactions:
+    """
+    Filters transactions with the item decision table in one pass:
+    rows of dropped items (and of items missing in the table) are removed,
+    items which are not in top N are replaced with FAKE_ITEM_ID;
+    price column is added. Lazy transactions are filtered while reading.
+    """
+
+    if not isinstance(data, pd.DataFrame):
+        return data.map_partitions(apply_item_decisions, item_decisions)
+
+    # Decisions of the rows are looked up by a hash join on item_id;
+    # -1 is the position of items missing in the table
+    item_id = data["item_id"].to_numpy()
+    pos = pd.Index(item_decisions["item_id"]).get_indexer(item_id)
+    decision = item_decisions["decision"].to_numpy()
+    keep = np.append(decision != DROP, False)
+    replace = np.append(decision == REPLACE, False)
+
+    rows = keep[pos]
+    replace = replace[pos[rows]]
+
+    price = _price(data)
+    data = data.take(np.flatnonzero(rows))
+    data["item_id"] = np.where(replace, FAKE_ITEM_ID, item_id[rows]).astype(
+        item_id.dtype
     )
+    data["price"] = price.array[rows]
+
+    return data
+
+
+def get_item_mapping(item_decisions: pd.DataFrame) -> pd.Series:
+    """
+    item_id of the transactions filtered by apply_item_decisions indexed
+    by item_id before the filter (dropped items are missing)
+    """
 
-    # Introduce fake item_id = 999999.
-    # If user has bought an item which is not from top-N, he bought an item 999999.
-    data.loc[~data["item_id"].isin(top), "item_id"] = 999999
+    item_decisions = item_decisions[item_decisions["decision"] != DROP]
+    item_ids = item_decisions["item_id"].to_numpy()
+
+    return pd.Series(
+        np.where(item_decisions["decision"] == REPLACE, FAKE_ITEM_ID, item_ids),
+        index=item_ids,
+    )
+
+
+def add_price(data: pd.DataFrame) -> pd.DataFrame:
+    """Adds price column of apply_item_decisions without filtering items"""
+
+    data = data.copy()
+    data["price"] = _price(data).to_numpy()
 
     return data
+
+
+def _price(data: pd.DataFrame) -> pd.Series:
+    return data["sales_value"] / np.maximum(data["quantity"], 1)
+
+
+def _get_item_users(
+    item_codes: np.ndarray, item_ids: np.ndarray, user_ids: np.ndarray
+) -> pd.DataFrame:
+    """
+    Distinct (item_id, user_id) pairs sorted by item_id and user_id
+    (item_codes - codes of the rows in sorted item_ids)
+    """
+
+    user_codes, users = pd.factorize(user_ids, sort=True)
+    n_users = max(len(users), 1)
+    pairs = item_codes.astype(np.int64) * n_users + user_codes
+    pairs.sort()
+    first = np.ones(len(pairs), dtype=bool)
+    np.not_equal(pairs[1:], pairs[:-1], out=first[1:])
+    pairs = pairs[first]
+
+    return pd.DataFrame(
+        {"item_id": item_ids[pairs // n_users], "user_id": users[pairs % n_users]}
+    )
+
+
+def _count_users(item_ids: np.ndarray, item_users: pd.DataFrame) -> np.ndarray:
+    """The number of distinct users of each item of item_ids (sorted)"""
+
+    pair_item_ids = item_users["item_id"].to_numpy()
+    starts = np.searchsorted(pair_item_ids, item_ids, side="left")
+    stops = np.searchsorted(pair_item_ids, item_ids, side="right")
+
+    return stops - starts
@@ -1,17 +1,80 @@
 import pandas as pd
 import numpy as np
-from scipy.sparse import csr_matrix
+from scipy.sparse import coo_matrix, csr_matrix
 from implicit.als import AlternatingLeastSquares
 from implicit.nearest_neighbours import ItemItemRecommender
 from implicit.nearest_neighbours import bm25_weight, tfidf_weight
+from .ann_index import IVFIndex
+
+BM25_K1 = 100
+BM25_B = 0.8
+# Users folded in at once: per-user Gram matrices are built for a batch only
+FOLD_IN_BATCH_SIZE = 1024
+
+
+class IdMapping:
+    """Mapping between ids (user_id or item_id) and matrix ids of implicit
+    Input
+    -----
+    ids: array-like
+        ids in the order of matrix rows / columns
+    """
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids)
+
+        # Sorted ids with their matrix ids for the reverse direction
+        order = np.argsort(self.ids, kind="stable")
+        if (order == np.arange(len(order))).all():
+            self._sorted_ids, self._order = self.ids, None
+        else:
+            self._sorted_ids, self._order = self.ids[order], order
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id_):
+        return self.encode(id_) >= 0
+
+    def encode(self, ids):
+        """Translates ids into matrix ids, unknown ids are encoded as -1"""
+
+        ids = np.asarray(ids)
+        if len(self.ids) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+
+        pos = np.searchsorted(self._sorted_ids, ids).clip(max=len(self.ids) - 1)
+        known = self._sorted_ids[pos] == ids
+        if self._order is not None:
+            pos = self._order[pos]
+
+        idx = np.where(known, pos, -1).astype(np.int64)
+
+        return idx if idx.ndim else int(idx)
+
+    def decode(self, idx):
+        """Translates matrix ids into ids"""
+
+        return self.ids[np.asarray(idx)]
+
+    def freeze(self):
+        """Makes the mapping arrays read-only"""
+
+        for array in (self.ids, self._sorted_ids, self._order):
+            if array is not None:
+                array.flags.writeable = False
 
 
 class MainRecommender:
     """Recommendations from ALS model and ItemItemRecommender
     Input
     -----
-    user_item_matrix: pd.DataFrame
-        Matrix of interactions user-item
+    data: pd.DataFrame
+        Transactions data used to build user_item_matrix,
+        sparse matrix of interactions user-item
+    ann_index: bool
+        Build IVF indices over ALS item and user factors for approximate
+        similar items / similar users search (ann_n_lists lists each)
     """
 
     def __init__(
@@ -22,6 +85,8 @@ class MainRecommender:
         regularization_ALS=0.001,
         iterations_ALS=15,
         num_threads_ALS=4,
+        ann_index=False,
+        ann_n_lists=None,
     ):
 
         self.n_factors = n_factors_ALS
@@ -49,61 +114,90 @@ class MainRecommender:
         self.overall_top_purchases = self.overall_top_purchases.item_id.tolist()
 
         # Prepare user_item_matrix and axillary dictionaries for implicit
-        self.user_item_matrix = self._prepare_matrix(data)
-        (
-            self.id_to_itemid,
-            self.id_to_userid,
-            self.itemid_to_id,
-            self.userid_to_id,
-        ) = self._prepare_dicts(self.user_item_matrix)
-
-        # Make bm25 weighting
+        self.user_item_matrix, userids, itemids = self._prepare_matrix(data)
+        self.user_mapping = IdMapping(userids)
+        self.item_mapping = IdMapping(itemids)
+
+        # Make bm25 weighting; idf of items and average length of users' rows
+        # are kept to weight purchases of new users the same way
+        self.bm25_idf, self.bm25_average_length = None, None
         if weighting:
-            self.user_item_matrix = bm25_weight(self.user_item_matrix.T).T
+            self.bm25_idf, self.bm25_average_length = self._bm25_statistics(
+                self.user_item_matrix
+            )
+            self.user_item_matrix = bm25_weight(
+                self.user_item_matrix, K1=BM25_K1, B=BM25_B
+            ).tocsr()
 
         # Train ALS model and ItemItemRecommender
         self.model = self.fit(self.user_item_matrix)
         self.own_recommender = self.fit_own_recommender(self.user_item_matrix)
 
+        # Approximate nearest neighbours indices over ALS factors
+        self.item_index, self.user_index = None, None
+        if ann_index:
+            self.item_index = IVFIndex(self.model.item_factors, n_lists=ann_n_lists)
+            self.user_index = IVFIndex(self.model.user_factors, n_lists=ann_n_lists)
+
     @staticmethod
     def _prepare_matrix(data):
-        """Prepares user_item_matrix for implicit"""
-        user_item_matrix = pd.pivot_table(
-            data,
-            index="item_id",
-            columns="user_id",
-            values="quantity",
-            aggfunc="count",
-            fill_value=0,
-        )
-        user_item_matrix = user_item_matrix.astype(float)
-
-        return user_item_matrix
+        """
+        Prepares sparse user_item_matrix (users x items) for implicit:
+        the number of purchases of each item by each user.
+        Returns the matrix and arrays of user_id and item_id corresponding
+        to its rows and columns.
+        """
 
-    @staticmethod
-    def _prepare_dicts(user_item_matrix):
-        """Prepares axillary dictionaries"""
+        user_codes, userids = pd.factorize(data["user_id"], sort=True)
+        item_codes, itemids = pd.factorize(data["item_id"], sort=True)
 
-        userids = user_item_matrix.columns.values
-        itemids = user_item_matrix.index.values
+        # Duplicated (user, item) entries are summed up into the counts
+        user_item_matrix = coo_matrix(
+            (np.ones(len(user_codes)), (user_codes, item_codes)),
+            shape=(len(userids), len(itemids)),
+        ).tocsr()
 
-        matrix_userids = np.arange(len(userids))
-        matrix_itemids = np.arange(len(itemids))
+        return user_item_matrix, np.asarray(userids), np.asarray(itemids)
 
-        id_to_itemid = dict(zip(matrix_itemids, itemids))
-        id_to_userid = dict(zip(matrix_userids, userids))
+    @staticmethod
+    def _bm25_statistics(user_item_matrix):
+        """idf of items and average row length used by bm25_weight"""
 
-        itemid_to_id = dict(zip(itemids, matrix_itemids))
-        userid_to_id = dict(zip(userids, matrix_userids))
+        n_users, n_items = user_item_matrix.shape
+        idf = np.log(n_users) - np.log1p(
+            np.bincount(user_item_matrix.indices, minlength=n_items)
+        )
+        average_length = user_item_matrix.sum(axis=1).mean()
+
+        return idf, average_length
+
+    def _weight(self, user_items):
+        """
+        Applies bm25 weighting of user_item_matrix to the rows of new users
+        (with idf and average length of the training matrix)
+        """
+
+        if self.bm25_idf is None:
+            return user_items
+
+        user_items = user_items.tocoo()
+        row_sums = np.ravel(user_items.sum(axis=1))
+        length_norm = (1.0 - BM25_B) + BM25_B * row_sums / self.bm25_average_length
+        user_items.data = (
+            user_items.data
+            * (BM25_K1 + 1.0)
+            / (BM25_K1 * length_norm[user_items.row] + user_items.data)
+            * self.bm25_idf[user_items.col]
+        )
 
-        return id_to_itemid, id_to_userid, itemid_to_id, userid_to_id
+        return user_items.tocsr()
 
     @staticmethod
     def fit_own_recommender(user_item_matrix):
         """Trains ItemItemRecommender, which recommends items from already bought by user"""
 
         own_recommender = ItemItemRecommender(K=1, num_threads=4)
-        own_recommender.fit(csr_matrix(user_item_matrix).T.tocsr())
+        own_recommender.fit(user_item_matrix)
 
         return own_recommender
 
@@ -116,99 +210,463 @@ class MainRecommender:
             iterations=self.iterations,
             num_threads=self.num_threads,
         )
-        model.fit(csr_matrix(user_item_matrix).T.tocsr())
+        model.fit(user_item_matrix)
 
         return model
 
-    def _update_dict(self, user_id):
-        """Updates dictionaries in case of new user / item"""
-
-        if user_id not in self.userid_to_id.keys():
-            max_id = max(list(self.userid_to_id.values()))
-            max_id += 1
-
-            self.userid_to_id.update({user_id: max_id})
-            self.id_to_userid.update({max_id: user_id})
-
     def _get_similar_item(self, item_id):
         """Finds item similar to item_id"""
 
         # As item is similar to itself, recommends 2 items (N=2)
-        recs = self.model.similar_items(self.itemid_to_id[item_id], N=2)
+        ids, _ = self.similar_items_batch([item_id], N=2)
         # Takes the 2nd item (not the item_id from this method's argument)
-        top_rec = recs[1][0]
-
-        return self.id_to_itemid[top_rec]
+        top_rec = ids[0, 1]
+
+        return top_rec
+
+    def similar_items_batch(self, item_ids, N=5, n_probe=None):
+        """
+        Items similar to a batch of items by cosine similarity of ALS factors;
+        the item itself is usually the first one.
+
+        If the recommender has an IVF index, the search is approximate
+        (n_probe lists are searched, see IVFIndex), otherwise it is exact.
+        Returns two arrays of shape (len(item_ids), N): item ids and
+        similarities; unknown items get -1 and nan.
+        """
+
+        return self._similar_batch(
+            self.item_mapping,
+            self.item_index,
+            self.model.similar_items,
+            self.model.item_factors,
+            item_ids,
+            N,
+            n_probe,
+        )
 
-    def _extend_with_top_popular(self, recommendations, N=5):
-        """If the number of recommendations is less than N, adds top purchases of all dataset"""
+    def similar_users_batch(self, user_ids, N=5, n_probe=None):
+        """The same as similar_items_batch for users"""
+
+        return self._similar_batch(
+            self.user_mapping,
+            self.user_index,
+            self.model.similar_users,
+            self.model.user_factors,
+            user_ids,
+            N,
+            n_probe,
+        )
 
-        if len(recommendations) < N:
-            recommendations.extend(self.overall_top_purchases[:N])
-            recommendations = recommendations[:N]
+    def _similar_batch(self, mapping, index, similar, factors, ids, N, n_probe):
+        idx = mapping.encode(np.atleast_1d(np.asarray(ids)))
+        known = idx >= 0
+
+        similar_idx = np.full((len(idx), N), -1, dtype=np.int64)
+        scores = np.full((len(idx), N), np.nan, dtype=np.float32)
+        if known.any():
+            if index is not None:
+                found, found_scores = index.search(
+                    factors[idx[known]], N=N, n_probe=n_probe
+                )
+            else:
+                found, found_scores = similar(idx[known], N=N)
+            n = found.shape[1]
+            similar_idx[known, :n], scores[known, :n] = found, found_scores
+
+        found = similar_idx >= 0
+        similar_ids = np.where(
+            found, mapping.decode(np.where(found, similar_idx, 0)), -1
+        )
 
-        return recommendations
+        return similar_ids, scores
 
     def _get_recommendations(self, user, model, N=5):
         """Recommendations from implicit (standard libraries)"""
 
-        self._update_dict(user_id=user)
-        res = [
-            self.id_to_itemid[rec]
-            for rec in model.recommend(
-                userid=self.userid_to_id[user],
-                user_items=csr_matrix(self.user_item_matrix).tocsr(),
-                N=N,
-                filter_already_liked_items=False,
-                # filter_items=[self.itemid_to_id[999999]],
-                recalculate_user=True,
-            )[0]
-        ][:N]
-        res = self._extend_with_top_popular(res, N=N)
+        res = self.recommend_batch([user], N=N, model=model)[0][0].tolist()
         assert len(res) == N, f"The number of recommendations != {N}, user_id = {user}"
 
         return res
 
+    def recommend_batch(self, user_ids, N=5, model=None, recent_purchases=None):
+        """
+        Recommendations for a batch of users from one implicit recommend call
+
+        Returns two arrays of shape (len(user_ids), N): item ids and scores.
+
+        Users unknown to the recommender go down the cold-start path:
+        if recent_purchases (transactions with columns user_id, item_id)
+        contain their purchases, recommendations are calculated from them
+        (ALS factors of the users are folded in), otherwise
+        they get top purchases of all dataset. Lists shorter than N are completed
+        with top purchases of all dataset as well (their scores are NaN).
+        The model state is never modified.
+        """
+
+        if model is None:
+            model = self.model
+
+        user_ids = np.asarray(user_ids)
+        user_idx = self.user_mapping.encode(user_ids)
+        known = user_idx >= 0
+
+        item_ids = np.full((len(user_idx), N), -1, dtype=np.int64)
+        scores = np.full((len(user_idx), N), np.nan, dtype=np.float32)
+        if known.any():
+            item_ids[known], scores[known] = self._recommend_rows(
+                model, user_idx[known], self.user_item_matrix[user_idx[known]], N
+            )
+
+        cold = np.flatnonzero(~known)
+        if recent_purchases is not None and len(cold):
+            user_items = self._get_user_items(user_ids[cold], recent_purchases)
+            has_purchases = user_items.getnnz(axis=1) > 0
+            if has_purchases.any():
+                rows = cold[has_purchases]
+                if model is self.model:
+                    item_ids[rows], scores[rows] = self._recommend_from_factors(
+                        self.fold_in(user_items[has_purchases]), N
+                    )
+                else:
+                    item_ids[rows], scores[rows] = self._recommend_rows(
+                        model,
+                        np.zeros(len(rows), dtype=np.int64),
+                        user_items[has_purchases],
+                        N,
+                    )
+
+        self._fill_with_top_popular(item_ids)
+        assert (item_ids >= 0).all(), f"The number of recommendations != {N}"
+
+        return item_ids, scores
+
+    def _recommend_rows(self, model, user_idx, user_items, N):
+        """Calls implicit recommend and translates the result into item_id"""
+
+        ids, scores = model.recommend(
+            userid=user_idx,
+            user_items=user_items,
+            N=N,
+            filter_already_liked_items=False,
+            recalculate_user=True,
+        )
+        ids = np.asarray(ids).reshape(-1, N)
+        found = ids >= 0
+
+        return (
+            np.where(found, self.item_mapping.decode(ids), -1),
+            np.where(found, scores, np.nan),
+        )
+
+    def _get_user_items(self, user_ids, purchases):
+        """
+        Prepares users x items matrix of the users from purchases weighted
+        like user_item_matrix; items unknown to the recommender are ignored.
+
+        purchases - transactions with columns user_id, item_id; the number
+                    of purchases is the number of rows of the user-item pair
+                    or the sum of column "count" if it is present.
+        """
+
+        rows = pd.Index(user_ids).get_indexer(purchases["user_id"])
+        cols = self.item_mapping.encode(purchases["item_id"].values)
+        mask = (rows >= 0) & (cols >= 0)
+        if "count" in purchases.columns:
+            counts = purchases["count"].values[mask].astype(np.float64)
+        else:
+            counts = np.ones(mask.sum())
+
+        user_items = coo_matrix(
+            (counts, (rows[mask], cols[mask])),
+            shape=(len(user_ids), len(self.item_mapping)),
+        ).tocsr()
+
+        return self._weight(user_items)
+
+    def _get_gram(self):
+        """Item factors (float64) and their Gram matrix YtY + regularization * I"""
+
+        gram = getattr(self, "_gram", None)
+        if gram is None:
+            Y = self.model.item_factors.astype(np.float64)
+            gram = (Y, Y.T @ Y + self.model.regularization * np.eye(Y.shape[1]))
+            self._gram = gram
+        return gram
+
+    def fold_in(self, user_items, batch_size=None):
+        """
+        Calculates ALS factors of new users without retraining
+
+        Solves ALS least squares step against the item factors for all rows
+        of user_items (users x items confidence matrix weighted like
+        user_item_matrix), vectorised over batches of batch_size users
+        (FOLD_IN_BATCH_SIZE by default):
+            (YtY + regularization * I + Yt(Cu - I)Y) xu = YtCu pu
+        """
+
+        if batch_size is None:
+            batch_size = FOLD_IN_BATCH_SIZE
+
+        user_items = csr_matrix(user_items)
+        n_users = user_items.shape[0]
+
+        return np.concatenate(
+            [
+                self._fold_in_batch(user_items[start : start + batch_size])
+                for start in range(0, max(n_users, 1), batch_size)
+            ]
+        )
+
+    def _fold_in_batch(self, user_items):
+        """
+        fold_in of a batch of users: the matrices of their least squares
+        steps and the outer products of their items take
+        O((n_users + n_items of the batch) * n_factors ** 2) memory
+        """
+
+        Y, gram = self._get_gram()
+        user_items = user_items * self.model.alpha
+        n_users, n_factors = user_items.shape[0], Y.shape[1]
+
+        # Only the items present in user_items take part in the correction
+        items, cols = np.unique(user_items.indices, return_inverse=True)
+        Y_items = Y[items]
+        confidence = user_items.data
+
+        correction = csr_matrix(
+            (np.abs(confidence) - 1, cols, user_items.indptr),
+            shape=(n_users, len(items)),
+        ) @ (Y_items[:, :, None] * Y_items[:, None, :]).reshape(
+            len(items), n_factors * n_factors
+        )
+        A = gram + correction.reshape(n_users, n_factors, n_factors)
+
+        b = (
+            csr_matrix(
+                (np.maximum(confidence, 0), cols, user_items.indptr),
+                shape=(n_users, len(items)),
+            )
+            @ Y_items
+        )
+
+        return np.linalg.solve(A, b[:, :, None])[:, :, 0].astype(np.float32)
+
+    def fold_in_users(self, user_ids, purchases):
+        """
+        ALS factors of the users calculated from their purchases
+        (transactions with columns user_id, item_id and optional "count")
+        """
+
+        return self.fold_in(self._get_user_items(np.asarray(user_ids), purchases))
+
+    def recommend_fold_in(self, user_ids, purchases, N=5):
+        """
+        ALS recommendations for the users calculated from the purchases only
+        (e.g. fresh purchases of new users), the model is not retrained.
+
+        Returns two arrays of shape (len(user_ids), N): item ids and scores;
+        users without purchases get top purchases of all dataset.
+        """
+
+        user_items = self._get_user_items(np.asarray(user_ids), purchases)
+        has_purchases = user_items.getnnz(axis=1) > 0
+
+        item_ids = np.full((len(user_ids), N), -1, dtype=np.int64)
+        scores = np.full((len(user_ids), N), np.nan, dtype=np.float32)
+        if has_purchases.any():
+            (
+                item_ids[has_purchases],
+                scores[has_purchases],
+            ) = self._recommend_from_factors(self.fold_in(user_items[has_purchases]), N)
+        self._fill_with_top_popular(item_ids)
+
+        return item_ids, scores
+
+    def _recommend_from_factors(self, user_factors, N):
+        """Top-N items by the dot product of user factors and item factors"""
+
+        item_factors = self.model.item_factors
+        scores = user_factors @ item_factors.T
+        n = min(N, scores.shape[1])
+        if n < scores.shape[1]:
+            top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        else:
+            top = np.tile(np.arange(n), (len(scores), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+
+        ids = np.full((len(scores), N), -1, dtype=np.int64)
+        ids[:, :n] = self.item_mapping.decode(top)
+        top_scores = np.full((len(scores), N), np.nan, dtype=np.float32)
+        top_scores[:, :n] = np.take_along_axis(scores, top, axis=1)
+
+        return ids, top_scores
+
+    def _fill_with_top_popular(self, item_ids):
+        """
+        Completes lists of recommendations with top purchases of all dataset;
+        the found items (>= 0) of each row should come first
+        """
+
+        N = item_ids.shape[1]
+        top = self._get_top_popular()[:N]
+        n_found = (item_ids >= 0).sum(axis=1, keepdims=True)
+        fill_pos = np.arange(N) - n_found
+        mask = (fill_pos >= 0) & (fill_pos < len(top))
+        item_ids[mask] = top[fill_pos[mask]]
+
+    def _get_top_popular(self):
+        """Top purchases of all dataset as an array"""
+
+        top = getattr(self, "_top_popular", None)
+        if top is None:
+            top = np.asarray(self.overall_top_purchases, dtype=np.int64)
+        return top
+
+    def freeze(self):
+        """
+        Switches the recommender to read-only serving mode.
+
+        Caches which would otherwise be filled lazily by the first requests
+        are calculated in advance and arrays of the recommender are made
+        read-only, so serving requests never write into the shared model state.
+        """
+
+        self._top_popular = np.asarray(self.overall_top_purchases, dtype=np.int64)
+        self._top_popular.flags.writeable = False
+        self.user_mapping.freeze()
+        self.item_mapping.freeze()
+
+        # Norms for similar_items / similar_users, YtY for recalculate_user
+        # and the Gram matrix for fold_in
+        self.model.item_norms
+        self.model.user_norms
+        self.model.YtY
+        self._get_gram()
+        for array in self._get_top_purchases_index():
+            array.flags.writeable = False
+        for index in (
+            getattr(self, "item_index", None),
+            getattr(self, "user_index", None),
+        ):
+            if index is not None:
+                index.freeze()
+
+        return self
+
     def get_als_recommendations(self, user, N=5):
         """Recommendations from implicit (standard libraries)"""
 
-        self._update_dict(user_id=user)
         return self._get_recommendations(user, model=self.model, N=N)
 
     def get_own_recommendations(self, user, N=5):
         """Recommendations from the items, which the user has already bought"""
 
-        self._update_dict(user_id=user)
         return self._get_recommendations(user, model=self.own_recommender, N=N)
 
     def get_similar_items_recommendation(self, user, N=5):
         """Recommendations of items similar to top-N bought by the"""
 
-        top_users_purchases = self.top_purchases[
-            self.top_purchases["user_id"] == user
-        ].head(N)
-        res = (
-            top_users_purchases["item_id"]
-            .apply(lambda x: self._get_similar_item(x))
-            .tolist()
-        )
-        res = self._extend_with_top_popular(res, N=N)
+        res = self.similar_items_recommend_batch([user], N=N)[0].tolist()
         assert len(res) == N, f"The number of recommendations != {N}"
 
         return res
 
+    def similar_items_recommend_batch(self, user_ids, N=5):
+        """
+        Recommendations of items similar to top-N bought by each user
+        for a batch of users
+
+        Top-N purchases of the users are taken from the per-user index of
+        top_purchases, the most similar item of every distinct purchased
+        item is found with one similar_items_batch call.
+        Returns an array of shape (len(user_ids), N) of item ids.
+        """
+
+        return self.similar_items_recommend_scores(user_ids, N=N)[0]
+
+    def similar_items_recommend_scores(self, user_ids, N=5):
+        """
+        The same as similar_items_recommend_batch, returns two arrays:
+        item ids and their similarities to the purchased items (NaN for
+        top purchases of all dataset completing the lists)
+        """
+
+        users, offsets, items = self._get_top_purchases_index()
+        user_ids = np.atleast_1d(np.asarray(user_ids))
+
+        # First N rows of each user (-1 for missing ones)
+        item_ids = np.full((len(user_ids), N), -1, dtype=np.int64)
+        if len(users):
+            pos = np.searchsorted(users, user_ids).clip(max=len(users) - 1)
+            known = users[pos] == user_ids
+            starts = np.where(known, offsets[pos], 0)
+            counts = np.where(known, np.minimum(offsets[pos + 1] - starts, N), 0)
+            cols = np.arange(N)
+            mask = cols < counts[:, None]
+            item_ids[mask] = items[(starts[:, None] + cols)[mask]]
+
+        # The most similar item of each distinct item
+        scores = np.full(item_ids.shape, np.nan, dtype=np.float32)
+        bought = item_ids >= 0
+        distinct, inverse = np.unique(item_ids[bought], return_inverse=True)
+        if len(distinct):
+            # As item is similar to itself, takes the 2nd one (N=2)
+            similar, similarities = self.similar_items_batch(distinct, N=2)
+            item_ids[bought] = similar[inverse, 1]
+            scores[bought] = similarities[inverse, 1]
+
+            # Items without a similar one (unknown or without neighbours
+            # in the index) leave gaps, found items are moved to the front
+            order = np.argsort(item_ids < 0, axis=1, kind="stable")
+            item_ids = np.take_along_axis(item_ids, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+
+        self._fill_with_top_popular(item_ids)
+
+        return item_ids, scores
+
+    def _get_top_purchases_index(self):
+        """
+        top_purchases grouped by user: sorted user ids, offsets of their rows
+        and item ids in the order of top_purchases within each user
+        """
+
+        index = getattr(self, "_top_purchases_index", None)
+        if index is None:
+            user_ids = self.top_purchases["user_id"].to_numpy()
+            order = np.argsort(user_ids, kind="stable")
+            users, starts = np.unique(user_ids[order], return_index=True)
+            index = (
+                users,
+                np.append(starts, len(order)),
+                self.top_purchases["item_id"].to_numpy()[order],
+            )
+            self._top_purchases_index = index
+
+        return index
+
     def get_similar_users_recommendation(self, user, N=5):
         """Recommend top-N items among the ones bought by the most similar user"""
 
-        # Find the most similar user (N=2) and
-        # eliminate the current user from request
-        similar_user = self.model.similar_users(self.userid_to_id[user], N=2)[
-            0
-        ].tolist()[1]
-
-        res = self.get_own_recommendations(similar_user, N)
-
-        res = self._extend_with_top_popular(res, N)
+        res = self.similar_users_recommend_batch([user], N=N)[0][0].tolist()
         assert len(res) == N, f"The number of recommendations != {N}"
 
         return res
+
+    def similar_users_recommend_batch(self, user_ids, N=5):
+        """
+        Recommendations of the own recommender of the most similar user
+        for a batch of users
+
+        Returns two arrays of shape (len(user_ids), N): item ids and scores;
+        users without a similar one get top purchases of all dataset.
+        """
+
+        # Find the most similar user (N=2) and
+        # eliminate the current user from request
+        similar_users = self.similar_users_batch(user_ids, N=2)[0][:, 1]
+
+        return self.recommend_batch(similar_users, N=N, model=self.own_recommender)
@@ -2,52 +2,179 @@ import logging
 import numpy as np
 import pandas as pd
 from pickle import dump
-from typing import Optional
+from typing import List, Optional, Tuple
+from .new_item_user_features import UserItemFeatures, Embeddings
+from .candidates_lvl_2 import RETRIEVER_FEATURES
 
 logger = logging.getLogger(__name__)
 
 __all__ = ["generate_targets"]
 
-N_ITEMS = 300
+# Features gathered from a table: column names, their values (rows of the
+# table) and the row of the table for each candidate (-1 if there is none)
+Block = Tuple[List[str], List[np.ndarray], np.ndarray]
 
 
 def get_targets_lvl_2(
-    users_lvl_2: pd.DataFrame,
+    candidates: pd.DataFrame,
     data_train_lvl_2: pd.DataFrame,
     item_features_transformed: pd.DataFrame,
     user_features_transformed: pd.DataFrame,
-    user_item_features: pd.DataFrame,
-    n_items: Optional[int] = None,
+    user_item_features: UserItemFeatures,
+    embeddings: Optional[Embeddings] = None,
+    dtype=np.float32,
 ) -> pd.DataFrame:
     """
     Generates targets for candidates from level 2 (data_train_lvl_2 6-week period,
-    which was validation period for level 1).
+    which was validation period for level 1); candidates is the long table
+    of get_candidates with one row per user and item, scores and ranks
+    of the retrievers (RETRIEVER_FEATURES) are kept as features.
+
+    Features of the items, the users and the user-item pairs are joined
+    from the tables of user_item_features by their unique keys; item and
+    user factors of embeddings are gathered for the candidates.
+
+    User and item ids are encoded to dense codes, targets are found by
+    a sorted membership test of the codes of the pairs and all the features
+    are gathered by row indices into one preallocated matrix of dtype
+    (NaN for the candidates missing from a table), so no wide frame is
+    merged or deduplicated. Returns user_id, item_id, RETRIEVER_FEATURES,
+    target and the features in the order of the tables.
     """
 
     logging.info("Generating targets for level 2...")
 
-    if n_items is None:
-        n_items = N_ITEMS
+    user_codes, users = pd.factorize(candidates["user_id"])
+    item_codes, items = pd.factorize(candidates["item_id"])
+    pairs = user_codes.astype(np.int64) * len(items) + item_codes
 
-    df = pd.DataFrame(
-        {
-            "user_id": users_lvl_2["user_id"].values.repeat(n_items),
-            "item_id": np.concatenate(users_lvl_2["candidates"].values, axis=None),
-        }
-    )
-    targets_lvl_2 = data_train_lvl_2[["user_id", "item_id"]].copy()
-    targets_lvl_2["target"] = 1  # Here we have only purchases
-    targets_lvl_2 = df.merge(targets_lvl_2, on=["user_id", "item_id"], how="left")
-    targets_lvl_2["target"].fillna(0, inplace=True)
+    # Repeated pairs keep the first row
+    _, first = np.unique(pairs, return_index=True)
+    if len(first) < len(pairs):
+        first.sort()
+        user_codes, item_codes, pairs = (
+            user_codes[first],
+            item_codes[first],
+            pairs[first],
+        )
+    else:
+        first = np.arange(len(pairs))
 
-    targets_lvl_2 = targets_lvl_2.merge(
-        item_features_transformed, on="item_id", how="left"
-    )
-    targets_lvl_2 = targets_lvl_2.merge(
-        user_features_transformed, on="user_id", how="left"
+    # Here we have only purchases
+    purchases = _encode_pairs(data_train_lvl_2, users, items)
+    target = np.isin(pairs, purchases).astype(dtype)
+
+    blocks: List[Block] = [
+        (
+            RETRIEVER_FEATURES,
+            [candidates[name].to_numpy() for name in RETRIEVER_FEATURES],
+            first,
+        ),
+        (["target"], [target], np.arange(len(pairs))),
+        _table_block(
+            item_features_transformed.reset_index(),
+            ["item_id"],
+            _lookup(item_features_transformed.index, items)[item_codes],
+        ),
+    ]
+    for table, keys in [
+        (user_features_transformed, ["user_id"]),
+        (user_item_features.items, ["item_id"]),
+        (user_item_features.users, ["user_id"]),
+    ]:
+        uniques, codes = (
+            (users, user_codes) if keys == ["user_id"] else (items, item_codes)
+        )
+        blocks.append(
+            _table_block(table, keys, _lookup(table[keys[0]], uniques)[codes])
+        )
+
+    user_items = user_item_features.user_items
+    table_pairs = _encode_pairs(user_items, users, items)
+    found = np.flatnonzero(table_pairs >= 0)
+    rows = _lookup(table_pairs[found], pairs)
+    blocks.append(
+        _table_block(
+            user_items, ["user_id", "item_id"], np.where(rows >= 0, found[rows], -1)
+        )
     )
-    targets_lvl_2 = targets_lvl_2.merge(
-        user_item_features, on=["user_id", "item_id"], how="left"
-    ).drop_duplicates()
+
+    if embeddings is not None:
+        for prefix, mapping, factors, uniques, codes in [
+            (
+                "factor_",
+                embeddings.item_mapping,
+                embeddings.item_factors,
+                items,
+                item_codes,
+            ),
+            (
+                "user_factor_",
+                embeddings.user_mapping,
+                embeddings.user_factors,
+                users,
+                user_codes,
+            ),
+        ]:
+            blocks.append(
+                (
+                    [prefix + str(i + 1) for i in range(factors.shape[1])],
+                    list(factors.T),
+                    mapping.encode(uniques.to_numpy())[codes],
+                )
+            )
+
+    names = [name for block_names, _, _ in blocks for name in block_names]
+    matrix = np.empty((len(pairs), len(names)), dtype=dtype, order="F")
+    position = 0
+    for _, columns, rows in blocks:
+        missing = rows < 0
+        for values in columns:
+            if len(values):
+                np.take(
+                    values.astype(dtype, copy=False),
+                    rows,
+                    out=matrix[:, position],
+                    mode="clip",
+                )
+                matrix[missing, position] = np.nan
+            else:
+                matrix[:, position] = np.nan
+            position += 1
+
+    targets_lvl_2 = pd.DataFrame(matrix, columns=names, copy=False)
+    targets_lvl_2.insert(0, "user_id", users.to_numpy()[user_codes])
+    targets_lvl_2.insert(1, "item_id", items.to_numpy()[item_codes])
 
     return targets_lvl_2
+
+
+def _table_block(table: pd.DataFrame, keys: List[str], rows: np.ndarray) -> Block:
+    """Features of the columns of table except for the keys"""
+
+    names = [name for name in table.columns if name not in keys]
+
+    return (
+        names,
+        [table[name].to_numpy() for name in names],
+        rows,
+    )
+
+
+def _encode_pairs(data: pd.DataFrame, users: pd.Index, items: pd.Index) -> np.ndarray:
+    """
+    Codes of the pairs user_id, item_id of data (as the codes of candidates);
+    pairs with users or items missing from the candidates get -1
+    """
+
+    user_codes = users.get_indexer(data["user_id"])
+    item_codes = items.get_indexer(data["item_id"])
+    found = (user_codes >= 0) & (item_codes >= 0)
+
+    return np.where(found, user_codes.astype(np.int64) * len(items) + item_codes, -1)
+
+
+def _lookup(keys, values) -> np.ndarray:
+    """Positions of values in unique keys (-1 if missing)"""
+
+    return pd.Index(keys).get_indexer(values)
@@ -0,0 +1,75 @@
+import logging
+import threading
+from typing import Any, Optional
+
+from .load_artifacts import InferenceArtifacts, load_inference_artifacts
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["ArtifactRegistry", "registry"]
+
+
+class ArtifactRegistry:
+    """
+    Keeps one set of inference artifacts resident in memory and shares it
+    between requests.
+
+    A new artifact set is loaded completely before it replaces the current one,
+    so a request always works with a consistent set: either the old one or
+    the new one, never a mixture of both.
+    """
+
+    def __init__(self) -> None:
+        self._artifacts: Optional[InferenceArtifacts] = None
+        self._version = 0
+        self._load_lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        """The number of artifact sets published in the registry"""
+
+        return self._version
+
+    def load(self, classifier: Any = None, **paths) -> InferenceArtifacts:
+        """
+        Loads artifacts with load_inference_artifacts (paths are passed to it
+        as keyword arguments) and publishes them in the registry together
+        with the classifier in one swap.
+        """
+
+        with self._load_lock:
+            logging.info("Loading inference artifacts...")
+            artifacts = load_inference_artifacts(**paths)._replace(
+                classifier=classifier
+            )
+            self._publish(artifacts)
+
+        return artifacts
+
+    def get(self) -> InferenceArtifacts:
+        """
+        Returns the current artifact set; the artifacts are loaded from
+        the default paths if nothing has been published yet.
+        """
+
+        artifacts = self._artifacts
+        if artifacts is None:
+            with self._load_lock:
+                artifacts = self._artifacts
+                if artifacts is None:
+                    logging.info("Loading inference artifacts...")
+                    artifacts = load_inference_artifacts()
+                    self._publish(artifacts)
+
+        return artifacts
+
+    def _publish(self, artifacts: InferenceArtifacts) -> None:
+        # Rebinding of the attribute is atomic, requests which have already
+        # taken the previous set keep working with it.
+        self._artifacts = artifacts
+        self._version += 1
+        logging.info(f"Inference artifacts version {self._version} published")
+
+
+registry = ArtifactRegistry()
@@ -5,18 +5,27 @@ sys.path.append(os.getcwd())
 sys.path.append(os.path.join(os.getcwd(), "src", "recsys_retail"))
 
 import pandas as pd
-from .load_artifacts import load_inference_artifacts
+from typing import Optional
+from .artifact_registry import registry
+from .load_artifacts import InferenceArtifacts
 from features.candidates_lvl_2 import get_candidates
 from features.targets import get_targets_lvl_2
+from features.new_item_user_features import get_embeddings
 
 N_ITEMS = 100
 
 
-def preprocess(user_ids, user_list=False) -> pd.DataFrame:
+def preprocess(
+    user_ids, user_list=False, artifacts: Optional[InferenceArtifacts] = None
+) -> pd.DataFrame:
     """
     Preprocesses user_id  for inference
 
+    artifacts - inference artifacts; by default the artifacts resident
+                in the registry are used.
     """
+    if artifacts is None:
+        artifacts = registry.get()
     (
         current_user_list,
         data_valid,
@@ -24,21 +33,26 @@ def preprocess(user_ids, user_list=False) -> pd.DataFrame:
         user_features_transformed,
         item_features_transformed,
         user_item_features,
-    ) = load_inference_artifacts()
+        user_item_index,
+        _,
+    ) = artifacts
 
     if not user_list:
         user_ids = [user_ids]
-    new_users = list(set(user_ids) - set(current_user_list))
+    new_users = list(set(user_ids) - current_user_list)
     df = pd.DataFrame(user_ids, index=range(len(user_ids)), columns=["user_id"])
 
-    users_inference = get_candidates(recommender, data_valid, df, n_items=N_ITEMS)
+    # Transactions of the requested users only
+    data_valid = data_valid.get_users(user_ids)
+
+    candidates = get_candidates(recommender, data_valid, df, n_items=N_ITEMS)
     train_dataset_lvl_2 = get_targets_lvl_2(
-        users_inference,
+        candidates,
         data_valid,
         item_features_transformed,
         user_features_transformed,
-        user_item_features,
-        n_items=N_ITEMS,
+        user_item_features._replace(user_items=user_item_index.get_users(user_ids)),
+        embeddings=get_embeddings(recommender),
     )
 
     return train_dataset_lvl_2.drop("target", axis=1).fillna(0), new_users
@@ -1,7 +1,19 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), "src", "recsys_retail"))
+
+import re
+import glob
 import logging
 import joblib
 import pandas as pd
-from typing import Optional, Tuple
+from typing import Any, List, NamedTuple, Optional
+from features.feature_index import UserItemFeatureIndex
+from features.prefilter import ItemStats
+from features.new_item_user_features import UserItemFeatures
+from data.aggregate_states import AggregateStates, join_week_partials
 
 PATH = ""
 
@@ -9,9 +21,31 @@ FOLDER = "data/04_feature/"
 CURRENT_USER_LIST_PATH = FOLDER + "current_user_list.joblib"
 DATA_VALID_PATH = FOLDER + "data_valid.parquet.gzip"
 RECOMMENDER_PATH = FOLDER + "recommender_v1.joblib"
+DESCRIPTION_ENCODER_PATH = FOLDER + "description_encoder.joblib"
 ITEM_FEATURES_TRANSFORMED_PATH = FOLDER + "item_features_transformed.parquet.gzip"
 USER_FEATURES_TRANSFORMED_PATH = FOLDER + "user_features_transformed.parquet.gzip"
 USER_ITEM_FEATURES_PATH = FOLDER + "user_item_features.parquet.gzip"
+FEATURE_TABLES_PATH = FOLDER + "user_item_features_{table}.parquet.gzip"
+ITEM_DECISIONS_PATH = FOLDER + "item_decisions_v{version}.parquet.gzip"
+ITEM_STATS_PATH = FOLDER + "item_stats_v{version}.parquet.gzip"
+ITEM_USERS_PATH = FOLDER + "item_users_v{version}.parquet.gzip"
+AGGREGATE_STATES_PATH = FOLDER + "aggregate_states_w{version}.joblib"
+
+
+class InferenceArtifacts(NamedTuple):
+    """
+    Set of artifacts used by preprocess function for inference and
+    the classifier applied to its output (None if it is not loaded).
+    """
+
+    current_user_list: frozenset
+    data_valid: UserItemFeatureIndex
+    recommender: Any
+    user_features_transformed: pd.DataFrame
+    item_features_transformed: pd.DataFrame
+    user_item_features: UserItemFeatures
+    user_item_index: UserItemFeatureIndex
+    classifier: Any = None
 
 
 def load_inference_artifacts(
@@ -22,25 +56,29 @@ def load_inference_artifacts(
     user_features_transformed_path: Optional[str] = None,
     item_features_transformed_path: Optional[str] = None,
     user_item_features_path: Optional[str] = None,
-) -> Tuple:
+    feature_tables_path: Optional[str] = None,
+) -> InferenceArtifacts:
     """
     Loads current_user_list, data_valid, recommender, user_features_transformed,
-    item_features_transformed, user_item_features for inference
+    item_features_transformed, user_item_features for inference;
+    data_valid and user_items table of user_item_features are indexed
+    by user_id and (user_id, item_id), the recommender is switched
+    to read-only serving mode.
     """
     if path is None:
         path = PATH
 
     if current_user_list_path is None:
         current_user_list_path = CURRENT_USER_LIST_PATH
-    current_user_list = joblib.load(current_user_list_path)
+    current_user_list = frozenset(joblib.load(current_user_list_path))
 
     if data_valid_path is None:
         data_valid_path = path + DATA_VALID_PATH
-    data_valid = pd.read_parquet(data_valid_path)
+    data_valid = UserItemFeatureIndex(pd.read_parquet(data_valid_path))
 
     if recommender_path is None:
         recommender_path = path + RECOMMENDER_PATH
-    recommender = joblib.load(recommender_path)
+    recommender = joblib.load(recommender_path).freeze()
 
     if user_features_transformed_path is None:
         user_features_transformed_path = path + USER_FEATURES_TRANSFORMED_PATH
@@ -50,15 +88,168 @@ def load_inference_artifacts(
         item_features_transformed_path = path + ITEM_FEATURES_TRANSFORMED_PATH
     item_features_transformed = pd.read_parquet(item_features_transformed_path)
 
-    if user_item_features_path is None:
-        user_item_features_path = path + USER_ITEM_FEATURES_PATH
-    user_item_features = pd.read_parquet(user_item_features_path)
+    user_item_features = load_user_item_features(
+        path, user_item_features_path, feature_tables_path
+    )
+    user_item_index = UserItemFeatureIndex(user_item_features.user_items)
+
+    # The index keeps its own sorted copy of user_items, it is shared
+    user_item_features = user_item_features._replace(
+        user_items=user_item_index.features
+    )
 
-    return (
+    return InferenceArtifacts(
         current_user_list,
         data_valid,
         recommender,
         user_features_transformed,
         item_features_transformed,
         user_item_features,
+        user_item_index,
+    )
+
+
+def load_user_item_features(
+    path: Optional[str] = None,
+    user_item_features_path: Optional[str] = None,
+    feature_tables_path: Optional[str] = None,
+) -> UserItemFeatures:
+    """Loads the tables of user_item_features saved by save_user_item_features"""
+
+    if path is None:
+        path = PATH
+    if user_item_features_path is None:
+        user_item_features_path = path + USER_ITEM_FEATURES_PATH
+    if feature_tables_path is None:
+        feature_tables_path = path + FEATURE_TABLES_PATH
+
+    return UserItemFeatures(
+        pd.read_parquet(user_item_features_path),
+        *[
+            pd.read_parquet(feature_tables_path.format(table=table))
+            for table in UserItemFeatures._fields[1:]
+        ],
+    )
+
+
+def load_description_encoder(
+    path: Optional[str] = None, description_encoder_path: Optional[str] = None
+):
+    """
+    Loads the encoder of item descriptions fitted on train dataset
+    (see features.item_features.fit_description_encoder) to encode unseen items.
+    """
+    if path is None:
+        path = PATH
+    if description_encoder_path is None:
+        description_encoder_path = path + DESCRIPTION_ENCODER_PATH
+
+    return joblib.load(description_encoder_path)
+
+
+def load_item_decisions(
+    version: Optional[int] = None,
+    path: Optional[str] = None,
+    item_decisions_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Loads the item decision table of prefilter of the given version
+    (the last one by default).
+    """
+    if path is None:
+        path = PATH
+    if item_decisions_path is None:
+        item_decisions_path = path + ITEM_DECISIONS_PATH
+    if version is None:
+        version = get_last_version(item_decisions_path)
+
+    item_decisions = pd.read_parquet(item_decisions_path.format(version=version))
+    item_decisions.attrs["version"] = version
+
+    return item_decisions
+
+
+def load_item_stats(
+    version: Optional[int] = None,
+    path: Optional[str] = None,
+    item_stats_path: Optional[str] = None,
+    item_users_path: Optional[str] = None,
+) -> ItemStats:
+    """
+    Loads item statistics of prefilter of the given version (the last one
+    by default) to refresh them with new weeks of data.
+    """
+    if path is None:
+        path = PATH
+    if item_stats_path is None:
+        item_stats_path = path + ITEM_STATS_PATH
+    if item_users_path is None:
+        item_users_path = path + ITEM_USERS_PATH
+    if version is None:
+        version = get_last_version(item_stats_path)
+
+    return ItemStats(
+        pd.read_parquet(item_stats_path.format(version=version)),
+        pd.read_parquet(item_users_path.format(version=version)),
+        version,
     )
+
+
+def load_aggregate_states(
+    path: Optional[str] = None,
+    aggregate_states_path: Optional[str] = None,
+) -> AggregateStates:
+    """
+    Loads aggregate states of the saved weeks to refresh them with new
+    weeks of data; weeks saved with another key than the last week's
+    one are outdated and skipped. The item_ids of each aggregation are
+    the ones of its last week: weeks corrected for new item_ids are saved
+    again, the other ones are the same with both.
+    """
+
+    if path is None:
+        path = PATH
+    if aggregate_states_path is None:
+        aggregate_states_path = path + AGGREGATE_STATES_PATH
+
+    week_partials = {}
+    item_ids: dict = {}
+    key = None
+    for week in sorted(get_versions(aggregate_states_path), reverse=True):
+        week_key, week_item_ids, partials = joblib.load(
+            aggregate_states_path.format(version=week)
+        )
+        if key is None:
+            key = week_key
+        if week_key == key:
+            week_partials[week] = partials
+            for name, ids in week_item_ids.items():
+                item_ids.setdefault(name, ids)
+    if key is None:
+        raise FileNotFoundError(aggregate_states_path.format(version="*"))
+
+    return join_week_partials(key, week_partials, item_ids)
+
+
+def get_last_version(versioned_path: str) -> int:
+    """The largest version of the files matching versioned_path"""
+
+    versions = get_versions(versioned_path)
+    if not versions:
+        raise FileNotFoundError(versioned_path.format(version="*"))
+
+    return max(versions)
+
+
+def get_versions(versioned_path: str) -> List[int]:
+    """Versions of the files matching versioned_path"""
+
+    pattern = re.compile(re.escape(versioned_path).replace(r"\{version\}", r"(\d+)"))
+
+    return [
+        int(match.group(1))
+        for match in map(
+            pattern.fullmatch, glob.glob(versioned_path.format(version="*"))
+        )
+        if match
+    ]
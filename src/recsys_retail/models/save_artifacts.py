@@ -22,12 +22,18 @@ CANDIDATES_PATH = FOLDER_3 + "candidates_lvl_2.parquet.gzip"
 
 FOLDER_4 = "data/04_feature/"
 PREFILTERED_ITEM_LIST_PATH = FOLDER_4 + "prefiltered_item_list.joblib"
+ITEM_DECISIONS_PATH = FOLDER_4 + "item_decisions_v{version}.parquet.gzip"
+ITEM_STATS_PATH = FOLDER_4 + "item_stats_v{version}.parquet.gzip"
+ITEM_USERS_PATH = FOLDER_4 + "item_users_v{version}.parquet.gzip"
+AGGREGATE_STATES_PATH = FOLDER_4 + "aggregate_states_w{version}.joblib"
 CURRENT_USER_LIST_PATH = FOLDER_4 + "current_user_list.joblib"
 VALID_DATA_LEVEL_1_PATH = FOLDER_4 + "data_valid.parquet.gzip"
 RECOMMENDER_PATH = FOLDER_4 + "recommender_v1.joblib"
+DESCRIPTION_ENCODER_PATH = FOLDER_4 + "description_encoder.joblib"
 ITEM_FEATURES_TRANSFORMED_PATH = FOLDER_4 + "item_features_transformed.parquet.gzip"
 USER_FEATURES_TRANSFORMED_PATH = FOLDER_4 + "user_features_transformed.parquet.gzip"
 USER_ITEM_FEATURES_PATH = FOLDER_4 + "user_item_features.parquet.gzip"
+FEATURE_TABLES_PATH = FOLDER_4 + "user_item_features_{table}.parquet.gzip"
 
 FOLDER_5 = "data/05_model_input/"
 TRAIN_DATASET_LVL_2_PATH = FOLDER_5 + "train_dataset_lvl_2.parquet.gzip"
@@ -68,6 +74,69 @@ def save_prefiltered_item_list(
     joblib.dump(prefiltered_item_list, prefiltered_item_list_path)
 
 
+def save_item_decisions(
+    item_decisions: pd.DataFrame,
+    item_stats,
+    path: Optional[str] = None,
+    item_decisions_path: Optional[str] = None,
+    item_stats_path: Optional[str] = None,
+    item_users_path: Optional[str] = None,
+):
+    """
+    Saves the item decision table of prefilter and the item statistics
+    behind it; the paths contain the version (the last week of the data).
+    """
+
+    logging.info("Saving item decisions...")
+
+    if path is None:
+        path = PATH
+
+    version = item_stats.last_week
+    if item_decisions_path is None:
+        item_decisions_path = path + ITEM_DECISIONS_PATH
+    item_decisions.to_parquet(
+        item_decisions_path.format(version=version), compression="gzip"
+    )
+    if item_stats_path is None:
+        item_stats_path = path + ITEM_STATS_PATH
+    item_stats.items.to_parquet(
+        item_stats_path.format(version=version), compression="gzip"
+    )
+    if item_users_path is None:
+        item_users_path = path + ITEM_USERS_PATH
+    item_stats.item_users.to_parquet(
+        item_users_path.format(version=version), compression="gzip"
+    )
+
+
+def save_aggregate_states(
+    aggregate_states,
+    path: Optional[str] = None,
+    aggregate_states_path: Optional[str] = None,
+):
+    """
+    Saves aggregate states of the new (or recalculated) weeks only,
+    one file per week with the key and the item_ids of the states.
+    """
+
+    logging.info("Saving aggregate states...")
+
+    if path is None:
+        path = PATH
+    if aggregate_states_path is None:
+        aggregate_states_path = path + AGGREGATE_STATES_PATH
+
+    for week in sorted(aggregate_states.new_weeks):
+        partials = aggregate_states.week_partials(week)
+        item_ids = {name: aggregate_states.item_ids.get(name) for name in partials}
+        joblib.dump(
+            (aggregate_states.key, item_ids, partials),
+            aggregate_states_path.format(version=week),
+        )
+    aggregate_states.new_weeks.clear()
+
+
 def save_current_user_list(
     current_user_list: list,
     path: Optional[str] = None,
@@ -126,8 +195,24 @@ def save_recommender(
     joblib.dump(recommender, recommender_path, 3)
 
 
+def save_description_encoder(
+    description_encoder,
+    path: Optional[str] = None,
+    description_encoder_path: Optional[str] = None,
+):
+
+    logging.info("Saving encoder of item descriptions...")
+
+    if path is None:
+        path = PATH
+
+    if description_encoder_path is None:
+        description_encoder_path = path + DESCRIPTION_ENCODER_PATH
+    joblib.dump(description_encoder, description_encoder_path, 3)
+
+
 def save_candidates(
-    users_lvl_2: pd.DataFrame,
+    candidates: pd.DataFrame,
     path: Optional[str] = None,
     candidates_path: Optional[str] = None,
 ):
@@ -139,7 +224,7 @@ def save_candidates(
 
     if candidates_path is None:
         candidates_path = path + CANDIDATES_PATH
-    users_lvl_2.to_parquet(candidates_path, compression="gzip")
+    candidates.to_parquet(candidates_path, compression="gzip")
 
 
 def save_item_featutes(
@@ -179,10 +264,16 @@ def save_user_features(
 
 
 def save_user_item_features(
-    user_item_features: pd.DataFrame,
+    user_item_features,
     path: Optional[str] = None,
     user_item_features_path: Optional[str] = None,
+    feature_tables_path: Optional[str] = None,
 ):
+    """
+    Saves the tables of user_item_features (see UserItemFeatures):
+    user_items to user_item_features_path, the others to
+    feature_tables_path formatted with the table name.
+    """
 
     logging.info("Saving new user-item features...")
 
@@ -191,7 +282,15 @@ def save_user_item_features(
 
     if user_item_features_path is None:
         user_item_features_path = path + USER_ITEM_FEATURES_PATH
-    user_item_features.to_parquet(user_item_features_path, compression="gzip")
+    user_item_features.user_items.to_parquet(
+        user_item_features_path, compression="gzip"
+    )
+    if feature_tables_path is None:
+        feature_tables_path = path + FEATURE_TABLES_PATH
+    for table in user_item_features._fields[1:]:
+        getattr(user_item_features, table).to_parquet(
+            feature_tables_path.format(table=table), compression="gzip"
+        )
 
 
 def save_train_dataset_lvl_2(
@@ -8,27 +8,48 @@ import logging
 import numpy as np
 import pandas as pd
 from pickle import dump
-from typing import Optional
+from typing import Dict, Optional
 
 from data.make_dataset import load_data
-from features.data_time_split import time_split_2
-from features.prefilter import prefilter_items
+from data.aggregate_states import AggregateStates, StatefulTransactions
+from data.validation import check_auc_unchanged
+from features.data_time_split import TimeSplitter, time_split_2
+from features.prefilter import (
+    ItemStats,
+    get_item_stats,
+    update_item_stats,
+    get_item_decisions,
+    apply_item_decisions,
+    get_item_mapping,
+    add_price,
+)
 from features.user_features import fit_transform_user_features
-from features.item_features import fit_transform_item_features
+from features.item_features import (
+    fit_description_encoder,
+    fit_transform_item_features,
+)
 from features.recommenders import MainRecommender
 from features.candidates_lvl_2 import get_candidates
-from features.new_item_user_features import get_user_item_features
+from features.new_item_user_features import (
+    UserItemFeatures,
+    get_user_item_features,
+    get_embeddings,
+)
+from features.dtypes import apply_dtype_schema
 from features.targets import get_targets_lvl_2
 from .save_artifacts import (
     save_time_split,
     save_prefiltered_data,
     save_prefiltered_item_list,
+    save_item_decisions,
     save_current_user_list,
     save_recommender,
+    save_description_encoder,
     save_candidates,
     save_item_featutes,
     save_user_features,
     save_user_item_features,
+    save_aggregate_states,
     save_train_dataset_lvl_2,
     save_to_YC_s3,
 )
@@ -43,6 +64,10 @@ N_ITEMS = 100
 PATH = "data/"
 FOLDERS = ["02_intermediate/", "03_primary/", "04_feature/", "05_model_input/"]
 FEATURE_STORE = "recsys-retail-feature-store"
+# Aggregate states are kept for prefiltered transactions and corrected for
+# the items with new decisions (see StatefulTransactions), states with
+# other keys are recalculated
+AGGREGATE_STATES_KEY = "prefiltered"
 
 
 def data_preprocessing_pipeline(
@@ -52,6 +77,11 @@ def data_preprocessing_pipeline(
     n_factors_ALS: Optional[int] = None,
     n_items: Optional[int] = None,
     save_artifacts=True,
+    item_stats: Optional[ItemStats] = None,
+    n_workers: Optional[int] = None,
+    aggregate_states: Optional[AggregateStates] = None,
+    quotas: Optional[Dict[str, float]] = None,
+    check_dtypes: bool = False,
 ) -> pd.DataFrame:
 
     """
@@ -61,11 +91,31 @@ def data_preprocessing_pipeline(
     n_items - the number of items selected by the recommender for each user
               on the 1st stage (long list), the bases for the further short list
               selection with the binary classification model.
+    item_stats - item statistics of prefilter saved by the previous run
+                 (see load_item_stats); they are refreshed with the new weeks
+                 of data only instead of being calculated from the full history.
+    n_workers - the number of processes computing user-item feature families.
+    aggregate_states - states of the aggregations of user-item features saved
+                       by the previous run (see load_aggregate_states); the
+                       aggregations are refreshed with the new weeks of data
+                       only, the states of the items with new decisions of
+                       prefilter are corrected from their transactions.
+    quotas - shares of n_items taken from each retriever of candidates
+             (see features.candidates_lvl_2.QUOTAS).
+    check_dtypes - checks that the compact dtypes of features (see
+                   features.dtypes.DTYPE_SCHEMA) do not change AUC of the model
+                   trained on the dataset assembled from float64 features.
 
     """
 
     logging.info("Prefiltering transactions data...")
-    data = prefilter_items(data, item_features)
+    if item_stats is None:
+        item_stats = get_item_stats(data)
+    else:
+        item_stats = update_item_stats(item_stats, data)
+    item_decisions = get_item_decisions(item_stats, item_features)
+    raw_data = data
+    data = apply_item_decisions(data, item_decisions)
     prefiltered_item_list = data["item_id"].unique().tolist()
     current_user_list = data["user_id"].unique().tolist()
 
@@ -83,6 +133,7 @@ def data_preprocessing_pipeline(
         regularization_ALS=0.001,
         iterations_ALS=15,
         num_threads_ALS=4,
+        ann_index=True,
     )
 
     logging.info("Selecting users for level 2 dataset...")
@@ -90,35 +141,88 @@ def data_preprocessing_pipeline(
     if n_items is None:
         n_items = N_ITEMS
 
-    users_lvl_2 = get_candidates(recommender, data_train, data_valid, n_items=n_items)
+    candidates = get_candidates(
+        recommender, data_train, data_valid, n_items=n_items, quotas=quotas
+    )
 
     logging.info("Generating new features for level 2 model...")
 
-    item_features_transformed = fit_transform_item_features(item_features)
+    description_encoder = fit_description_encoder(item_features)
+    item_features_transformed = fit_transform_item_features(
+        item_features, description_encoder=description_encoder
+    )
     user_features_transformed = fit_transform_user_features(user_features)
-    user_item_features = get_user_item_features(recommender, data_train)
-
-    logging.info("Generating train dataset for level 2 model...")
-
-    train_dataset_lvl_2 = get_targets_lvl_2(
-        users_lvl_2,
-        data_valid,
+    if aggregate_states is None:
+        user_item_features = get_user_item_features(data_train, n_workers=n_workers)
+    else:
+        if aggregate_states.key != AGGREGATE_STATES_KEY:
+            logging.info("Recalculating aggregate states...")
+            aggregate_states = AggregateStates(AGGREGATE_STATES_KEY)
+        raw_data_train, _ = TimeSplitter(raw_data).time_split_2(
+            last_week=int(data_valid["week_no"].max())
+        )
+        user_item_features = get_user_item_features(
+            StatefulTransactions(
+                raw_data_train,
+                aggregate_states,
+                item_ids=get_item_mapping(item_decisions),
+            ).map_partitions(add_price)
+        )
+
+    logging.info("Downcasting features to compact dtypes...")
+
+    features = (
         item_features_transformed,
         user_features_transformed,
         user_item_features,
-        n_items,
     )
+    item_features_transformed = apply_dtype_schema(item_features_transformed)
+    user_features_transformed = apply_dtype_schema(user_features_transformed)
+    user_item_features = UserItemFeatures(
+        *(apply_dtype_schema(table) for table in user_item_features)
+    )
+
+    logging.info("Generating train dataset for level 2 model...")
+
+    embeddings = get_embeddings(recommender)
+    train_dataset_lvl_2 = apply_dtype_schema(
+        get_targets_lvl_2(
+            candidates,
+            data_valid,
+            item_features_transformed,
+            user_features_transformed,
+            user_item_features,
+            embeddings=embeddings,
+        )
+    )
+    if check_dtypes:
+        logging.info("Checking AUC with compact dtypes...")
+        check_auc_unchanged(
+            get_targets_lvl_2(
+                candidates,
+                data_valid,
+                *features,
+                embeddings=embeddings,
+                dtype=np.float64
+            ),
+            train_dataset_lvl_2,
+        )
+    del features
 
     if save_artifacts:
         save_prefiltered_data(data)
         save_prefiltered_item_list(prefiltered_item_list)
+        save_item_decisions(item_decisions, item_stats)
         save_current_user_list(current_user_list)
         save_time_split(data_train, data_valid)
         save_recommender(recommender)
-        save_candidates(users_lvl_2)
+        save_description_encoder(description_encoder)
+        save_candidates(candidates)
         save_item_featutes(item_features_transformed)
         save_user_features(user_features_transformed)
         save_user_item_features(user_item_features)
+        if aggregate_states is not None:
+            save_aggregate_states(aggregate_states)
         save_train_dataset_lvl_2(train_dataset_lvl_2)
 
         logging.info("Saving artifacts in Feature store in Yandex Object Storage...")
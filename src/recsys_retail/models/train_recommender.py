@@ -30,6 +30,7 @@ def train_save_recommender(
         regularization_ALS=0.001,
         iterations_ALS=15,
         num_threads_ALS=4,
+        ann_index=True,
     )
 
     logging.info("Saving recommender...")
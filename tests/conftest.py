@@ -0,0 +1,40 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+
+@pytest.fixture(scope="session")
+def transactions():
+    """Small synthetic sample with the columns of train.csv"""
+
+    rng = np.random.default_rng(16)
+    n_rows, n_users, n_items = 6000, 200, 120
+    item_weights = rng.lognormal(0, 1, n_items)
+    item_id = 1000 + rng.choice(n_items, n_rows, p=item_weights / item_weights.sum())
+    user_id = rng.integers(1, n_users + 1, n_rows)
+    week_no = np.sort(rng.integers(1, 61, n_rows))
+    day = (week_no - 1) * 7 + rng.integers(1, 8, n_rows)
+    quantity = rng.integers(1, 4, n_rows) * (rng.uniform(size=n_rows) > 0.02)
+    price = (item_id % 23) * 0.7 + 1.5
+
+    return pd.DataFrame(
+        {
+            "user_id": user_id,
+            "basket_id": user_id.astype(np.int64) * 1000 + day,
+            "day": day,
+            "item_id": item_id,
+            "quantity": quantity,
+            "sales_value": np.round(
+                np.maximum(quantity, 1) * price * rng.uniform(0.8, 1.2, n_rows), 2
+            ),
+            "store_id": rng.integers(1, 10, n_rows),
+            "retail_disc": -np.round(rng.uniform(0, 1, n_rows), 2),
+            "trans_time": rng.integers(0, 24, n_rows) * 100
+            + rng.integers(0, 60, n_rows),
+            "week_no": week_no,
+            "coupon_disc": -np.round(
+                rng.uniform(0, 1, n_rows) * (rng.uniform(size=n_rows) < 0.1), 2
+            ),
+            "coupon_match_disc": 0.0,
+        }
+    )
@@ -0,0 +1,572 @@
+"""Reference implementations the optimised code of the package is compared with"""
+
+import numpy as np
+import pandas as pd
+from typing import Optional
+from src.recsys_retail.features.prefilter import (
+    LOWER_PRICE_THRESHOLD,
+    UPPER_PRICE_THRESHOLD,
+    TAKE_N_POPULAR,
+)
+
+
+def encode_transactions_legacy(
+    data: pd.DataFrame,
+) -> pd.DataFrame:
+    """The previous encoding: a groupby per statistic and a merge per key"""
+
+    X = data.copy()
+    X["hour"] = X["trans_time"] // 100
+    X["weekday"] = X["day"] % 7
+
+    X = encode_users_legacy(X)
+    X = encode_items_legacy(X)
+    X = encode_baskets_legacy(X)
+    X = encode_store_legacy(X)
+    X = encode_week_no_legacy(X)
+    X = encode_weekday_legacy(X)
+    X = encode_trans_time_legacy(X)
+
+    return X
+
+
+def encode_users_legacy(
+    data: pd.DataFrame,
+) -> pd.DataFrame:
+
+    df = pd.DataFrame()
+    df["n_baskets_user"] = data.groupby(["user_id"])["basket_id"].count()
+    df["n_items_user"] = data.groupby(["user_id"])["item_id"].count()
+    df["sales_value_user"] = data.groupby(["user_id"])["sales_value"].sum()
+    df1 = data.groupby(["user_id"])["sales_value", "quantity"].sum()
+    df["avg_price_user"] = df1["sales_value"] / df1["quantity"]
+    df["n_stores_user"] = data.groupby(["user_id"])["store_id"].count()
+    df["retail_disc_user"] = data.groupby(["user_id"])["retail_disc"].sum()
+    df["retail_disc_sales_ratio_user"] = df["retail_disc_user"] / df["sales_value_user"]
+    df["coupon_disc_user"] = data.groupby(["user_id"])["coupon_disc"].sum()
+    df["coupon_disc_sales_ratio_user"] = df["coupon_disc_user"] / df["sales_value_user"]
+    df["coupon_match_disc_user"] = data.groupby(["user_id"])["coupon_match_disc"].sum()
+    df["coupon_match_disc_sales_ratio_user"] = (
+        df["coupon_match_disc_user"] / df["sales_value_user"]
+    )
+    df["n_week_nos_user"] = (
+        data.groupby(["user_id", "week_no"])["week_no"]
+        .count()
+        .groupby(["user_id"])
+        .count()
+    )
+    df["mean_visits_interval_user"] = (
+        data.groupby("user_id")["day"].max() - data.groupby("user_id")["day"].min()
+    ) / data.groupby("user_id")["day"].count()
+
+    df["mean_basket_value_user"] = (
+        data.groupby(["user_id", "basket_id"])["sales_value"]
+        .sum()
+        .groupby("user_id")
+        .mean()
+    )
+    df["n_items_baskets_mean_user"] = (
+        data.groupby(["user_id", "basket_id"])["item_id"]
+        .count()
+        .groupby(["user_id"])
+        .mean()
+    )
+    df["n_items_baskets_max_user"] = (
+        data.groupby(["user_id", "basket_id"])["item_id"]
+        .count()
+        .groupby(["user_id"])
+        .max()
+    )
+    df["n_items_baskets_std_user"] = (
+        data.groupby(["user_id", "basket_id"])["item_id"]
+        .count()
+        .groupby(["user_id"])
+        .std()
+    )
+    data = pd.merge(data, df, on="user_id", how="left")
+
+    df = pd.DataFrame()
+    df["median_trans_hour_user-item"] = data.groupby(["user_id", "item_id"])[
+        "hour"
+    ].median()
+    df["median_trans_weekday_user-item"] = data.groupby(["user_id", "item_id"])[
+        "weekday"
+    ].median()
+    data = pd.merge(data, df, on=["user_id", "item_id"], how="left")
+
+    df = pd.DataFrame()
+    df["n_baskets_weekday_user"] = data.groupby(["user_id", "weekday"])[
+        "basket_id"
+    ].count()
+    df["n_items_weekday_user"] = data.groupby(["user_id", "weekday"])["item_id"].count()
+    df["sales_value_weekday_user"] = data.groupby(["user_id", "weekday"])[
+        "sales_value"
+    ].sum()
+    df1 = data.groupby(["user_id", "weekday"])["sales_value", "quantity"].sum()
+    df["avg_price_weekday_user"] = df1["sales_value"] / df1["quantity"]
+    data = pd.merge(data, df, on=["user_id", "weekday"], how="left")
+
+    df = pd.DataFrame()
+    df["n_baskets_trans_time_user"] = data.groupby(["user_id", "trans_time"])[
+        "basket_id"
+    ].count()
+    df["n_items_trans_time_user"] = data.groupby(["user_id", "trans_time"])[
+        "item_id"
+    ].count()
+    df["sales_value_trans_time_user"] = data.groupby(["user_id", "trans_time"])[
+        "sales_value"
+    ].sum()
+    data = pd.merge(data, df, on=["user_id", "trans_time"], how="left")
+
+    return data
+
+
+def encode_items_legacy(
+    data: pd.DataFrame,
+) -> pd.DataFrame:
+
+    df = pd.DataFrame()
+    df["n_baskets_item"] = data.groupby(["item_id"])["basket_id"].count()
+    df["n_users_item"] = data.groupby(["item_id"])["user_id"].count()
+    df["sales_value_item"] = data.groupby(["item_id"])["sales_value"].sum()
+    df["n_stores_item"] = data.groupby(["item_id"])["store_id"].count()
+    df["retail_disc_item"] = data.groupby(["item_id"])["retail_disc"].sum()
+    df["retail_disc_sales_ratio_item"] = df["retail_disc_item"] / df["sales_value_item"]
+    df["coupon_disc_item"] = data.groupby(["item_id"])["coupon_disc"].sum()
+    df["coupon_disc_sales_ratio_item"] = df["coupon_disc_item"] / df["sales_value_item"]
+    df["coupon_match_disc_item"] = data.groupby(["item_id"])["coupon_match_disc"].sum()
+    df["coupon_match_disc_sales_ratio_item"] = (
+        df["coupon_match_disc_item"] / df["sales_value_item"]
+    )
+    df["n_week_nos_item"] = (
+        data.groupby(["item_id", "week_no"])["week_no"]
+        .count()
+        .groupby(["item_id"])
+        .count()
+    )
+    data = pd.merge(data, df, on="item_id", how="left")
+
+    df = pd.DataFrame()
+    df["n_baskets_weekday_item"] = data.groupby(["item_id", "weekday"])[
+        "basket_id"
+    ].count()
+    df["n_users_weekday_item"] = data.groupby(["item_id", "weekday"])["user_id"].count()
+    df["sales_value_weekday_item"] = data.groupby(["item_id", "weekday"])[
+        "sales_value"
+    ].sum()
+    df["n_stores_weekday_item"] = data.groupby(["item_id", "weekday"])[
+        "store_id"
+    ].count()
+    data = pd.merge(data, df, on=["item_id", "weekday"], how="left")
+
+    df = pd.DataFrame()
+    df["n_baskets_trans_time_item"] = data.groupby(["item_id", "trans_time"])[
+        "basket_id"
+    ].count()
+    df["n_users_trans_time_item"] = data.groupby(["item_id", "trans_time"])[
+        "user_id"
+    ].count()
+    df["sales_value_trans_time_item"] = data.groupby(["item_id", "trans_time"])[
+        "sales_value"
+    ].sum()
+    df["n_stores_trans_time_item"] = data.groupby(["item_id", "trans_time"])[
+        "store_id"
+    ].count()
+    data = pd.merge(data, df, on=["item_id", "trans_time"], how="left")
+
+    return data
+
+
+def encode_baskets_legacy(
+    data: pd.DataFrame,
+) -> pd.DataFrame:
+
+    df = pd.DataFrame()
+    df["n_items_busket"] = data.groupby(["basket_id"])["item_id"].count()
+    df["sales_value_basket"] = data.groupby(["basket_id"])["sales_value"].sum()
+    df1 = data.groupby(["basket_id"])["sales_value", "quantity"].sum()
+    df["avg_price_basket"] = df1["sales_value"] / df1["quantity"]
+    df["retail_disc_basket"] = data.groupby(["basket_id"])["retail_disc"].sum()
+    df["retail_disc_sales_ratio_basket"] = (
+        df["retail_disc_basket"] / df["sales_value_basket"]
+    )
+    df["coupon_disc_basket"] = data.groupby(["basket_id"])["coupon_disc"].sum()
+    df["coupon_disc_sales_ratio_basket"] = (
+        df["coupon_disc_basket"] / df["sales_value_basket"]
+    )
+    df["coupon_match_disc_basket"] = data.groupby(["basket_id"])[
+        "coupon_match_disc"
+    ].sum()
+    df["coupon_match_disc_sales_ratio_basket"] = (
+        df["coupon_match_disc_basket"] / df["sales_value_basket"]
+    )
+    data = pd.merge(data, df, on="basket_id", how="left")
+
+    df = pd.DataFrame()
+    df["sales_value_weekday_basket"] = data.groupby(["basket_id", "weekday"])[
+        "sales_value"
+    ].sum()
+    data = pd.merge(data, df, on=["basket_id", "weekday"], how="left")
+
+    df = pd.DataFrame()
+    df["sales_value_trans_time_item"] = data.groupby(["basket_id", "trans_time"])[
+        "sales_value"
+    ].sum()
+    data = pd.merge(data, df, on=["basket_id", "trans_time"], how="left")
+
+    return data
+
+
+def encode_store_legacy(
+    data: pd.DataFrame,
+) -> pd.DataFrame:
+
+    df = pd.DataFrame()
+    df["n_users_store"] = (
+        data.groupby(["store_id", "user_id"])["user_id"]
+        .count()
+        .groupby(["store_id"])
+        .count()
+    )
+    df["mean_user_value_store"] = (
+        data.groupby(["store_id", "user_id"])["sales_value"]
+        .sum()
+        .groupby(["store_id"])
+        .mean()
+    )
+    df["n_items_store"] = (
+        data.groupby(["store_id", "item_id"])["item_id"]
+        .count()
+        .groupby(["store_id"])
+        .count()
+    )
+    df["mean_item_value_store"] = (
+        data.groupby(["store_id", "item_id"])["sales_value"]
+        .sum()
+        .groupby(["store_id"])
+        .mean()
+    )
+    df["n_baskets_store"] = (
+        data.groupby(["store_id", "basket_id"])["basket_id"]
+        .count()
+        .groupby(["store_id"])
+        .count()
+    )
+    df["mean_basket_value_store"] = (
+        data.groupby(["store_id", "basket_id"])["sales_value"]
+        .sum()
+        .groupby(["store_id"])
+        .mean()
+    )
+    df["sales_value_store"] = data.groupby(["store_id"])["sales_value"].sum()
+    df1 = data.groupby(["store_id"])["sales_value", "quantity"].sum()
+    df["avg_price_store"] = df1["sales_value"] / df1["quantity"]
+    df["retail_disc_store"] = data.groupby(["store_id"])["retail_disc"].sum()
+    df["retail_disc_sales_ratio_store"] = (
+        df["retail_disc_store"] / df["sales_value_store"]
+    )
+    df["coupon_disc_store"] = data.groupby(["store_id"])["coupon_disc"].sum()
+    df["coupon_disc_sales_ratio_store"] = (
+        df["coupon_disc_store"] / df["sales_value_store"]
+    )
+    df["coupon_match_disc_store"] = data.groupby(["store_id"])[
+        "coupon_match_disc"
+    ].sum()
+    df["coupon_match_disc_sales_ratio_store"] = (
+        df["coupon_match_disc_store"] / df["sales_value_store"]
+    )
+    df["n_week_nos_store"] = (
+        data.groupby(["store_id", "week_no"])["week_no"]
+        .count()
+        .groupby(["store_id"])
+        .count()
+    )
+    data = pd.merge(data, df, on=["store_id"], how="left")
+
+    df = pd.DataFrame()
+    df["n_users_weekday_store"] = (
+        data.groupby(["store_id", "weekday", "user_id"])["user_id"]
+        .count()
+        .groupby(["store_id", "weekday"])
+        .count()
+    )
+    df["n_items_weekday_store"] = (
+        data.groupby(["store_id", "weekday", "item_id"])["item_id"]
+        .count()
+        .groupby(["store_id", "weekday"])
+        .count()
+    )
+    df["n_baskets_weekday_store"] = (
+        data.groupby(["store_id", "weekday", "basket_id"])["basket_id"]
+        .count()
+        .groupby(["store_id", "weekday"])
+        .count()
+    )
+    df["sales_value_weekday_store"] = data.groupby(["store_id", "weekday"])[
+        "sales_value"
+    ].sum()
+    data = pd.merge(data, df, on=["store_id", "weekday"], how="left")
+
+    df = pd.DataFrame()
+    df["n_users_trans_time_store"] = (
+        data.groupby(["store_id", "trans_time", "user_id"])["user_id"]
+        .count()
+        .groupby(["store_id", "trans_time"])
+        .count()
+    )
+    df["n_items_trans_time_store"] = (
+        data.groupby(["store_id", "trans_time", "item_id"])["item_id"]
+        .count()
+        .groupby(["store_id", "trans_time"])
+        .count()
+    )
+    df["n_baskets_trans_time_store"] = (
+        data.groupby(["store_id", "trans_time", "basket_id"])["basket_id"]
+        .count()
+        .groupby(["store_id", "trans_time"])
+        .count()
+    )
+    df["sales_value_trans_time_store"] = data.groupby(["store_id", "trans_time"])[
+        "sales_value"
+    ].sum()
+    data = pd.merge(data, df, on=["store_id", "trans_time"], how="left")
+
+    return data
+
+
+def encode_week_no_legacy(
+    data: pd.DataFrame,
+) -> pd.DataFrame:
+
+    df = pd.DataFrame()
+    df["n_users_week_no"] = (
+        data.groupby(["week_no", "user_id"])["user_id"]
+        .count()
+        .groupby("week_no")
+        .count()
+    )
+    df["n_items_week_no"] = (
+        data.groupby(["week_no", "item_id"])["item_id"]
+        .count()
+        .groupby("week_no")
+        .count()
+    )
+    df["n_baskets_week_no"] = (
+        data.groupby(["week_no", "basket_id"])["basket_id"]
+        .count()
+        .groupby("week_no")
+        .count()
+    )
+    df["n_stores_week_no"] = (
+        data.groupby(["week_no", "store_id"])["store_id"]
+        .count()
+        .groupby("week_no")
+        .count()
+    )
+    df["sales_value_week_no"] = data.groupby(["week_no"])["sales_value"].sum()
+    df1 = data.groupby(["week_no"])["sales_value", "quantity"].sum()
+    df["avg_price_week_no"] = df1["sales_value"] / df1["quantity"]
+    df["retail_disc_week_no"] = data.groupby(["week_no"])["retail_disc"].sum()
+    df["retail_disc_sales_ratio_week_no"] = (
+        df["retail_disc_week_no"] / df["sales_value_week_no"]
+    )
+    df["coupon_disc_week_no"] = data.groupby(["week_no"])["coupon_disc"].sum()
+    df["coupon_disc_sales_ratio_week_no"] = (
+        df["coupon_disc_week_no"] / df["sales_value_week_no"]
+    )
+    df["coupon_match_disc_week_no"] = data.groupby(["week_no"])[
+        "coupon_match_disc"
+    ].sum()
+    df["coupon_match_disc_sales_ratio_week_no"] = (
+        df["coupon_match_disc_week_no"] / df["sales_value_week_no"]
+    )
+    data = pd.merge(data, df, on=["week_no"], how="left")
+
+    df = pd.DataFrame()
+    df["sales_value_weekday_week_no"] = data.groupby(["week_no", "weekday"])[
+        "sales_value"
+    ].sum()
+    data = pd.merge(data, df, on=["week_no", "weekday"], how="left")
+
+    df = pd.DataFrame()
+    df["sales_value_trans_time_store"] = data.groupby(["week_no", "trans_time"])[
+        "sales_value"
+    ].sum()
+    data = pd.merge(data, df, on=["week_no", "trans_time"], how="left")
+
+    return data
+
+
+def encode_weekday_legacy(
+    data: pd.DataFrame,
+) -> pd.DataFrame:
+
+    df = pd.DataFrame()
+    df["n_baskets_weekday"] = (
+        data.groupby(["weekday", "basket_id"])["basket_id"]
+        .count()
+        .groupby("weekday")
+        .count()
+    )
+    df["sales_weekday"] = data.groupby(["weekday"])["sales_value"].sum()
+
+    df["avg_basket_value_weekday"] = df["sales_weekday"] / df["n_baskets_weekday"]
+    df1 = data.groupby(["weekday"])["sales_value", "quantity"].sum()
+    df["avg_price_weekday"] = df1["sales_value"] / df1["quantity"]
+    df["retail_disc_weekday"] = data.groupby(["weekday"])["retail_disc"].sum()
+    df["retail_disc_sales_ratio_weekday"] = (
+        df["retail_disc_weekday"] / df["sales_weekday"]
+    )
+    df["coupon_disc_weekday"] = data.groupby(["weekday"])["coupon_disc"].sum()
+    df["coupon_disc_sales_ratio_weekday"] = (
+        df["coupon_disc_weekday"] / df["sales_weekday"]
+    )
+    df["coupon_match_disc_weekday"] = data.groupby(["weekday"])[
+        "coupon_match_disc"
+    ].sum()
+    df["coupon_match_disc_sales_ratio_weekday"] = (
+        df["coupon_match_disc_weekday"] / df["sales_weekday"]
+    )
+    data = pd.merge(data, df, on=["weekday"], how="left")
+
+    df = pd.DataFrame()
+    df["sales_value_trans_time_weekday"] = data.groupby(["weekday", "trans_time"])[
+        "sales_value"
+    ].sum()
+    data = pd.merge(data, df, on=["weekday", "trans_time"], how="left")
+
+    return data
+
+
+def encode_trans_time_legacy(
+    data: pd.DataFrame,
+) -> pd.DataFrame:
+
+    df = pd.DataFrame()
+    df["n_baskets_trans_time"] = (
+        data.groupby(["trans_time", "basket_id"])["basket_id"]
+        .count()
+        .groupby("trans_time")
+        .count()
+    )
+    df["sales_trans_time"] = data.groupby(["trans_time"])["sales_value"].sum()
+    df["avg_basket_value_trans_time"] = (
+        df["sales_trans_time"] / df["n_baskets_trans_time"]
+    )
+    df1 = data.groupby(["trans_time"])["sales_value", "quantity"].sum()
+    df["avg_price_trans_time"] = df1["sales_value"] / df1["quantity"]
+    df["retail_disc_trans_time"] = data.groupby(["trans_time"])["retail_disc"].sum()
+    df["retail_disc_sales_ratio_trans_time"] = (
+        df["retail_disc_trans_time"] / df["sales_trans_time"]
+    )
+    df["coupon_disc_trans_time"] = data.groupby(["trans_time"])["coupon_disc"].sum()
+    df["coupon_disc_sales_ratio_trans_time"] = (
+        df["coupon_disc_trans_time"] / df["sales_trans_time"]
+    )
+    df["coupon_match_disc_trans_time"] = data.groupby(["trans_time"])[
+        "coupon_match_disc"
+    ].sum()
+    df["coupon_match_disc_sales_ratio_trans_time"] = (
+        df["coupon_match_disc_trans_time"] / df["sales_trans_time"]
+    )
+    data = pd.merge(data, df, on=["trans_time"], how="left")
+
+    return data
+
+
+def prefilter_items_legacy(
+    data: pd.DataFrame,
+    item_features: pd.DataFrame,
+    lower_price_threshold: Optional[int] = None,
+    upper_price_threshold: Optional[int] = None,
+    take_n_popular: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    The previous implementation of prefilter_items: seven filtering passes
+    over the transactions.
+
+    1.Removes items that have not been sold for the last 12 months
+    2.Removes most popular items (they will be bought anyway).
+    3.Removes most unpopular items (nobody will buy them)
+    4.Removes items from the departments with a limited assortiment
+    5.Removes too cheap items (we will not earn on them)
+    6.Removes too expensive_items. They will be bought irrespective
+      of our recommendations.
+    7.Selects top N popular items
+    8.Introduces fake item_id = 999999. If user has bought an item which
+      is not from top-N, he bought an item 999999.
+    """
+
+    # 1.Remove items that have not been sold for the last 12 months
+    t = max(data["day"]) - 365
+    not_sold_in_12_month = list(
+        set(data[data["day"] < t]["item_id"].unique())
+        - set(data[data["day"] >= t]["item_id"].unique())
+    )
+    data = data[~data["item_id"].isin(not_sold_in_12_month)]
+
+    # 2.Remove most popular items (they will be bought anyway).
+    popularity = (
+        data.groupby("item_id")["user_id"].nunique() / data["user_id"].nunique()
+    ).reset_index()
+    popularity.rename(columns={"user_id": "share_unique_users"}, inplace=True)
+    top_popular = popularity[popularity["share_unique_users"] > 0.2].item_id.tolist()
+    data = data[~data["item_id"].isin(top_popular)]
+
+    # 3.Remove most unpopular items (nobody will buy them)
+    top_unpopular = popularity[popularity["share_unique_users"] < 0.02].item_id.tolist()
+    data = data[~data["item_id"].isin(top_unpopular)]
+
+    # 4.Remove items from the departments with a limited assortiment
+    if item_features is not None:
+        department_size = (
+            item_features.groupby("department")["item_id"]
+            .nunique()
+            .sort_values(ascending=False)
+        ).reset_index()
+        department_size.columns = ["department", "n_items"]
+
+        unpopular_departments = department_size[
+            department_size["n_items"] < 150
+        ].department.tolist()
+        items_in_unpopular_departments = (
+            item_features[item_features["department"].isin(unpopular_departments)]
+            .item_id.unique()
+            .tolist()
+        )
+        data = data[~data["item_id"].isin(items_in_unpopular_departments)]
+
+    # 5.Remove too cheap items (we will not earn on them)
+    data["price"] = data["sales_value"] / np.maximum(data["quantity"], 1)
+    if lower_price_threshold is None:
+        lower_price_threshold = LOWER_PRICE_THRESHOLD
+    cheap_items = (
+        data.loc[data["price"] < lower_price_threshold, "item_id"].unique().tolist()
+    )
+    data = data[~data["item_id"].isin(cheap_items)]
+
+    # 6.Remove too expensive_items.
+    # They will be bought irrespective of our recommendations.
+    if upper_price_threshold is None:
+        upper_price_threshold = UPPER_PRICE_THRESHOLD
+    expensive_items = (
+        data.loc[data["price"] > upper_price_threshold, "item_id"].unique().tolist()
+    )
+    data = data[~data["item_id"].isin(expensive_items)]
+
+    # 7.Select top N popular items
+    popularity = data.groupby("item_id")["quantity"].sum().reset_index()
+    popularity.rename(columns={"quantity": "n_sold"}, inplace=True)
+    if take_n_popular is None:
+        take_n_popular = TAKE_N_POPULAR
+    top = (
+        popularity.sort_values("n_sold", ascending=False)
+        .head(take_n_popular)
+        .item_id.tolist()
+    )
+
+    # Introduce fake item_id = 999999.
+    # If user has bought an item which is not from top-N, he bought an item 999999.
+    data.loc[~data["item_id"].isin(top), "item_id"] = 999999
+
+    return data
@@ -0,0 +1,170 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import numpy as np
+import pandas as pd
+from src.recsys_retail.data import aggregate_states
+from src.recsys_retail.data.aggregate_states import (
+    AggregateStates,
+    StatefulTransactions,
+)
+from src.recsys_retail.features.prefilter import (
+    get_item_stats,
+    get_item_decisions,
+    apply_item_decisions,
+    get_item_mapping,
+    add_price,
+)
+from src.recsys_retail.features.new_item_user_features import get_user_item_features
+from src.recsys_retail.models.save_artifacts import save_aggregate_states
+from src.recsys_retail.models.load_artifacts import load_aggregate_states
+
+AGGREGATIONS = dict(
+    n_rows=("item_id", "size"),
+    sales_value=("sales_value", "sum"),
+    last_day=("day", "max"),
+    n_weeks=("week_no", "nunique"),
+    median_store=("store_id", "median"),
+)
+
+
+def test_stateful_aggregate(transactions):
+    states = AggregateStates()
+    old = transactions[transactions["week_no"] <= 40]
+    StatefulTransactions(old, states).aggregate("user_id", **AGGREGATIONS)
+    assert states.last_week == 40
+
+    # Only the new weeks are aggregated: the old ones come from the states
+    data = transactions.copy()
+    data.loc[data["week_no"] <= 40, "sales_value"] = 0
+    result = StatefulTransactions(data, states).aggregate("user_id", **AGGREGATIONS)
+
+    pd.testing.assert_frame_equal(
+        result, transactions.groupby("user_id").agg(**AGGREGATIONS)
+    )
+    assert states.new_weeks == set(transactions["week_no"])
+
+    # A window of weeks is combined from the states
+    window = transactions[transactions["week_no"].between(21, 50)]
+    pd.testing.assert_frame_equal(
+        StatefulTransactions(window, states).aggregate("user_id", **AGGREGATIONS),
+        window.groupby("user_id").agg(**AGGREGATIONS),
+    )
+
+
+def test_get_user_item_features_incremental(transactions):
+    states = AggregateStates()
+    get_user_item_features(
+        StatefulTransactions(transactions[transactions["week_no"] <= 50], states)
+    )
+    features = get_user_item_features(StatefulTransactions(transactions, states))
+    expected = get_user_item_features(transactions)
+
+    for name, table in expected._asdict().items():
+        pd.testing.assert_frame_equal(
+            features._asdict()[name].replace(np.inf, np.nan),
+            table.replace(np.inf, np.nan),
+            rtol=1e-9,
+        )
+
+
+def test_states_reused_with_new_item_decisions(transactions, monkeypatch):
+    # Corrections of the items are kept apart from the states of the weeks
+    monkeypatch.setattr(aggregate_states, "MAX_SUBTRACTED_SHARE", 1)
+    states = AggregateStates()
+    previous_item_ids = None
+    for last_week in [59, 60]:
+        data = transactions[transactions["week_no"] <= last_week]
+        item_decisions = get_item_decisions(
+            get_item_stats(data), None, take_n_popular=20
+        )
+        item_ids = get_item_mapping(item_decisions)
+        states.new_weeks.clear()
+
+        features = get_user_item_features(
+            StatefulTransactions(data, states, item_ids=item_ids).map_partitions(
+                add_price
+            )
+        )
+        expected = get_user_item_features(apply_item_decisions(data, item_decisions))
+
+        for name, table in expected._asdict().items():
+            pd.testing.assert_frame_equal(
+                features._asdict()[name].replace(np.inf, np.nan),
+                table.replace(np.inf, np.nan),
+                rtol=1e-9,
+            )
+        if previous_item_ids is not None:
+            # Items are dropped and replaced differently in the next week,
+            # the states of the previous weeks are corrected for the weeks
+            # of the changed items only
+            items = item_ids.index.union(previous_item_ids.index)
+            changed = items[
+                item_ids.reindex(items).to_numpy()
+                != previous_item_ids.reindex(items).to_numpy()
+            ]
+            assert len(changed) > 0
+            changed_weeks = data.loc[data["item_id"].isin(changed), "week_no"]
+            assert states.new_weeks == set(changed_weeks) | {60}
+            assert states.new_weeks != set(data["week_no"])
+        previous_item_ids = item_ids
+
+
+def test_save_load_aggregate_states(transactions, tmp_path):
+    path = str(tmp_path / "aggregate_states_w{version}.joblib")
+    states = AggregateStates("v1")
+    old = transactions[transactions["week_no"] <= 40]
+    StatefulTransactions(old, states).aggregate("user_id", **AGGREGATIONS)
+    save_aggregate_states(states, aggregate_states_path=path)
+
+    states = load_aggregate_states(aggregate_states_path=path)
+    assert states.key == "v1"
+    result = StatefulTransactions(transactions, states).aggregate(
+        "user_id", **AGGREGATIONS
+    )
+    pd.testing.assert_frame_equal(
+        result, transactions.groupby("user_id").agg(**AGGREGATIONS)
+    )
+
+    # Only the new weeks are saved
+    assert states.new_weeks == set(range(41, 61))
+    save_aggregate_states(states, aggregate_states_path=path)
+    assert len(os.listdir(tmp_path)) == 60
+
+
+def test_corrected_states_saved(transactions, tmp_path, monkeypatch):
+    # Corrections of the items are added up into the groups right away
+    monkeypatch.setattr(aggregate_states, "MAX_SUBTRACTED_SHARE", 0)
+    path = str(tmp_path / "aggregate_states_w{version}.joblib")
+    keys = ["store_id", "item_id"]
+    states = AggregateStates()
+    for last_week in [59, 60]:
+        data = transactions[transactions["week_no"] <= last_week]
+        item_decisions = get_item_decisions(
+            get_item_stats(data), None, take_n_popular=20
+        )
+        item_ids = get_item_mapping(item_decisions)
+        expected = (
+            apply_item_decisions(data, item_decisions).groupby(keys).agg(**AGGREGATIONS)
+        )
+
+        result = StatefulTransactions(data, states, item_ids=item_ids).aggregate(
+            keys, **AGGREGATIONS
+        )
+        pd.testing.assert_frame_equal(result, expected)
+        save_aggregate_states(states, aggregate_states_path=path)
+
+        # Weeks corrected for the new item_ids are saved again
+        states = load_aggregate_states(aggregate_states_path=path)
+        result = StatefulTransactions(data, states, item_ids=item_ids).aggregate(
+            keys, **AGGREGATIONS
+        )
+        pd.testing.assert_frame_equal(result, expected)
+        assert not states.new_weeks
+
+    stats, value_counts = next(iter(states.partials.values()))
+    for table in [stats] + list(value_counts.values()):
+        assert (table["count"] > 0).all()
@@ -0,0 +1,94 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import pytest
+import numpy as np
+from src.recsys_retail.features.ann_index import IVFIndex
+from src.recsys_retail.features.recommenders import MainRecommender
+
+
+N = 10
+
+
+def recall_at_n(approximate: np.ndarray, exact: np.ndarray) -> float:
+    """Share of the exact neighbours found by approximate search"""
+
+    found = sum(len(set(a) & set(e[e >= 0])) for a, e in zip(approximate, exact))
+    return found / (exact >= 0).sum()
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 16))
+    return centers[rng.integers(0, 20, 2000)] + 0.3 * rng.normal(size=(2000, 16))
+
+
+def exact_search(vectors, queries, N):
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(
+        np.float32
+    )
+    return np.argsort(-(queries @ vectors.T), axis=1, kind="stable")[:, :N]
+
+
+def test_search_exhaustive(vectors):
+    index = IVFIndex(vectors, n_lists=30)
+    ids, scores = index.search(vectors[:100], N=N, n_probe=index.n_lists)
+
+    assert ids.shape == scores.shape == (100, N)
+    assert (ids[:, 0] == np.arange(100)).all()
+    assert recall_at_n(ids, exact_search(vectors, vectors[:100], N)) == 1
+    assert (np.diff(scores, axis=1) <= 1e-6).all()
+
+
+def test_search_recall(vectors):
+    index = IVFIndex(vectors, n_lists=30)
+    exact = exact_search(vectors, vectors, N)
+    recalls = [
+        recall_at_n(
+            index.search(vectors, N=N, n_probe=n_probe, batch_size=300)[0], exact
+        )
+        for n_probe in [1, 4, 30]
+    ]
+
+    assert recalls == sorted(recalls)
+    assert recalls[1] > 0.9
+
+
+def test_search_small_lists():
+    ids, scores = IVFIndex(np.eye(4), n_lists=4).search(np.eye(4)[:1], N=6, n_probe=1)
+
+    assert ids[0].tolist() == [0, -1, -1, -1, -1, -1]
+    assert np.isnan(scores[0, 1:]).all()
+
+
+def test_search_empty_index():
+    index = IVFIndex(np.zeros((0, 4)))
+    ids, scores = index.search(np.eye(4)[:2], N=3)
+
+    assert len(index) == 0 and index.n_lists == 0
+    assert (ids == -1).all() and np.isnan(scores).all()
+
+
+def test_recommender_similar_items(transactions):
+    recommender = MainRecommender(
+        transactions, n_factors_ALS=8, iterations_ALS=5, ann_index=True
+    ).freeze()
+    item_ids = transactions["item_id"].unique()[:10]
+
+    approximate, _ = recommender.similar_items_batch(
+        item_ids, N=N, n_probe=recommender.item_index.n_lists
+    )
+    exact, _ = recommender.model.similar_items(
+        recommender.item_mapping.encode(item_ids), N=N
+    )
+
+    assert (approximate[:, 0] == item_ids).all()
+    assert recall_at_n(approximate, recommender.item_mapping.decode(exact)) == 1
+    assert recommender.similar_users_batch([-1], N=N)[0].tolist() == [[-1] * N]
@@ -0,0 +1,93 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import pytest
+import numpy as np
+from src.recsys_retail.features.recommenders import MainRecommender
+from src.recsys_retail.features.candidates_lvl_2 import (
+    get_candidates,
+    ALS,
+    OWN_RECOMMENDER,
+    QUOTAS,
+    RETRIEVERS,
+    TOP_POPULAR,
+)
+
+N = 20
+
+
+@pytest.fixture(scope="module")
+def data(transactions):
+    data_train = transactions[transactions["week_no"] <= 50]
+    data_valid = transactions[transactions["week_no"] > 50].copy()
+    data_valid.iloc[:5, data_valid.columns.get_loc("user_id")] = 100000
+    return data_train, data_valid
+
+
+@pytest.fixture(scope="module")
+def recommender(data):
+    return MainRecommender(data[0], n_factors_ALS=8, iterations_ALS=5)
+
+
+def test_get_candidates(recommender, data):
+    data_train, data_valid = data
+    candidates = get_candidates(
+        recommender, data_train, data_valid, n_items=N, quotas={OWN_RECOMMENDER: 1}
+    )
+
+    users = data_valid["user_id"].unique()
+    assert candidates["user_id"].tolist() == users.repeat(N).tolist()
+    assert candidates["rank"].tolist() == list(range(1, N + 1)) * len(users)
+
+    current = users[users != 100000]
+    item_ids, scores = recommender.recommend_batch(
+        current,
+        N=N,
+        model=recommender.own_recommender,
+        recent_purchases=data_train,
+    )
+    own = candidates[candidates["source"] == OWN_RECOMMENDER]
+    found = ~np.isnan(scores)
+    np.testing.assert_array_equal(own["item_id"], item_ids[found])
+    np.testing.assert_array_equal(own["score"], scores[found])
+    np.testing.assert_array_equal(own["own_recommender_score"], scores[found])
+    np.testing.assert_array_equal(own["own_recommender_rank"], found.nonzero()[1] + 1)
+
+    # New users get top purchases
+    new = candidates[candidates["user_id"] == 100000]
+    assert new["item_id"].tolist() == recommender.overall_top_purchases[:N]
+    assert new["score"].isna().all()
+    assert (new["source"] == TOP_POPULAR).all()
+    assert new["own_recommender_rank"].isna().all()
+
+
+def test_blend_candidates(recommender, data):
+    data_train, data_valid = data
+    candidates = get_candidates(recommender, data_train, data_valid, n_items=N)
+
+    assert not candidates.duplicated(["user_id", "item_id"]).any()
+    assert (candidates.groupby("user_id").size() == N).all()
+    assert set(candidates["source"]) - {TOP_POPULAR} == set(QUOTAS)
+
+    # Quotas of the retrievers come first in the order of priority
+    in_quota = candidates[candidates["rank"] <= N * QUOTAS[OWN_RECOMMENDER]]
+    assert (in_quota["source"] == OWN_RECOMMENDER).mean() > 0.9
+
+    # Scores and ranks of a retriever are kept for all its items
+    users = candidates["user_id"].unique()[:10]
+    item_ids, scores = RETRIEVERS[ALS](recommender, users, N, data_train)
+    for user_id, items, user_scores in zip(users, item_ids, scores):
+        user = candidates[candidates["user_id"] == user_id].set_index("item_id")
+        retrieved = {
+            item_id: (rank, score)
+            for rank, (item_id, score) in enumerate(zip(items, user_scores), 1)
+            if not np.isnan(score)
+        }
+        for item_id, row in user.iterrows():
+            rank, score = retrieved.get(item_id, (np.nan, np.nan))
+            np.testing.assert_equal(row["als_rank"], rank)
+            # Scores of batches of different sizes differ in float32 rounding
+            np.testing.assert_allclose(row["als_score"], score, rtol=1e-5)
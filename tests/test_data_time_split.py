@@ -0,0 +1,63 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import numpy as np
+import pandas as pd
+from src.recsys_retail.features.data_time_split import (
+    TimeSplitter,
+    time_split,
+    time_split_2,
+)
+
+
+def test_time_split(transactions):
+    last_week = transactions["week_no"].max()
+    weeks = transactions["week_no"]
+    data_train, data_val_lvl_1, data_val_lvl_2 = time_split(transactions)
+
+    pd.testing.assert_frame_equal(data_train, transactions[weeks < last_week - 9])
+    pd.testing.assert_frame_equal(
+        data_val_lvl_1,
+        transactions[(weeks >= last_week - 9) & (weeks < last_week - 3)],
+    )
+    pd.testing.assert_frame_equal(data_val_lvl_2, transactions[weeks >= last_week - 3])
+
+    data_train, data_valid = time_split_2(transactions)
+    pd.testing.assert_frame_equal(data_valid, transactions[weeks >= last_week - 6])
+    assert np.shares_memory(
+        data_train["user_id"].to_numpy(), transactions["user_id"].to_numpy()
+    )
+
+
+def test_time_split_unsorted(transactions):
+    shuffled = transactions.sample(frac=1, random_state=0)
+    data_train, data_valid = TimeSplitter(shuffled).time_split_2()
+    expected_train, expected_valid = time_split_2(transactions)
+
+    assert sorted(data_train.index) == sorted(expected_train.index)
+    assert sorted(data_valid.index) == sorted(expected_valid.index)
+
+
+def test_rolling_time_splits(transactions):
+    splitter = TimeSplitter(transactions)
+    last_week = transactions["week_no"].max()
+
+    folds = list(splitter.rolling_time_splits(4, step_weeks=2))
+    assert len(folds) == 4
+    for fold, expected in zip(folds[-1], splitter.time_split()):
+        pd.testing.assert_frame_equal(fold, expected)
+    assert [fold[2]["week_no"].max() for fold in folds] == [
+        last_week - 6,
+        last_week - 4,
+        last_week - 2,
+        last_week,
+    ]
+
+    for data_train, data_val_lvl_1, _ in splitter.rolling_time_splits(
+        3, train_size_weeks=10
+    ):
+        assert data_train["week_no"].nunique() == 10
+        assert data_train["week_no"].max() + 1 == data_val_lvl_1["week_no"].min()
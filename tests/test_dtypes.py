@@ -0,0 +1,58 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import pytest
+import numpy as np
+import pandas as pd
+from src.recsys_retail.features.dtypes import apply_dtype_schema
+from src.recsys_retail.data.validation import check_auc_unchanged
+
+
+def test_apply_dtype_schema():
+    df = pd.DataFrame(
+        {
+            "user_id": [1, 2, 3],
+            "target": [0.0, 1.0, 0.0],
+            "brand": [0.0, np.nan, 1.0],
+            "n_baskets_user": [10, 20, 30],
+            "n_items_baskets_mean_user": [1.5, 2.0, 2.5],
+            "item_desc_3": [0.25, -0.5, 0.0],
+            "sales_value": [1.25, 2.5, 3.75],
+            "department": ["A", "B", "C"],
+        }
+    )
+
+    result = apply_dtype_schema(df)
+
+    assert result.dtypes.to_dict() == {
+        "user_id": np.int64,
+        "target": np.int8,
+        "brand": np.float32,
+        "n_baskets_user": np.int32,
+        "n_items_baskets_mean_user": np.float32,
+        "item_desc_3": np.float32,
+        "sales_value": np.float32,
+        "department": object,
+    }
+    pd.testing.assert_frame_equal(result, df, check_dtype=False)
+
+
+def test_check_auc_unchanged():
+    rng = np.random.default_rng(5)
+    X = rng.normal(size=(3000, 5)) * 1000
+    logits = 3 * X[:, 0] / 1000 - X[:, 1] / 1000
+    df = pd.DataFrame(X, columns=[f"sales_value_{i}" for i in range(5)])
+    df["target"] = (rng.uniform(size=len(df)) < 1 / (1 + np.exp(-logits))) * 1.0
+
+    auc, compact_auc = check_auc_unchanged(df, apply_dtype_schema(df))
+    assert auc > 0.7
+    # Deterministic: the same data gives the same AUC
+    assert check_auc_unchanged(df, df) == (auc, auc)
+
+    # Lossy compaction of the features is caught
+    lossy = df.round(-4).assign(target=df["target"])
+    with pytest.raises(ValueError, match="Compact dtypes"):
+        check_auc_unchanged(df, lossy)
@@ -0,0 +1,45 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import pytest
+import numpy as np
+import pandas as pd
+from src.recsys_retail.features.feature_index import UserItemFeatureIndex
+
+
+def sort_rows(df):
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+@pytest.fixture
+def user_item_features():
+    rng = np.random.default_rng(16)
+    return pd.DataFrame(
+        {
+            "user_id": rng.integers(0, 50, 1000),
+            "item_id": rng.integers(0, 30, 1000),
+            "feature": rng.normal(size=1000),
+        }
+    )
+
+
+@pytest.mark.parametrize("user_ids", [[3], [3, 7, 100], [100], []])
+def test_get_users(user_item_features, user_ids):
+    index = UserItemFeatureIndex(user_item_features)
+    expected = user_item_features[user_item_features["user_id"].isin(user_ids)]
+    pd.testing.assert_frame_equal(
+        sort_rows(index.get_users(user_ids)), sort_rows(expected)
+    )
+
+
+def test_get_pairs(user_item_features):
+    index = UserItemFeatureIndex(user_item_features)
+    pairs = pd.DataFrame({"user_id": [1, 1, 5, 60], "item_id": [2, 3, 4, 2]})
+    expected = user_item_features.merge(pairs, on=["user_id", "item_id"])
+    pd.testing.assert_frame_equal(
+        sort_rows(index.get_pairs(pairs["user_id"], pairs["item_id"])),
+        sort_rows(expected),
+    )
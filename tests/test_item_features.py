@@ -0,0 +1,53 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import numpy as np
+import pandas as pd
+from src.recsys_retail.features.item_features import (
+    encode_item_descriptions,
+    fit_description_encoder,
+    N_DESCRIPTION_COMPONENTS,
+)
+
+COMMODITIES = ["SOFT DRINKS", "BAKED BREAD/BUNS/ROLLS", "CHEESE", "FROZEN PIZZA"]
+SUB_COMMODITIES = ["12/18&15PK CAN CAR", "MAINSTREAM WHITE", "SHREDDED", "PREMIUM"]
+
+
+def test_encode_item_descriptions():
+    rng = np.random.default_rng(7)
+    n_items = 200
+    item_features = pd.DataFrame(
+        {
+            "item_id": np.arange(n_items),
+            "commodity_desc": rng.choice(COMMODITIES, n_items),
+            "sub_commodity_desc": [
+                f"{rng.choice(SUB_COMMODITIES)} {rng.choice(['DIET', 'LOW-FAT', 'SLICED', 'MIX'])} GROUP{i % 40}"
+                for i in range(n_items)
+            ],
+            "curr_size_of_product": rng.choice(["12 OZ", "16 OZ", "1 LB"], n_items),
+        }
+    ).set_index("item_id")
+
+    encoded = encode_item_descriptions(item_features)
+    assert encoded.shape == (n_items, N_DESCRIPTION_COMPONENTS)
+    assert (encoded.dtypes == np.float32).all()
+    assert encoded.index.equals(item_features.index)
+    assert (encoded.std() > 0).all()
+
+    # Unseen items are encoded with the encoder fitted on the others
+    encoder = fit_description_encoder(item_features.iloc[:150])
+    seen = encode_item_descriptions(item_features.iloc[:150], encoder=encoder)
+    unseen = encode_item_descriptions(item_features.iloc[150:], encoder=encoder)
+    pd.testing.assert_frame_equal(
+        pd.concat([seen, unseen]),
+        encode_item_descriptions(item_features, encoder=encoder),
+    )
+
+    # Items with the same description get the same encoding
+    same = item_features.iloc[[0]].rename(index={0: -1})
+    np.testing.assert_array_equal(
+        encode_item_descriptions(same, encoder=encoder).iloc[0], seen.iloc[0]
+    )
@@ -0,0 +1,146 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import pytest
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from src.recsys_retail.data.make_dataset import write_parquet_cache, read_parquet_cache
+from src.recsys_retail.data.lazy_dataset import scan_parquet_cache
+from src.recsys_retail.data.aggregate_states import (
+    AggregateStates,
+    StatefulTransactions,
+)
+from src.recsys_retail.features.prefilter import (
+    get_item_stats,
+    get_item_decisions,
+    apply_item_decisions,
+    get_item_mapping,
+    add_price,
+)
+from src.recsys_retail.features.new_item_user_features import get_user_item_features
+
+
+@pytest.fixture(scope="module")
+def cache(transactions, tmp_path_factory):
+    """
+    The sample in the Parquet cache: transactions read into memory
+    (pandas backend) and scanned lazily by week.
+    """
+
+    path = str(tmp_path_factory.mktemp("cache"))
+    write_parquet_cache(
+        path,
+        pa.Table.from_pandas(transactions, preserve_index=False),
+        pa.table({"PRODUCT_ID": [1000]}),
+        pa.table({"household_key": [1]}),
+    )
+
+    return read_parquet_cache(path)[0], scan_parquet_cache(path)
+
+
+def test_aggregate(cache):
+    data, lazy = cache
+    aggregations = dict(
+        n_rows=("item_id", "size"),
+        sales_value=("sales_value", "sum"),
+        first_day=("day", "min"),
+        last_day=("day", "max"),
+        n_weeks=("week_no", "nunique"),
+        n_stores=("store_id", "nunique"),
+        median_store=("store_id", "median"),
+    )
+
+    for keys in ["user_id", ["store_id", "trans_time"]]:
+        pd.testing.assert_frame_equal(
+            lazy.aggregate(keys, **aggregations),
+            data.groupby(keys).agg(**aggregations),
+        )
+
+
+def test_aggregate_batch(cache):
+    data, lazy = cache
+    requests = [
+        ("user_id", dict(n_rows=("item_id", "size"), last_day=("day", "max"))),
+        (
+            ["store_id", "trans_time"],
+            dict(n_users=("user_id", "nunique"), median_store=("store_id", "median")),
+        ),
+    ]
+    reads: list = []
+
+    results = lazy.map_partitions(_count_reads, reads).aggregate_batch(requests)
+
+    # All the aggregations are calculated in one pass
+    assert len(reads) == len(lazy.weeks)
+    for (keys, aggregations), result in zip(requests, results):
+        pd.testing.assert_frame_equal(result, data.groupby(keys).agg(**aggregations))
+
+
+def _count_reads(partition: pd.DataFrame, reads: list) -> pd.DataFrame:
+    reads.append(len(partition))
+    return partition
+
+
+def test_select(cache):
+    data, lazy = cache
+    weeks = lazy.select(10, 20)
+
+    assert weeks.weeks.tolist() == list(range(10, 20))
+    pd.testing.assert_frame_equal(
+        weeks.collect(),
+        data[data["week_no"].between(10, 19)].reset_index(drop=True),
+    )
+
+
+def test_prefilter_parity(cache):
+    data, lazy = cache
+    item_stats = get_item_stats(data)
+    lazy_item_stats = get_item_stats(lazy)
+
+    pd.testing.assert_frame_equal(lazy_item_stats.items, item_stats.items)
+    pd.testing.assert_frame_equal(
+        lazy_item_stats.item_users, item_stats.item_users, check_dtype=False
+    )
+    assert lazy_item_stats.last_week == item_stats.last_week
+
+    item_decisions = get_item_decisions(item_stats, None, take_n_popular=20)
+    pd.testing.assert_frame_equal(
+        apply_item_decisions(lazy, item_decisions).collect(),
+        apply_item_decisions(data, item_decisions).reset_index(drop=True),
+    )
+
+
+def test_get_user_item_features_parity(cache):
+    data, lazy = cache
+    features = get_user_item_features(data)
+    lazy_features = get_user_item_features(lazy)
+
+    for name, table in features._asdict().items():
+        # Sums are added up week by week in a different order
+        pd.testing.assert_frame_equal(
+            lazy_features._asdict()[name].replace(np.inf, np.nan),
+            table.replace(np.inf, np.nan),
+            rtol=1e-9,
+        )
+
+
+def test_stateful_parity(cache):
+    data, lazy = cache
+    item_decisions = get_item_decisions(get_item_stats(data), None, take_n_popular=20)
+    features = get_user_item_features(apply_item_decisions(data, item_decisions))
+    stateful_features = get_user_item_features(
+        StatefulTransactions(
+            lazy, AggregateStates(), item_ids=get_item_mapping(item_decisions)
+        ).map_partitions(add_price)
+    )
+
+    for name, table in features._asdict().items():
+        pd.testing.assert_frame_equal(
+            stateful_features._asdict()[name].replace(np.inf, np.nan),
+            table.replace(np.inf, np.nan),
+            rtol=1e-9,
+        )
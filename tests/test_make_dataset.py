@@ -0,0 +1,95 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import shutil
+import pytest
+import pandas as pd
+from src.recsys_retail.data.make_dataset import load_data
+
+
+@pytest.fixture(scope="module")
+def raw_paths(transactions, tmp_path_factory):
+    path = tmp_path_factory.mktemp("01_raw")
+    paths = [str(path / name) for name in ["train.csv", "items.csv", "users.csv"]]
+
+    # Weeks are out of order in the file
+    transactions.sample(frac=1, random_state=1).to_csv(paths[0], index=False)
+    pd.DataFrame(
+        {
+            "PRODUCT_ID": [1000, 1001, 1002],
+            "MANUFACTURER": [2, 69, 2],
+            "DEPARTMENT": ["GROCERY", "KIOSK", "GROCERY"],
+            "BRAND": ["National", "Private", "National"],
+            "COMMODITY_DESC": ["CHEESE", "BEEF", "CHEESE"],
+            "SUB_COMMODITY_DESC": ["SHREDDED CHEESE", "PRIMAL", "PREMIUM"],
+            "CURR_SIZE_OF_PRODUCT": ["12 OZ", "", "1 LB"],
+        }
+    ).to_csv(paths[1], index=False)
+    pd.DataFrame(
+        {
+            "AGE_DESC": ["65+", "45-54"],
+            "MARITAL_STATUS_CODE": ["A", "U"],
+            "INCOME_DESC": ["35-49K", "50-74K"],
+            "HOMEOWNER_DESC": ["Homeowner", "Unknown"],
+            "HH_COMP_DESC": ["2 Adults No Kids", "Single Female"],
+            "HOUSEHOLD_SIZE_DESC": ["2", "5+"],
+            "KID_CATEGORY_DESC": ["None/Unknown", "None/Unknown"],
+            "household_key": [1, 7],
+        }
+    ).to_csv(paths[2], index=False)
+
+    return paths
+
+
+def read_csv(data_path, item_path, user_path):
+    item_features = pd.read_csv(item_path).rename(columns=str.lower)
+    user_features = pd.read_csv(user_path).rename(columns=str.lower)
+
+    data = pd.read_csv(data_path).sort_values("week_no", kind="stable")
+
+    return (
+        data.reset_index(drop=True),
+        item_features.rename(columns={"product_id": "item_id"}),
+        user_features.rename(columns={"household_key": "user_id"}),
+    )
+
+
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_load_data(raw_paths, tmp_path, use_cache):
+    cache_path = str(tmp_path / "cache") if use_cache else None
+    expected = read_csv(*raw_paths)
+
+    for _ in range(2 if use_cache else 1):
+        loaded = load_data(*raw_paths, cache_path=cache_path)
+        for df, expected_df in zip(loaded, expected):
+            pd.testing.assert_frame_equal(
+                df, expected_df, check_dtype=False, check_categorical=False
+            )
+
+    data, item_features, user_features = loaded
+    assert data["user_id"].dtype == "int32" and data["day"].dtype == "int16"
+    assert data["sales_value"].dtype == "float32"
+    assert item_features["department"].dtype == "category"
+    assert user_features["age_desc"].dtype == "category"
+    if use_cache:
+        assert os.path.exists(os.path.join(cache_path, "transactions", "week_no=1"))
+
+
+def test_load_data_stale_cache(raw_paths, tmp_path):
+    paths = [str(tmp_path / os.path.basename(path)) for path in raw_paths]
+    for path, raw_path in zip(paths, raw_paths):
+        shutil.copy(raw_path, path)
+    cache_path = str(tmp_path / "cache")
+    load_data(*paths, cache_path=cache_path)
+
+    # The cache is rebuilt when a source file changes
+    pd.read_csv(paths[0]).head(100).to_csv(paths[0], index=False)
+    data = load_data(*paths, cache_path=cache_path)[0]
+
+    pd.testing.assert_frame_equal(data, read_csv(*paths)[0], check_dtype=False)
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["cache"] + [os.path.basename(path) for path in paths]
+    )
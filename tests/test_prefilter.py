@@ -0,0 +1,105 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import pytest
+import numpy as np
+import pandas as pd
+from src.recsys_retail.features.prefilter import (
+    prefilter_items,
+    get_item_stats,
+    update_item_stats,
+    get_item_decisions,
+    apply_item_decisions,
+)
+from src.recsys_retail.models.save_artifacts import save_item_decisions
+from src.recsys_retail.models.load_artifacts import (
+    load_item_decisions,
+    load_item_stats,
+)
+from tests.reference import prefilter_items_legacy
+
+
+@pytest.fixture(scope="module")
+def item_features(transactions):
+    """Large department with all the items but a few ones from a small department"""
+
+    item_ids = np.arange(1000, 1300)
+    return pd.DataFrame(
+        {
+            "item_id": item_ids,
+            "department": np.where(item_ids % 40 == 7, "KIOSK", "GROCERY"),
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {},
+        {"take_n_popular": 20},
+        {"lower_price_threshold": 5, "upper_price_threshold": 15},
+    ],
+)
+def test_prefilter_items(transactions, item_features, params):
+    # Items which have not been sold for the last 12 months
+    data = transactions.copy()
+    data.loc[data["item_id"] % 17 == 3, "day"] = 5
+
+    result = prefilter_items(data, item_features, **params)
+    expected = prefilter_items_legacy(data, item_features, **params)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert (result["item_id"] == 999999).any() == ("take_n_popular" in params)
+
+
+def test_update_item_stats(transactions, item_features):
+    item_stats = get_item_stats(transactions[transactions["week_no"] <= 40])
+    item_stats = update_item_stats(item_stats, transactions)
+    expected = get_item_stats(transactions)
+
+    assert item_stats.last_week == expected.last_week == 60
+    pd.testing.assert_frame_equal(item_stats.items, expected.items)
+    pd.testing.assert_frame_equal(
+        item_stats.item_users.reset_index(drop=True), expected.item_users
+    )
+
+    item_decisions = get_item_decisions(item_stats, item_features, take_n_popular=20)
+    pd.testing.assert_frame_equal(
+        apply_item_decisions(transactions, item_decisions),
+        prefilter_items(transactions, item_features, take_n_popular=20),
+    )
+    assert set(item_decisions["decision"]) == {"keep", "replace", "drop"}
+    assert (item_decisions["decision"] == "keep").sum() == 20
+
+
+def test_save_load_item_decisions(transactions, item_features, tmp_path):
+    path = str(tmp_path) + "/"
+    for last_week in [30, 60]:
+        item_stats = get_item_stats(transactions[transactions["week_no"] <= last_week])
+        item_decisions = get_item_decisions(item_stats, item_features)
+        save_item_decisions(
+            item_decisions,
+            item_stats,
+            item_decisions_path=path + "item_decisions_v{version}.parquet",
+            item_stats_path=path + "item_stats_v{version}.parquet",
+            item_users_path=path + "item_users_v{version}.parquet",
+        )
+
+    loaded = load_item_decisions(
+        item_decisions_path=path + "item_decisions_v{version}.parquet"
+    )
+    assert loaded.attrs["version"] == 60
+    pd.testing.assert_frame_equal(loaded, item_decisions)
+
+    loaded_stats = load_item_stats(
+        version=30,
+        item_stats_path=path + "item_stats_v{version}.parquet",
+        item_users_path=path + "item_users_v{version}.parquet",
+    )
+    assert loaded_stats.last_week == 30
+    pd.testing.assert_frame_equal(
+        update_item_stats(loaded_stats, transactions).items, item_stats.items
+    )
@@ -0,0 +1,149 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import pytest
+import numpy as np
+from src.recsys_retail.features.recommenders import IdMapping, MainRecommender
+
+
+N = 20
+
+
+@pytest.fixture(scope="module")
+def recommender(transactions):
+    return MainRecommender(transactions, n_factors_ALS=8, iterations_ALS=5)
+
+
+@pytest.mark.parametrize("model_name", ["model", "own_recommender"])
+def test_recommend_batch(recommender, transactions, model_name):
+    model = getattr(recommender, model_name)
+    user_ids = transactions["user_id"].unique()[:10]
+    item_ids, scores = recommender.recommend_batch(user_ids, N=N, model=model)
+
+    assert item_ids.shape == scores.shape == (len(user_ids), N)
+    for user_id, recs in zip(user_ids, item_ids):
+        user_idx = recommender.user_mapping.encode(user_id)
+        ids, _ = model.recommend(
+            user_idx,
+            recommender.user_item_matrix[user_idx],
+            N=N,
+            filter_already_liked_items=False,
+            recalculate_user=True,
+        )
+        expected = recommender.item_mapping.decode(ids).tolist()
+        expected = (expected + recommender.overall_top_purchases)[:N]
+        assert recs.tolist() == expected
+
+
+def test_recommend_batch_unknown_user(recommender):
+    item_ids, scores = recommender.recommend_batch([-1], N=N)
+    assert item_ids[0].tolist() == recommender.overall_top_purchases[:N]
+    assert np.isnan(scores).all()
+
+
+def test_id_mapping():
+    ids = np.array([30, 10, 20])
+    mapping = IdMapping(ids)
+    assert mapping.encode([20, 30, 40]).tolist() == [2, 0, -1]
+    assert mapping.decode([2, 0]).tolist() == [20, 30]
+    assert 10 in mapping and 40 not in mapping
+
+
+def test_recommend_batch_cold_start(transactions):
+    recommender = MainRecommender(
+        transactions, weighting=False, n_factors_ALS=8, iterations_ALS=5
+    ).freeze()
+    user_id = transactions["user_id"].iloc[0]
+    recent_purchases = transactions[transactions["user_id"] == user_id].assign(
+        user_id=-1
+    )
+    n_users = len(recommender.user_mapping)
+
+    for model in [recommender.model, recommender.own_recommender]:
+        item_ids, _ = recommender.recommend_batch(
+            [user_id, -1, -2], N=N, model=model, recent_purchases=recent_purchases
+        )
+        assert item_ids[1].tolist() == item_ids[0].tolist()
+        assert item_ids[2].tolist() == recommender.overall_top_purchases[:N]
+
+    assert len(recommender.user_mapping) == n_users
+    with pytest.raises(ValueError):
+        recommender.user_mapping.ids[0] = -1
+
+
+def test_fold_in(recommender, transactions):
+    model = recommender.model
+    user_ids = transactions["user_id"].unique()[:5]
+    user_items = recommender._get_user_items(user_ids, transactions)
+    user_factors = recommender.fold_in(user_items)
+
+    Y = model.item_factors.astype(np.float64)
+    for user_factor, row in zip(user_factors, user_items.toarray() * model.alpha):
+        A = Y.T @ Y + model.regularization * np.eye(Y.shape[1])
+        A += Y.T @ (np.where(row > 0, row - 1, 0)[:, None] * Y)
+        expected = np.linalg.solve(A, Y.T @ row)
+        assert np.allclose(user_factor, expected, rtol=1e-4, atol=1e-4)
+
+    # Batches of users give the same factors
+    np.testing.assert_array_equal(
+        recommender.fold_in(user_items, batch_size=2), user_factors
+    )
+    assert recommender.fold_in(user_items[:0]).shape == (0, Y.shape[1])
+
+    item_ids, scores = recommender.recommend_fold_in(
+        np.append(user_ids, -1), transactions, N=N
+    )
+    assert item_ids.shape == (len(user_ids) + 1, N)
+    assert np.allclose(scores[:-1], np.sort(user_factors @ Y.T, axis=1)[:, ::-1][:, :N])
+    assert item_ids[-1].tolist() == recommender.overall_top_purchases[:N]
+
+
+def test_similar_items_recommend_batch(recommender, transactions):
+    user_ids = np.append(transactions["user_id"].unique()[:20], -1)
+    item_ids = recommender.similar_items_recommend_batch(user_ids, N=N)
+
+    top_purchases = recommender.top_purchases
+    for user_id, recs in zip(user_ids, item_ids):
+        expected = [
+            recommender.item_mapping.decode(
+                recommender.model.similar_items(
+                    recommender.item_mapping.encode(item_id), N=2
+                )[0][1]
+            )
+            for item_id in top_purchases[top_purchases["user_id"] == user_id]
+            .head(N)["item_id"]
+            .tolist()
+        ]
+        expected = (expected + recommender.overall_top_purchases[:N])[:N]
+        assert recs.tolist() == expected
+
+
+def test_similar_items_recommend_batch_no_neighbour(
+    recommender, transactions, monkeypatch
+):
+    user_id = transactions["user_id"].iloc[0]
+    top_purchases = recommender.top_purchases
+    bought = top_purchases[top_purchases["user_id"] == user_id].head(N)["item_id"]
+    similar_items_batch = recommender.similar_items_batch
+
+    # The first purchase has no neighbour but itself (as in a sparse IVF list)
+    def without_neighbour(item_ids, N=5, n_probe=None):
+        ids, scores = similar_items_batch(item_ids, N=N, n_probe=n_probe)
+        lonely = np.asarray(item_ids) == bought.iloc[0]
+        ids[lonely, 1:], scores[lonely, 1:] = -1, np.nan
+        return ids, scores
+
+    monkeypatch.setattr(recommender, "similar_items_batch", without_neighbour)
+    item_ids, scores = recommender.similar_items_recommend_scores([user_id], N=N)
+
+    n_similar = len(bought) - 1
+    assert (item_ids >= 0).all()
+    assert not np.isnan(scores[0, :n_similar]).any()
+    assert np.isnan(scores[0, n_similar:]).all()
+    assert (
+        item_ids[0, n_similar:].tolist()
+        == recommender.overall_top_purchases[: N - n_similar]
+    )
@@ -0,0 +1,66 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import numpy as np
+import pandas as pd
+from src.recsys_retail.features.recommenders import MainRecommender
+from src.recsys_retail.features.candidates_lvl_2 import RETRIEVER_FEATURES
+from src.recsys_retail.features.new_item_user_features import (
+    get_user_item_features,
+    get_embeddings,
+    add_embeddings,
+)
+from src.recsys_retail.features.targets import get_targets_lvl_2
+
+
+def test_get_targets_lvl_2(transactions):
+    data_train = transactions[transactions["week_no"] <= 50]
+    data_valid = transactions[transactions["week_no"] > 50]
+    recommender = MainRecommender(data_train, n_factors_ALS=8, iterations_ALS=5)
+    embeddings = get_embeddings(recommender)
+    user_item_features = get_user_item_features(data_train)
+
+    rng = np.random.default_rng(3)
+    candidates = data_valid[["user_id", "item_id"]].sample(500, random_state=3)
+    # A new user, a new item and repeated pairs
+    candidates.iloc[:3] = [[100000, 1000], [1, 999999], [1, 999999]]
+    for name in RETRIEVER_FEATURES:
+        values = rng.uniform(size=len(candidates)).astype(np.float32)
+        candidates[name] = np.where(values < 0.3, np.nan, values)
+
+    item_features = pd.DataFrame(
+        {"item_id": np.arange(1000, 1100), "brand": np.arange(100) % 3}
+    ).set_index("item_id")
+    user_features = pd.DataFrame(
+        {"user_id": np.arange(1, 150), "age": np.arange(1, 150) * 0.5}
+    )
+
+    result = get_targets_lvl_2(
+        candidates,
+        data_valid,
+        item_features,
+        user_features,
+        user_item_features,
+        embeddings=embeddings,
+    )
+
+    expected = candidates.drop_duplicates(["user_id", "item_id"])
+    targets = data_valid[["user_id", "item_id"]].drop_duplicates()
+    targets["target"] = 1
+    expected = expected.merge(targets, on=["user_id", "item_id"], how="left")
+    expected["target"].fillna(0, inplace=True)
+    expected = expected.merge(item_features, on="item_id", how="left")
+    expected = expected.merge(user_features, on="user_id", how="left")
+    expected = expected.merge(user_item_features.items, on="item_id", how="left")
+    expected = expected.merge(user_item_features.users, on="user_id", how="left")
+    expected = expected.merge(
+        user_item_features.user_items, on=["user_id", "item_id"], how="left"
+    )
+    expected = add_embeddings(expected, embeddings)
+
+    assert (result.dtypes.iloc[2:] == np.float32).all()
+    assert result["target"].sum() > 0
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, rtol=1e-6)
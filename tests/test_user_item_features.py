@@ -0,0 +1,90 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), ".."))
+
+import pytest
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from src.recsys_retail.features.recommenders import MainRecommender
+from src.recsys_retail.features.new_item_user_features import (
+    get_user_item_features,
+    get_embeddings,
+    add_embeddings,
+)
+from tests.reference import encode_transactions_legacy
+
+
+@pytest.fixture(scope="module")
+def recommender(transactions):
+    return MainRecommender(transactions, n_factors_ALS=8, iterations_ALS=5)
+
+
+def test_get_user_item_features(transactions):
+    features = get_user_item_features(transactions)
+    encoded = encode_transactions_legacy(transactions)
+
+    # One row per user-item pair with the means of its transactions
+    user_items = features.user_items
+    expected = (
+        encoded.groupby(["user_id", "item_id"])[user_items.columns[2:]]
+        .mean()
+        .reset_index()
+    )
+    # Compensated grouped mean of pandas may turn infinite ratios into nan
+    pd.testing.assert_frame_equal(
+        user_items.replace(np.inf, np.nan),
+        expected.replace(np.inf, np.nan),
+        check_dtype=False,
+        rtol=1e-5,
+    )
+
+    # Tables of a single key have the values of its transactions
+    for table, key in [
+        (features.users, "user_id"),
+        (features.items, "item_id"),
+        (features.stores, "store_id"),
+        (features.weeks, "week_no"),
+        (features.weekdays, "weekday"),
+        (features.trans_times, "trans_time"),
+    ]:
+        expected = encoded.groupby(key, as_index=False)[table.columns[1:]].first()
+        pd.testing.assert_frame_equal(table, expected, check_dtype=False)
+
+
+def test_add_embeddings(recommender):
+    embeddings = get_embeddings(recommender)
+    user_id = recommender.user_mapping.ids[3]
+    item_id = recommender.item_mapping.ids[5]
+    df = pd.DataFrame({"user_id": [user_id, -1], "item_id": [-1, item_id]})
+
+    result = add_embeddings(df, embeddings)
+
+    factors = recommender.model.item_factors
+    assert result.filter(like="user_factor_").shape[1] == factors.shape[1]
+    assert result["factor_1"].dtype == np.float32
+    np.testing.assert_array_equal(result.filter(regex="^factor_").iloc[1], factors[5])
+    np.testing.assert_array_equal(
+        result.filter(like="user_factor_").iloc[0], recommender.model.user_factors[3]
+    )
+    assert result.filter(regex="^factor_").iloc[0].isna().all()
+    assert result.filter(like="user_factor_").iloc[1].isna().all()
+
+
+def test_get_user_item_features_in_pool(transactions):
+    expected = get_user_item_features(transactions, n_workers=1)
+    result = get_user_item_features(transactions, n_workers=3)
+
+    for table, expected_table in zip(result, expected):
+        pd.testing.assert_frame_equal(table, expected_table)
+
+
+def test_get_embeddings_mismatch(recommender):
+    model = SimpleNamespace(
+        item_factors=recommender.model.item_factors,
+        user_factors=recommender.model.user_factors[:-1],
+    )
+    with pytest.raises(ValueError, match="user factors"):
+        get_embeddings(SimpleNamespace(**{**vars(recommender), "model": model}))